@@ -96,6 +96,38 @@ def create_argparser(rastertools_parsers):
         help="Distance to the mean value (in sigma) in order to produce a raster "
              "that highlights outliers.")
 
+    # argument group for the computation of large geometries
+    streaming_pc = parser.add_argument_group("Options to compute stats of large geometries")
+    streaming_pc.add_argument(
+        '--streaming',
+        dest="streaming",
+        action="store_true",
+        help="Read the raster block by block so that memory does not depend on the extent "
+             "of the geometries. Median, percentiles and mad are computed from histograms. "
+             "Stats majority, minority, unique and categorical option are not available.")
+    streaming_pc.add_argument(
+        '--bins',
+        dest="bins",
+        type=int,
+        help="Number of bins of the histograms in streaming mode (default: 1024)")
+    streaming_pc.add_argument(
+        '--accuracy',
+        dest="accuracy",
+        type=float,
+        help="Relative accuracy of the quantile sketches used instead of the histograms in "
+             "streaming mode. Median, percentiles and mad are then computed in a single "
+             "pass with a relative error lower than the accuracy (e.g. 0.01)")
+
+    # argument group for the computation of a stack of rasters
+    stack_pc = parser.add_argument_group("Options to compute stats of a stack of rasters")
+    stack_pc.add_argument(
+        '--stack',
+        dest="stack",
+        action="store_true",
+        help="Read the input rasters together (they must have the same grid) and write "
+             "the stats of all the rasters in a single CSV table with the columns zone, "
+             "date, band, stat and value. Outliers and stats per category are not available.")
+
     # argument group for generating stats charts
     chart_pc = parser.add_argument_group('Options to plot the generated stats')
     chart_pc.add_argument(
@@ -176,6 +208,8 @@ def create_zonalstats(args) -> Zonalstats:
     tool.with_output(args.output, args.output_format) \
         .with_geometries(args.geometries, args.within) \
         .with_outliers(args.sigma) \
+        .with_streaming(args.streaming, args.bins, args.accuracy) \
+        .with_stack(args.stack) \
         .with_chart(args.chartfile, args.geom_index, args.display) \
         .with_per_category(args.category_file, args.category_index, args.category_names)
 
@@ -74,7 +74,7 @@ class Filtering(Rastertool, Windowable):
         tool.process_file("./mytif.tif")
     """
     median_filter = RasterFilter(
-        "median", algo=algo.median
+        "median", algo=algo.median, executor="threads"
     ).with_documentation(
         help="Apply median filter",
         description="Apply a median filter (see scipy median_filter for more information)"
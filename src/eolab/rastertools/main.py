@@ -119,7 +119,10 @@ def add_custom_rastertypes(rastertypes):
         the bands_pattern.
       * description (optional): mask band description that will be reused in the generated products.
       * maskfunc (optional): fully qualified name of the python function that converts the mask
-        band values to a binary mask (0 = masked; 1 = unmasked)
+        band values to a binary mask (0 = masked; 1 = unmasked). The VRT pixel functions in
+        python require the GDAL configuration option GDAL_VRT_ENABLE_PYTHON=YES, except the
+        built-in functions that are evaluated natively by GDAL (e.g.
+        eolab.rastertools.product.s2_maja_mask).
 
     Args:
         rastertypes: JSON string that contains the new raster types definition
@@ -158,6 +161,27 @@ def run_tool(args):
         help="Maximum number of workers for parallel processing. If not given, it will default to "
              "the number of processors on the machine. When all processors are not allocated to "
              "run rastertools, it is thus recommended to set this option.")
+    parser.add_argument(
+        '--executor',
+        dest="executor",
+        choices=["serial", "threads", "processes"],
+        help="Backend used to process the windows in parallel. If not given, every tool uses "
+             "the backend that best suits its algorithm: threads for algorithms that release "
+             "the GIL, processes otherwise.")
+    parser.add_argument(
+        '--cachedir',
+        dest="cachedir",
+        help="Dir of a persistent cache of the VRT images generated when handling the input "
+             "files that are raster products (archives or dirs) and of the list of the files "
+             "in the archives. They are reused by the next runs on the same products and "
+             "removed when unused for RASTERTOOLS_CACHEMAXAGE days (default 30).")
+    parser.add_argument(
+        '--scratchdir',
+        dest="scratchdir",
+        help="Dir where the JPEG2000 files of the input raster products are transcoded to "
+             "tiled GeoTIFFs that are faster to read. The least recently used files are "
+             "removed when the size of the dir exceeds RASTERTOOLS_SCRATCHSIZE MB "
+             "(default 10240).")
     parser.add_argument(
         '--debug',
         dest="keep_vrt",
@@ -212,6 +236,15 @@ def run_tool(args):
     if "RASTERTOOLS_MAXWORKERS" not in os.environ and args.max_workers is not None:
         os.environ["RASTERTOOLS_MAXWORKERS"] = f"{args.max_workers}"
 
+    if "RASTERTOOLS_EXECUTOR" not in os.environ and args.executor is not None:
+        os.environ["RASTERTOOLS_EXECUTOR"] = args.executor
+
+    if "RASTERTOOLS_CACHEDIR" not in os.environ and args.cachedir is not None:
+        os.environ["RASTERTOOLS_CACHEDIR"] = args.cachedir
+
+    if "RASTERTOOLS_SCRATCHDIR" not in os.environ and args.scratchdir is not None:
+        os.environ["RASTERTOOLS_SCRATCHDIR"] = args.scratchdir
+
     # handle rastertype option
     if args.rastertype:
         with open(args.rastertype) as json_content:
@@ -247,27 +247,57 @@ def interpolated_timeseries(dates, series, output_dates, nodata):
     # stacked input data: shape is time x band x height x width
     stack = ma.stack(series)
     stack_shape = stack.shape
-    # flatten the stacked data: shape is pixel x time
-    pixel_series = stack.transpose((1, 2, 3, 0)).reshape(
-        stack_shape[1] * stack_shape[2] * stack_shape[3], -1)
-
-    output = []
-    for serie in pixel_series:
-        compressed = serie.compressed()
-        if serie.count() > 1:
-            output.append(np.interp(
-                output_dates,
-                ma.masked_array(dates, serie.mask).compressed(),
-                compressed,
-                compressed[0],
-                compressed[-1]))
-        else:
-            default_val = serie.sum() if serie.count() > 0 else nodata
-            output.append([default_val] * len(output_dates))
-
-    output = np.array(output)
-    return output.transpose(1, 0).reshape(
-        -1, stack_shape[1], stack_shape[2], stack_shape[3])
+    ntimes = stack_shape[0]
+    # flatten the stacked data: shape is time x pixel
+    values = ma.getdata(stack).reshape(ntimes, -1).astype(np.float64)
+    valid = ~ma.getmaskarray(stack).reshape(ntimes, -1)
+    npixels = values.shape[1]
+    pixels = np.arange(npixels)
+
+    dates = np.asarray(dates, dtype=np.float64)
+    output_dates = np.asarray(output_dates, dtype=np.float64)
+
+    # for every date and every pixel, index of the last valid date before or at
+    # this date (-1 if none) and index of the first valid date at or after this
+    # date (ntimes if none)
+    indexes = np.arange(ntimes)[:, np.newaxis]
+    last_valid = np.maximum.accumulate(np.where(valid, indexes, -1), axis=0)
+    next_valid = np.minimum.accumulate(np.where(valid, indexes, ntimes)[::-1], axis=0)[::-1]
+    first_value = values[np.minimum(next_valid[0], ntimes - 1), pixels]
+
+    # index of the last input date before or at every output date
+    positions = np.searchsorted(dates, output_dates, side="right") - 1
+
+    output = np.empty((len(output_dates), npixels))
+    for i, (date, position) in enumerate(zip(output_dates, positions)):
+        before = last_valid[position] if position >= 0 else np.full(npixels, -1)
+        after = next_valid[position + 1] if position + 1 < ntimes else np.full(npixels, ntimes)
+        value_before = values[np.maximum(before, 0), pixels]
+        value_after = values[np.minimum(after, ntimes - 1), pixels]
+        date_before = dates[np.maximum(before, 0)]
+        date_after = dates[np.minimum(after, ntimes - 1)]
+
+        # linear interpolation computed like numpy.interp
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slope = (value_after - value_before) / (date_after - date_before)
+            result = slope * (date - date_before) + value_before
+            nan = np.isnan(result)
+            result[nan] = (slope * (date - date_after) + value_after)[nan]
+            nan = np.isnan(result) & (value_before == value_after)
+            result[nan] = value_before[nan]
+
+        # constant extrapolation before the first valid date and after the last one
+        result = np.where(before < 0, first_value, result)
+        result = np.where((before >= 0) & ((after >= ntimes) | (date_before == date)),
+                          value_before, result)
+        output[i] = result
+
+    # pixels with a single valid date are constant, pixels without valid date are nodata
+    count = valid.sum(axis=0)
+    output[:, count == 1] = first_value[count == 1]
+    output[:, count == 0] = nodata
+
+    return output.reshape(-1, stack_shape[1], stack_shape[2], stack_shape[3])
 
 
 def _local_sum(data: np.ndarray, kernel_width: int):
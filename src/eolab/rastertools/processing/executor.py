@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This module defines the execution backends that distribute the processing of the
+windows of a raster over several workers. Three backends are available:
+
+- serial: windows are processed one after the other in the calling thread
+- threads: windows are processed by a pool of threads. It is the best choice for
+  algorithms that release the GIL (numpy, scipy.ndimage...) since data are not pickled
+- processes: windows are processed by a pool of processes. It is the best choice for
+  algorithms that are mainly written in pure python.
+
+The backend can be set for the whole run with the environment variable
+RASTERTOOLS_EXECUTOR (see option --executor of the command line) and the number of
+workers with the environment variable RASTERTOOLS_MAXWORKERS (see option --max_workers).
+
+The results are consumed with :func:`imap` that bounds the number of pending tasks, and
+the resources opened by the initializer of a worker are registered with
+:func:`close_at_shutdown` to be closed when the executor shuts down.
+"""
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing.util
+import os
+import threading
+
+
+SERIAL = "serial"
+"""Backend that processes the windows in the calling thread"""
+
+THREADS = "threads"
+"""Backend that processes the windows in a pool of threads"""
+
+PROCESSES = "processes"
+"""Backend that processes the windows in a pool of processes"""
+
+EXECUTORS = [SERIAL, THREADS, PROCESSES]
+"""List of the available backends"""
+
+_initializing = threading.local()
+"""Resources registered by the initializer running in the current thread"""
+
+
+class SerialExecutor(Executor):
+    """Executor that runs the tasks in the calling thread. It has the same interface
+    as the executors of concurrent.futures.
+    """
+
+    def __init__(self, initializer=None, initargs=()):
+        """Constructor
+
+        Args:
+            initializer (Callable, optional, default=None):
+                Function called once before running the tasks
+            initargs (tuple, optional, default=()):
+                Arguments passed to the initializer
+        """
+        self._max_workers = 1
+        self._resources = []
+        if initializer is not None:
+            _initialize(self._resources, initializer, initargs)
+
+    def submit(self, fn, *args, **kwargs):
+        """Run the task and return a completed future"""
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as err:
+            future.set_exception(err)
+        return future
+
+    def map(self, fn, *iterables, timeout=None, chunksize=1):
+        """Lazily run the tasks: a task is run when its result is requested"""
+        return map(fn, *iterables)
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        """Close the resources opened by the initializer"""
+        _close(self._resources)
+
+
+class _ThreadPoolExecutor(ThreadPoolExecutor):
+    """Pool of threads that closes the resources opened by the initializer of its
+    workers when it shuts down."""
+
+    def __init__(self, max_workers=None, initializer=None, initargs=()):
+        self._resources = []
+        if initializer is not None:
+            initargs = (self._resources, initializer, initargs)
+            initializer = _initialize
+        super().__init__(max_workers=max_workers, initializer=initializer, initargs=initargs)
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        """Wait for the workers, then close the resources opened by their initializer"""
+        super().shutdown(wait=wait, cancel_futures=cancel_futures)
+        if wait:
+            _close(self._resources)
+
+
+def _initialize(resources: list, initializer, initargs, at_exit: bool = False):
+    """Run the initializer of a worker and add the resources it registers (see
+    close_at_shutdown) to the list of resources. When the worker is a process, the
+    resources are closed when the process exits."""
+    _initializing.resources = resources
+    try:
+        initializer(*initargs)
+    finally:
+        del _initializing.resources
+    if at_exit:
+        multiprocessing.util.Finalize(None, _close, args=(resources,), exitpriority=0)
+
+
+def _close(resources: list):
+    """Close the resources in the reverse order of their registration"""
+    while resources:
+        resources.pop().close()
+
+
+def close_at_shutdown(resource):
+    """Register a resource opened by the initializer of a worker (e.g. a dataset
+    stored in a threading.local()) so that it is closed when the executor shuts down.
+
+    Args:
+        resource:
+            Resource to close, it shall have a close() method
+
+    Returns:
+        the resource
+    """
+    resources = getattr(_initializing, "resources", None)
+    if resources is None:
+        raise RuntimeError("Resources can only be registered by the initializer of a worker")
+    resources.append(resource)
+    return resource
+
+
+def imap(executor: Executor, fn, iterable, max_pending: int = None):
+    """Lazily run the function on every item of the iterable and generate the results
+    in the order of the items. Contrary to Executor.map that submits all the tasks at
+    once, a task is submitted when the result of a previous one is consumed: no more
+    than max_pending results are kept in memory when the caller (e.g. the writer of
+    the outputs) is slower than the workers, and the outputs are still written in the
+    order of the windows.
+
+    Args:
+        executor (concurrent.futures.Executor):
+            Executor that runs the tasks
+        fn (Callable):
+            Function called on every item
+        iterable (Iterable):
+            Items to process
+        max_pending (int, optional, default=None):
+            Maximum number of tasks submitted and not consumed yet, twice the number
+            of workers of the executor if not set
+
+    Returns:
+        A generator of the results
+    """
+    if max_pending is None:
+        max_pending = 2 * (getattr(executor, "_max_workers", None) or 1)
+    pending = deque()
+    try:
+        for item in iterable:
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+            pending.append(executor.submit(fn, item))
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # the caller stopped consuming the results
+        for future in pending:
+            future.cancel()
+
+
+def get_executor_type(default: str = PROCESSES) -> str:
+    """Get the backend to use. The backend defined by the environment variable
+    RASTERTOOLS_EXECUTOR has the priority over the default one.
+
+    Args:
+        default (str, optional, default="processes"):
+            Backend to use when the environment variable is not set
+
+    Returns:
+        str: one of "serial", "threads" or "processes"
+    """
+    executor_type = os.getenv("RASTERTOOLS_EXECUTOR") or default or PROCESSES
+    if executor_type not in EXECUTORS:
+        raise ValueError(f"Invalid executor {executor_type}: must be one of {EXECUTORS}")
+    return executor_type
+
+
+def get_max_workers() -> int:
+    """Get the maximum number of workers defined by the environment variable
+    RASTERTOOLS_MAXWORKERS
+
+    Returns:
+        int: the maximum number of workers or None if not set
+    """
+    max_workers = os.getenv("RASTERTOOLS_MAXWORKERS")
+    return int(max_workers) if max_workers is not None else None
+
+
+def create_executor(default: str = PROCESSES, initializer=None, initargs=()) -> Executor:
+    """Create the executor that runs the tasks.
+
+    Every worker of the executor is initialized by the initializer: it is the right
+    place to open the datasets once per worker. The state of the worker shall be
+    stored in a threading.local() so that it is not shared between threads when the
+    backend is "threads", and the datasets shall be registered with close_at_shutdown
+    so that they are closed when the executor shuts down.
+
+    Args:
+        default (str, optional, default="processes"):
+            Backend to use when the environment variable RASTERTOOLS_EXECUTOR is not set
+        initializer (Callable, optional, default=None):
+            Function called once by every worker
+        initargs (tuple, optional, default=()):
+            Arguments passed to the initializer
+
+    Returns:
+        concurrent.futures.Executor: the executor
+    """
+    executor_type = get_executor_type(default)
+    if executor_type == SERIAL:
+        executor = SerialExecutor(initializer=initializer, initargs=initargs)
+    elif executor_type == THREADS:
+        executor = _ThreadPoolExecutor(max_workers=get_max_workers(),
+                                       initializer=initializer, initargs=initargs)
+    else:
+        if initializer is not None:
+            # the resources are closed by the worker processes when they exit
+            initargs = ([], initializer, initargs, True)
+            initializer = _initialize
+        executor = ProcessPoolExecutor(max_workers=get_max_workers(),
+                                       initializer=initializer, initargs=initargs)
+    return executor
@@ -22,7 +22,8 @@ class RasterProcessing:
                  in_dtype: np.dtype = None,
                  compress: str = None,
                  nbits: int = False,
-                 per_band_algo: bool = False):
+                 per_band_algo: bool = False,
+                 executor: str = None):
         """Constructor
 
         Args:
@@ -49,6 +50,10 @@ class RasterProcessing:
             per_band_algo (bool, optional, default=False):
                 Whether the algo is applied on a dataset that contains only one band
                 (per_band_algo=True) or on a dataset with all bands (per_band_algo=False)
+            executor (str, optional, default=None):
+                Backend used to distribute the computation of the windows: "serial",
+                "threads" or "processes". When None, windows are computed by processes.
+                Prefer "threads" for algorithms that release the GIL.
         """
         self._name = name
         self._algo = algo
@@ -58,6 +63,7 @@ class RasterProcessing:
         self._in_dtype = in_dtype
         self._compress = compress
         self._nbits = nbits
+        self._executor = executor
         self._arguments = dict()
 
     def __repr__(self) -> str:
@@ -104,6 +110,11 @@ class RasterProcessing:
         """bits size of the generated data"""
         return self._nbits
 
+    @property
+    def executor(self) -> str:
+        """Backend used to distribute the computation of the windows"""
+        return self._executor
+
     @property
     def description(self):
         """Long description of the processing"""
@@ -235,11 +246,13 @@ class RasterFilter(RasterProcessing):
                  algo: Callable = None,
                  nodata: float = -2.0,
                  dtype: np.dtype = np.float32,
-                 per_band_algo: bool = False):
+                 per_band_algo: bool = False,
+                 executor: str = None):
         """Constructor. See documentation of RasterProcessing.__init__ for
         the description of input arguments.
         """
-        super().__init__(name, algo=algo, nodata=nodata, dtype=dtype, per_band_algo=per_band_algo)
+        super().__init__(name, algo=algo, nodata=nodata, dtype=dtype,
+                         per_band_algo=per_band_algo, executor=executor)
 
         # kernel size of the filter
         self._kernel_size = 8
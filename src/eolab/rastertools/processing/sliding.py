@@ -3,25 +3,28 @@
 """
 This module defines a method to run a RasterProcessing on sliding windows.
 """
-from itertools import repeat
 import logging
 import logging.config
 import os
+import threading
 from typing import List
-import multiprocessing
 
 import numpy as np
 import numpy.ma as ma
 import rasterio
 from rasterio.windows import Window
-from tqdm.contrib.concurrent import process_map
+from tqdm import tqdm
 
 from eolab.rastertools import utils
 from eolab.rastertools.processing import RasterProcessing
+from eolab.rastertools.processing.executor import close_at_shutdown, create_executor, imap
 
 
 _logger = logging.getLogger(__name__)
 
+# Context of a worker: input dataset opened once and processing configuration
+_worker = threading.local()
+
 
 def compute_sliding(input_image: str, output_image: str, rasterprocessing: RasterProcessing,
                     window_size: tuple = (1024, 1024), window_overlap: int = 0,
@@ -74,10 +77,6 @@ def compute_sliding(input_image: str, output_image: str, rasterprocessing: Raste
                            tiled=True, dtype=dtype, nbits=nbits, compress=compress,
                            nodata=nodata, count=len(bands))
 
-            with rasterio.open(output_image, "w", **profile):
-                # file is created
-                pass
-
             # create the generator of sliding windows
             sliding_gen = _sliding_windows((src.width, src.height),
                                            window_size, window_overlap)
@@ -87,61 +86,66 @@ def compute_sliding(input_image: str, output_image: str, rasterprocessing: Raste
             else:
                 sliding_windows_bands = [(w, bands) for w in sliding_gen]
 
-    m = multiprocessing.Manager()
-    write_lock = m.Lock()
-
-    # compute using concurrent.futures.ThreadPoolExecutor and tqdm
-    kwargs = {
-        "total": len(sliding_windows_bands),
-        "disable": os.getenv("RASTERTOOLS_NOTQDM", 'False').lower() in ['true', '1']
-    }
-    max_workers = os.getenv("RASTERTOOLS_MAXWORKERS")
-    if max_workers is not None:
-        kwargs["max_workers"] = int(max_workers)
-
-    process_map(_process_sliding, repeat(rasterprocessing),
-                repeat(input_image), repeat(output_image),
-                sliding_windows_bands, repeat(window_overlap),
-                repeat(pad_mode), repeat(in_dtype),
-                repeat(write_lock),
-                **kwargs)
-
-
-def _process_sliding(rasterprocessing: RasterProcessing,
-                     input_image, output_image,
-                     sliding_windowbands, window_overlap,
-                     pad_mode, dtype, write_lock):
+    # compute using the executor of the processing and tqdm
+    disable = os.getenv("RASTERTOOLS_NOTQDM", 'False').lower() in ['true', '1']
+
+    # the output image is opened once by a single writer (the current process) which
+    # receives the computed windows in the order of submission. The windows are thus
+    # written sequentially and every compressed block is written only once.
+    with rasterio.open(output_image, "w", **profile) as dst:
+        # every worker opens the input image and receives the processing once,
+        # then the tasks only contain the windows to compute
+        with create_executor(rasterprocessing.executor,
+                             initializer=_init_worker,
+                             initargs=(rasterprocessing, input_image,
+                                       window_overlap, pad_mode, in_dtype)) as executor:
+            outputs = imap(executor, _process_sliding, sliding_windows_bands)
+            for (sliding_window, bands), output in tqdm(zip(sliding_windows_bands, outputs),
+                                                        total=len(sliding_windows_bands),
+                                                        disable=disable):
+                w_window = sliding_window[2]
+                if rasterprocessing.per_band_algo:
+                    # here bands only contain a single item which is the band number
+                    dst.write_band(bands[0], output[0], window=w_window)
+                else:
+                    dst.write(output, window=w_window)
+
+
+def _init_worker(rasterprocessing: RasterProcessing, input_image: str,
+                 window_overlap: int, pad_mode: str, dtype):
+    """Internal method that initializes a worker: the input image is opened once
+    and kept open with the processing configuration for all the windows computed
+    by the worker.
+    """
+    with rasterio.Env(GDAL_VRT_ENABLE_PYTHON=True):
+        _worker.src = close_at_shutdown(rasterio.open(input_image))
+    _worker.rasterprocessing = rasterprocessing
+    _worker.window_overlap = window_overlap
+    _worker.pad_mode = pad_mode
+    _worker.dtype = dtype
+
+
+def _process_sliding(sliding_windowbands):
     """Internal method that computes the raster data for a specific window.
-    This method can be called safely by several processes thanks to the locks
-    that prevent from writing files simultaneously.
+    This method can be called safely by several workers since it only reads
+    the input image opened by the worker: the computed data (without the
+    overlapping pixels) are returned to the writer.
     """
     sliding_window, bands = sliding_windowbands
     r_window, pad, w_window = sliding_window
+    window_overlap = _worker.window_overlap
 
     with rasterio.Env(GDAL_VRT_ENABLE_PYTHON=True):
-        with rasterio.open(input_image) as src:
-            dataset = _read_dataset(src, bands, r_window, pad, pad_mode)
-            dataset = dataset.astype(dtype)
+        dataset = _read_dataset(_worker.src, bands, r_window, pad, _worker.pad_mode)
+        dataset = dataset.astype(_worker.dtype)
 
     # The computation can be performed concurrently
-    output = rasterprocessing.compute(dataset)
+    output = _worker.rasterprocessing.compute(dataset)
 
-    # Use of the lock to avoid writing in //
-    with write_lock:
-        with rasterio.open(output_image, mode="r+") as dst:
-            if rasterprocessing.per_band_algo:
-                # here bands only contain a single item which is the band number
-                dst.write_band(
-                    bands[0],
-                    output[0, window_overlap:-window_overlap,
-                           window_overlap:-window_overlap],
-                    window=w_window)
-            else:
-                dst.write(
-                    output[:,
-                           window_overlap:-window_overlap,
-                           window_overlap:-window_overlap],
-                    window=w_window)
+    # remove the overlapping pixels
+    return output[:,
+                  window_overlap:output.shape[1] - window_overlap,
+                  window_overlap:output.shape[2] - window_overlap]
 
 
 def _read_dataset(src, bands: List[int], window: Window, pad: tuple, pad_mode: str):
@@ -3,30 +3,67 @@
 """
 Functions to compute statistics on raster images.
 """
+from contextlib import ExitStack
 import os
-from typing import List, Dict
+from typing import List, Dict, Tuple, Union
 import re
 import datetime
+import threading
 
 import numpy as np
-from scipy.stats import median_abs_deviation
 import pandas as pd
 import geopandas as gpd
 import matplotlib
 import matplotlib.pyplot as plt
 import rasterio
 from rasterio import features
+from rasterio.windows import Window
+from shapely.geometry import box
 from tqdm import tqdm
 
 from eolab.rastertools.utils import get_metadata_name
-from eolab.rastertools.processing.vector import rasterize, filter_dissolve
+from eolab.rastertools.processing.executor import PROCESSES, THREADS, create_executor
+from eolab.rastertools.processing.executor import get_executor_type
+from eolab.rastertools.processing.vector import filter_dissolve
+from eolab.rastertools.processing.vector import reproject, vectorize
+from eolab.rastertools.processing.zonal import DEFAULT_BINS, MaskCache, is_reducible
+from eolab.rastertools.processing.zonal import is_streamable
+from eolab.rastertools.processing.zonal import compute_zonal_stats_by_labels
+from eolab.rastertools.processing.zonal import compute_zonal_stats_by_category_labels
+from eolab.rastertools.processing.zonal import compute_zonal_stats_streaming
+
+
+STRIP_HEIGHT = 256
+"""Minimum height (in pixels) of the strips of blocks read in the input image"""
+
+MAX_STRIP_ROWS = 1024
+"""Maximum height (in pixels) of the windows read from the strips of blocks: the higher
+windows are read on their own so that the rows kept in memory are bounded"""
+
+_worker = threading.local()
+"""Context of a worker: parameters of the stats"""
 
 
 def compute_zonal_stats(geoms: gpd.GeoDataFrame, image: str,
                         bands: List[int] = [1],
                         stats: List[str] = ["min", "max", "mean", "std"],
-                        categorical: bool = False) -> List[List[Dict[str, float]]]:
-    """Compute the statistics of an input image for each feature in the shapefile
+                        categorical: bool = False, streaming: bool = False,
+                        bins: int = DEFAULT_BINS,
+                        masks: MaskCache = None,
+                        accuracy: float = None) -> List[List[Dict[str, float]]]:
+    """Compute the statistics of an input image for each feature in the shapefile.
+
+    When all the stats can be computed by grouped reductions (count, sum, min, max,
+    mean, std...), the stats of all the geometries are computed at once on a label
+    raster (see :obj:`eolab.rastertools.processing.zonal`). Otherwise, the stats are
+    computed geometry after geometry on windows served by a single pass over the blocks
+    of the raster, except for layers of points whose values are sampled block by block.
+
+    In streaming mode, the raster is read block by block whatever the extent of the
+    geometries and the median, percentiles and mad are computed from histograms.
+
+    When a cache of masks is given, the geometries rasterized in the grid of the image
+    are kept in the cache and reused by the next images of the same grid.
 
     Args:
         geoms (GeoDataFrame):
@@ -39,38 +76,227 @@ def compute_zonal_stats(geoms: gpd.GeoDataFrame, image: str,
             List of stats to computed
         categorical (bool, optional, default=False):
             Whether to treat the input raster as categorical
+        streaming (bool, optional, default=False):
+            Whether to compute the stats in streaming mode. Only the stats defined in
+            :obj:`eolab.rastertools.processing.zonal.STREAMING_STATS` and the
+            percentiles can be computed in this mode.
+        bins (int, optional, default=1024):
+            Number of bins of the histograms in streaming mode
+        masks (MaskCache, optional, default=None):
+            Cache of the rasterized geometries
+        accuracy (float, optional, default=None):
+            Relative accuracy of the quantile sketches used instead of the histograms
+            in streaming mode. If None, histograms are used.
 
     Returns:
         statistics: a list of list of dictionnaries. First list on ROI, second on bands.
         Dict associates the stat names and the stat values.
     """
-    statistics = []
-    nb_geoms = len(geoms)
-    with rasterio.open(image) as src:
-        geom_gen = (geoms.iloc[i].geometry for i in range(nb_geoms))
-        geom_windows = ((geom, features.geometry_window(src, [geom])) for geom in geom_gen)
+    if streaming:
+        if not is_streamable(stats, categorical):
+            raise ValueError("Categorical stats can not be computed in streaming mode")
+        return compute_zonal_stats_streaming(geoms, image, bands=bands, stats=stats, bins=bins,
+                                             masks=masks, accuracy=accuracy)
+    if is_reducible(stats, categorical):
+        return compute_zonal_stats_by_labels(geoms, image, bands=bands, stats=stats,
+                                             masks=masks)
+    return _compute_zonal_stats_per_geometry(geoms, image, bands, stats, categorical, masks)
+
+
+def compute_zonal_stats_stack(geoms: gpd.GeoDataFrame, images: List[str],
+                              bands: List[int] = [1],
+                              stats: List[str] = ["min", "max", "mean", "std"],
+                              categorical: bool = False, streaming: bool = False,
+                              bins: int = DEFAULT_BINS,
+                              masks: MaskCache = None,
+                              accuracy: float = None) -> List[List[List[Dict[str, float]]]]:
+    """Compute the statistics of a stack of images of the same grid (e.g. a time series
+    of a tile) for each feature in the shapefile.
+
+    The images are read together: the windows of the geometries are computed and the
+    geometries are rasterized once for all the images. See compute_zonal_stats for the
+    engines used to compute the stats.
 
-        statistics = []
+    Args:
+        geoms (GeoDataFrame):
+            Geometries where to compute stats
+        images ([str]):
+            Filenames of the input images to process. The images must have the same grid
+            (crs, transform and size), the same data type and the same nodata value.
+        bands ([int], optional, default=[1]):
+            List of bands to process in the input images
+        stats ([str], optional, default=["min", "max","mean", "std"]):
+            List of stats to computed
+        categorical (bool, optional, default=False):
+            Whether to treat the input rasters as categorical
+        streaming (bool, optional, default=False):
+            Whether to compute the stats in streaming mode
+        bins (int, optional, default=1024):
+            Number of bins of the histograms in streaming mode
+        masks (MaskCache, optional, default=None):
+            Cache of the rasterized geometries
+        accuracy (float, optional, default=None):
+            Relative accuracy of the quantile sketches used instead of the histograms
+            in streaming mode. If None, histograms are used.
+
+    Returns:
+        statistics: a list of list of list of dictionnaries. First list on images, second
+        on ROI, third on bands. Dict associates the stat names and the stat values.
+    """
+    with rasterio.open(images[0]) as src:
+        grid, dtype, nodata = MaskCache.grid_key(src), src.dtypes[bands[0] - 1], src.nodata
+    for image in images[1:]:
+        with rasterio.open(image) as src:
+            if MaskCache.grid_key(src) != grid:
+                raise ValueError(f"Image {image} is not on the grid of the first image")
+            same_nodata = src.nodata == nodata or (
+                src.nodata is not None and nodata is not None
+                and np.isnan(src.nodata) and np.isnan(nodata))
+            if src.dtypes[bands[0] - 1] != dtype or not same_nodata:
+                raise ValueError(f"Image {image} has not the data type or the nodata value "
+                                 "of the first image")
+
+    if streaming:
+        if not is_streamable(stats, categorical):
+            raise ValueError("Categorical stats can not be computed in streaming mode")
+        statistics = compute_zonal_stats_streaming(geoms, images, bands=bands, stats=stats,
+                                                   bins=bins, masks=masks, accuracy=accuracy)
+    elif is_reducible(stats, categorical):
+        statistics = compute_zonal_stats_by_labels(geoms, images, bands=bands, stats=stats,
+                                                   masks=masks)
+    else:
+        statistics = _compute_zonal_stats_per_geometry(geoms, images, bands, stats,
+                                                       categorical, masks)
+
+    # split the stats of the bands of every image
+    nb_bands = len(bands)
+    return [[geom_stats[i * nb_bands:(i + 1) * nb_bands] for geom_stats in statistics]
+            for i in range(len(images))]
+
+
+def _compute_zonal_stats_per_geometry(geoms: gpd.GeoDataFrame, image: Union[str, List[str]],
+                                      bands: List[int] = [1],
+                                      stats: List[str] = ["min", "max", "mean", "std"],
+                                      categorical: bool = False,
+                                      masks: MaskCache = None) -> List[List[Dict[str, float]]]:
+    """Compute the statistics of an input image for each feature in the shapefile,
+    geometry after geometry. When all the geometries are points, the values of the
+    points are sampled instead (see _sample_points). See compute_zonal_stats for the
+    description of the input arguments.
+    """
+    if len(geoms.index) > 0 and (geoms.geom_type == "Point").all():
+        return _sample_points(geoms, image, bands, stats, categorical)
+    items = [([geoms.iloc[i].geometry], "") for i in range(len(geoms))]
+    return _map_geometries(image, items, bands, stats, categorical, masks)
+
+
+def _sample_points(geoms: gpd.GeoDataFrame, image: Union[str, List[str]],
+                   bands: List[int], stats: List[str],
+                   categorical: bool) -> List[List[Dict[str, float]]]:
+    """Compute the statistics of points: the points are sorted by block of the raster,
+    every block that contains points is read once and the values of all its points are
+    sampled at once. The stats of a point are the stats of the pixel that contains it
+    (no stats when the point is outside the raster).
+    """
+    images = [image] if isinstance(image, str) else list(image)
+    with ExitStack() as stack:
+        srcs = [stack.enter_context(rasterio.open(image)) for image in images]
+        src = srcs[0]
+        nodata = src.nodata
+
+        # pixel of every point
+        rows, cols = rasterio.transform.rowcol(src.transform, geoms.geometry.x.to_numpy(),
+                                               geoms.geometry.y.to_numpy())
+        rows, cols = np.asarray(rows), np.asarray(cols)
+        inside = (rows >= 0) & (rows < src.height) & (cols >= 0) & (cols < src.width)
+
+        # sort the points by block
+        block_height, block_width = src.block_shapes[0]
+        nb_block_cols = -(-src.width // block_width)
+        blocks = (rows // block_height) * nb_block_cols + cols // block_width
+        points = np.flatnonzero(inside)
+        points = points[np.argsort(blocks[points], kind="stable")]
+        starts = np.flatnonzero(np.diff(blocks[points], prepend=-1))
+        ends = np.append(starts[1:], len(points))
+
+        values = np.zeros((len(srcs) * len(bands), len(geoms.index)),
+                          dtype=src.dtypes[bands[0] - 1])
         disable = os.getenv("RASTERTOOLS_NOTQDM", 'False').lower() in ['true', '1']
-        for geom, window in tqdm(geom_windows, total=nb_geoms, disable=disable, desc="zonalstats"):
-            data = src.read(bands, window=window)
-            transform = src.window_transform(window)
+        for start, end in tqdm(zip(starts, ends), total=len(starts), disable=disable,
+                               desc="zonalstats"):
+            block_points = points[start:end]
+            row = (blocks[block_points[0]] // nb_block_cols) * block_height
+            col = (blocks[block_points[0]] % nb_block_cols) * block_width
+            window = Window(col, row, min(block_width, src.width - col),
+                            min(block_height, src.height - row))
+            data = np.concatenate([other.read(bands, window=window) for other in srcs])
+            values[:, block_points] = data[:, rows[block_points] - row,
+                                           cols[block_points] - col]
+
+    # stats of a single pixel
+    if nodata is not None and np.isnan(nodata):
+        valids = inside & ~np.isnan(values)
+    else:
+        valids = inside & (values != nodata)
+    # stats of the points outside the raster and of the nodata pixels
+    nodatas = np.full((1, 1, 1), 0 if nodata is None else nodata, dtype=values.dtype)
+    outside = _compute_stats((nodatas, None, None, None), nodata, stats, categorical,
+                             mask=np.zeros((1, 1), dtype=bool))[0]
+    invalid = _compute_stats((nodatas, None, None, None), nodata, stats, categorical,
+                             mask=np.ones((1, 1), dtype=bool))[0]
+    statistics = []
+    for i in range(len(geoms.index)):
+        no_stats = invalid if inside[i] else outside
+        statistics.append([_pixel_stats(value, stats, categorical) if valid else dict(no_stats)
+                           for value, valid in zip(values[:, i], valids[:, i])])
+    return statistics
 
-            s = _compute_stats((data, transform, [geom], window),
-                               src.nodata, stats, categorical)
-            statistics.append(s)
 
-    return statistics
+def _pixel_stats(value, stats: List[str], categorical: bool) -> Dict[str, float]:
+    """Generate the statistics of a single valid pixel, as _compute_stats does"""
+    v = float(value)
+    feature_stats = {key: v for key in ['min', 'max', 'mean', 'sum'] if key in stats}
+    if 'std' in stats:
+        feature_stats['std'] = 0.0
+    if 'median' in stats:
+        feature_stats['median'] = v
+    if 'range' in stats:
+        feature_stats['range'] = 0.0
+    for pctile in [s for s in stats if s.startswith('percentile_')]:
+        feature_stats[pctile] = np.float64(v)
+    if 'mad' in stats:
+        feature_stats['mad'] = np.float64(0)
+    if categorical:
+        feature_stats[value.item()] = 1
+    if 'majority' in stats:
+        feature_stats['majority'] = v
+    if 'minority' in stats:
+        feature_stats['minority'] = v
+    if 'unique' in stats:
+        feature_stats['unique'] = 1
+    if "count" in stats:
+        feature_stats['count'] = np.int64(1)
+    if 'nodata' in stats:
+        feature_stats['nodata'] = np.int64(0)
+    if 'valid' in stats:
+        feature_stats['valid'] = np.float64(1.0 / (1 + 1e-5))
+    return feature_stats
 
 
 def compute_zonal_stats_per_category(geoms: gpd.GeoDataFrame, image: str,
                                      bands: List[int] = [1],
                                      stats: List[str] = ["min", "max", "mean", "std"],
-                                     categories: gpd.GeoDataFrame = None,
+                                     categories: Union[gpd.GeoDataFrame, str] = None,
                                      category_index: str = 'Classe',
-                                     category_labels: Dict[str, str] = None):
+                                     category_labels: Dict[str, str] = None,
+                                     masks: MaskCache = None):
     """Compute the statistics of an input image for each feature in the shapefile
 
+    When the categories are defined by a raster and all the stats can be computed by
+    grouped reductions, the stats are computed on labels that combine the geometries
+    and the categories of the raster (see :obj:`eolab.rastertools.processing.zonal`).
+    Otherwise, the categories are vectorized and intersected with every geometry.
+
     Args:
         geoms (GeoDataFrame):
             Geometries where to compute stats
@@ -80,13 +306,16 @@ def compute_zonal_stats_per_category(geoms: gpd.GeoDataFrame, image: str,
             List of bands to process in the input image
         stats ([str], optional, default=["min", "max", "mean", "std"]):
             List of stats to computed
-        categories (GeoDataFrame, optional, default=None):
-            The geometries defining the categories.
+        categories (GeoDataFrame or str, optional, default=None):
+            The geometries defining the categories or the filename of a raster
+            of categories
         category_index (str, optional, default='Classe'):
             Name of the column in category file (when it is a vector) that
             contains the category index
         category_labels (Dict[str, str], optional, default=None):
             Dict that associates the category values and category names
+        masks (MaskCache, optional, default=None):
+            Cache of the rasterized geometries
 
     Returns:
         statistics ([[Dict[str, float]]]): a list of list of dictionnaries.
@@ -104,63 +333,56 @@ def compute_zonal_stats_per_category(geoms: gpd.GeoDataFrame, image: str,
             raise IOError('Shape is not a polygon.')
         return polygons
 
+    if isinstance(categories, str):
+        if is_reducible(stats):
+            return compute_zonal_stats_by_category_labels(geoms, image, categories,
+                                                          bands=bands, stats=stats,
+                                                          category_labels=category_labels,
+                                                          masks=masks)
+        # vectorize the raster and reproject in the raster crs
+        categories = reproject(vectorize(categories, image, category_index), image)
+
     statistics = []
     # Process geometries one by one
     nb_geoms = len(geoms)
     nb_bands = len(bands)
 
-    with rasterio.open(image) as src:
-        # each input geometry is split following the categorical geometries.
-        # geom_by_class contains the list of categorical geometries (one list of categorical
-        # geometries per input geometry)
-        geom_gen = (geoms.iloc[[i]] for i in range(nb_geoms))
-        geom_by_class = [filter_dissolve(roi, categories, id=category_index)
-                         for roi in geom_gen]
-
-        # Compute the number of categorical geometries for each input geometry
-        nb_class_roi = [geom_by_class.shape[0] for geom_by_class in geom_by_class]
-
-        # compute stats prefix
-        index_list_roi = [str(el)
-                          for geom_by_class in geom_by_class
-                          for el in geom_by_class[category_index]]
-
-        # change index_list_roi names if a dict is given
-        if category_labels:
-            index_list_roi = [category_labels[el] if el in category_labels else el
-                              for el in index_list_roi]
-
-        # Generator to creates windows associated with each category
-        # geom_window_gen is a generator whose elements are list of geometries per class and per roi
-        geom_windows = [(_get_list_of_polygons(geom),
-                         features.geometry_window(src, _get_list_of_polygons(geom)))
-                        for geom_by_class in geom_by_class
-                        for geom in geom_by_class.geometry]
-
-        substats = []
-        disable = os.getenv("RASTERTOOLS_NOTQDM", 'False').lower() in ['true', '1']
-        for geom_window, stats_prefix in tqdm(zip(geom_windows, index_list_roi),
-                                              disable=disable, desc="zonalstats"):
-            """Read input raster and compute stats"""
-            geom, window = geom_window
-
-            data = src.read(bands, window=window)
-            transform = src.window_transform(window)
-
-            s = _compute_stats((data, transform, geom, window),
-                               src.nodata, stats, False, stats_prefix)
-            substats.append(s)
-
-        offset = 0
-        # re-order output so that all stats of catagorical geometries that correspond
-        # to the same input geometry are concatenated in the same list
-        for i in range(nb_geoms):
-            results_roi = [{}] * nb_bands
-            [results_roi[u].update(substats[v + offset][u])
-             for u in range(nb_bands)
-             for v in range(nb_class_roi[i])]
-            offset = offset + nb_class_roi[i]
-            statistics.append(results_roi)
+    # each input geometry is split following the categorical geometries.
+    # geom_by_class contains the list of categorical geometries (one list of categorical
+    # geometries per input geometry)
+    geom_gen = (geoms.iloc[[i]] for i in range(nb_geoms))
+    geom_by_class = [filter_dissolve(roi, categories, id=category_index)
+                     for roi in geom_gen]
+
+    # Compute the number of categorical geometries for each input geometry
+    nb_class_roi = [geom_by_class.shape[0] for geom_by_class in geom_by_class]
+
+    # compute stats prefix
+    index_list_roi = [str(el)
+                      for geom_by_class in geom_by_class
+                      for el in geom_by_class[category_index]]
+
+    # change index_list_roi names if a dict is given
+    if category_labels:
+        index_list_roi = [category_labels[el] if el in category_labels else el
+                          for el in index_list_roi]
+
+    # list of geometries per class and per roi
+    geom_gen = (geom for geom_by_class in geom_by_class for geom in geom_by_class.geometry)
+    items = [(_get_list_of_polygons(geom), stats_prefix)
+             for geom, stats_prefix in zip(geom_gen, index_list_roi)]
+    substats = _map_geometries(image, items, bands, stats, False, masks)
+
+    offset = 0
+    # re-order output so that all stats of catagorical geometries that correspond
+    # to the same input geometry are concatenated in the same list
+    for i in range(nb_geoms):
+        results_roi = [{} for _ in range(nb_bands)]
+        [results_roi[u].update(substats[v + offset][u])
+         for u in range(nb_bands)
+         for v in range(nb_class_roi[i])]
+        offset = offset + nb_class_roi[i]
+        statistics.append(results_roi)
 
     return statistics
 
@@ -172,6 +394,11 @@ def extract_zonal_outliers(geoms: gpd.GeoDataFrame, image: str, outliers_image:
     mean value. The outliers are computed for each geometry. The stats mean and std of the
     geometries shall have been computed by the function compute_zonal_stats.
 
+    The image is processed strip by strip: the geometries are burnt in a zone label
+    raster of the strip and the mean and std of the pixels are looked up from the stats
+    of their zone, for all the bands at once. Pixels outside the geometries and nodata
+    pixels are set to nodata.
+
     Args:
         geoms (GeoDataFrame):
             Geometries that contain as metadata the statistics (at least the mean and std)
@@ -186,29 +413,63 @@ def extract_zonal_outliers(geoms: gpd.GeoDataFrame, image: str, outliers_image:
         sigma (float, optional, default=2):
             Distance (in sigma) to the mean value to consider a point as an outlier
     """
-    for i, band in enumerate(bands):
-        mean_attr = get_metadata_name(band, prefix[i], "mean")
-        std_attr = get_metadata_name(band, prefix[i], "std")
-        geoms = geoms[~np.isnan(geoms[mean_attr])]
-        geoms = geoms[~np.isnan(geoms[std_attr])]
-
-        with rasterio.open(image) as dataset:
-            profile = dataset.profile
-            data = dataset.read(band, masked=True)
-
-            with rasterio.open(outliers_image, "w", **profile) as output:
-                # rasterisation du mean et du std
-                mean = rasterize(geoms, image, burn=mean_attr, burn_type=rasterio.float32,
-                                 nodata=dataset.nodata)  # , output=image[:-4] + "-mean.tif")
-                std = rasterize(geoms, image, burn=std_attr, burn_type=rasterio.float32,
-                                nodata=dataset.nodata)  # , output=image[:-4] + "-std.tif")
-
-                outliers = np.logical_and(mean > -1,
-                                          np.logical_or(data <= mean - float(sigma) * std,
-                                                        data >= mean + float(sigma) * std))
-
-                mean[outliers] = data[outliers]
-                output.write_band(band, mean)
+    prefix = prefix or [""] * len(bands)
+    mean_attrs = [get_metadata_name(band, pref, "mean") for band, pref in zip(bands, prefix)]
+    std_attrs = [get_metadata_name(band, pref, "std") for band, pref in zip(bands, prefix)]
+
+    # keep the geometries whose mean and std are defined for every band
+    for attr in mean_attrs + std_attrs:
+        geoms = geoms[~np.isnan(geoms[attr])]
+    geometries = geoms.geometry.reset_index(drop=True)
+
+    # mean and std of every zone label (label 0 is outside the geometries)
+    means = np.zeros((len(bands), len(geometries) + 1), dtype=np.float32)
+    stds = np.zeros((len(bands), len(geometries) + 1), dtype=np.float32)
+    means[:, 1:] = geoms[mean_attrs].to_numpy(dtype=np.float32).T
+    stds[:, 1:] = geoms[std_attrs].to_numpy(dtype=np.float32).T
+
+    with rasterio.open(image) as dataset:
+        profile = dataset.profile
+        nodata = dataset.nodata
+        fill = 0 if nodata is None else nodata
+        nodata_is_nan = nodata is not None and np.isnan(nodata)
+
+        with rasterio.open(outliers_image, "w", **profile) as output:
+            for window in _strip_windows(dataset):
+                labels = _burn_labels(dataset, geometries, window)
+                data = dataset.read(bands, window=window)
+                outliers = np.full(data.shape, fill, dtype=np.float32)
+                for i in range(len(bands)):
+                    valid = ~np.isnan(data[i]) if nodata_is_nan else data[i] != nodata
+                    inside = (labels > 0) & valid
+                    values = data[i][inside]
+                    mean = means[i][labels[inside]]
+                    std = stds[i][labels[inside]]
+                    selected = np.logical_or(values <= mean - float(sigma) * std,
+                                             values >= mean + float(sigma) * std)
+                    outliers[i][inside] = np.where(selected, values, mean)
+                output.write(outliers, indexes=bands, window=window)
+
+
+def _strip_windows(dataset) -> List[Window]:
+    """Get the windows of the strips of blocks that cover a raster. Strips are at least
+    STRIP_HEIGHT pixels high and aligned on the blocks of the raster."""
+    block_height = dataset.block_shapes[0][0]
+    height = block_height * max(1, -(-STRIP_HEIGHT // block_height))
+    return [Window(0, row, dataset.width, min(height, dataset.height - row))
+            for row in range(0, dataset.height, height)]
+
+
+def _burn_labels(dataset, geometries: gpd.GeoSeries, window: Window) -> np.ndarray:
+    """Burn the zone labels (position of the geometry + 1) of the geometries that
+    intersect a window. Where geometries overlap, the last geometry wins."""
+    candidates = np.sort(geometries.sindex.query(box(*dataset.window_bounds(window))))
+    if len(candidates) == 0:
+        return np.zeros((window.height, window.width), dtype=np.int32)
+    shapes = [(geometries.iloc[i], i + 1) for i in candidates]
+    return features.rasterize(shapes, out_shape=(window.height, window.width),
+                              transform=dataset.window_transform(window),
+                              fill=0, dtype=np.int32)
 
 
 def plot_stats(chartfile: str, stats_per_date: Dict[datetime.datetime, gpd.GeoDataFrame],
@@ -271,8 +532,219 @@ def plot_stats(chartfile: str, stats_per_date: Dict[datetime.datetime, gpd.GeoDa
         plt.show()
 
 
+def _map_geometries(image: Union[str, List[str]], items: List[Tuple[list, str]],
+                    bands: List[int], stats: List[str], categorical: bool,
+                    masks: MaskCache = None) -> List[List[Dict[str, float]]]:
+    """Compute the stats of every item (list of geometries, stats prefix).
+
+    The raster is read once, strip of blocks after strip of blocks. The rows of the
+    strips are kept in memory as long as a geometry that covers them has not been
+    processed so that the windows of neighbouring geometries are served from the same
+    decoded blocks. When all the rows of the window of a geometry have been read, its
+    stats are computed by the workers of the executor. The results are returned in
+    the order of the items.
+
+    When a list of images of the same grid is given, the images are read together and
+    the stats of the bands of every image are concatenated. When a cache of masks is
+    given, the windows and the masks of the items are kept in the cache.
+    """
+    images = [image] if isinstance(image, str) else list(image)
+    statistics = [None] * len(items)
+    disable = os.getenv("RASTERTOOLS_NOTQDM", 'False').lower() in ['true', '1']
+    with ExitStack() as stack:
+        srcs = [stack.enter_context(rasterio.open(image)) for image in images]
+        src = srcs[0]
+
+        def _get_windows():
+            return [features.geometry_window(src, geometries) for geometries, _ in items]
+
+        if get_executor_type(THREADS) == PROCESSES:
+            # the masks would be copied in every process and lost
+            masks = None
+        masks_key = None
+        if masks is None:
+            windows = _get_windows()
+        else:
+            all_geometries = (geometry for geometries, _ in items for geometry in geometries)
+            masks_key = (MaskCache.grid_key(src), MaskCache.geometries_key(all_geometries),
+                         tuple(len(geometries) for geometries, _ in items))
+            windows = masks.get(masks_key + ("windows",), _get_windows)
+
+        with create_executor(THREADS,
+                             initializer=_init_worker,
+                             initargs=(src.nodata, stats, categorical,
+                                       masks, masks_key)) as executor, \
+                tqdm(total=len(items), disable=disable, desc="zonalstats") as progress:
+            for indexes, packs in _iter_packs(srcs, bands, items, windows):
+                for i, s in zip(indexes, executor.map(_compute_stats_item, packs)):
+                    statistics[i] = s
+                progress.update(len(indexes))
+
+    return statistics
+
+
+def _iter_packs(srcs, bands: List[int], items: List[Tuple[list, str]], windows: List[Window]):
+    """Generate the items whose data have been read (see _iter_strips). The windows
+    higher than MAX_STRIP_ROWS are read on their own so that a tall geometry does not
+    keep all the rows of the raster in memory.
+
+    Returns:
+        A generator of pairs: the indexes of the items and the packs of the items
+        (index, data, geo transform, geometries, window and prefix)
+    """
+    src = srcs[0]
+
+    def _pack(i, data):
+        return (i, data, src.window_transform(windows[i]), items[i][0], windows[i],
+                items[i][1])
+
+    tall = [i for i, window in enumerate(windows) if window.height > MAX_STRIP_ROWS]
+    for i in tall:
+        data = np.concatenate([other.read(bands, window=windows[i]) for other in srcs])
+        yield [i], [_pack(i, data)]
+
+    others = [i for i, window in enumerate(windows) if window.height <= MAX_STRIP_ROWS]
+    for indexes, strips in _iter_strips(srcs, bands, [windows[i] for i in others]):
+        indexes = [others[i] for i in indexes]
+        packs = []
+        for i in indexes:
+            packs.append(_pack(i, _get_rows(strips, windows[i])))
+        yield indexes, packs
+
+
+def _iter_strips(srcs, bands: List[int], windows: List[Window]):
+    """Read the raster strip of blocks after strip of blocks, every strip once.
+
+    Strips that do not intersect any window are not read, and a strip is only read on the
+    columns of blocks between the first and the last column of the windows that intersect
+    it: small or sparse geometries do not decode whole rows of blocks. The strips are kept
+    in memory as long as a window that has not been processed intersects them: when the
+    windows are at most MAX_STRIP_ROWS high, at most MAX_STRIP_ROWS rows plus two strips
+    are kept.
+
+    Args:
+        srcs ([rasterio.DatasetReader]):
+            Input images of the same grid
+        bands ([int]):
+            List of bands to read
+        windows ([Window]):
+            Windows of the geometries
+
+    Returns:
+        A generator of pairs: the indexes of the windows whose rows have all been read
+        and the strips kept in memory (list of triplets: index of the first row and of the
+        first column of the strip in the raster and data of the strip for the bands of
+        every image)
+    """
+    src = srcs[0]
+    block_height, block_width = src.block_shapes[0]
+    height = block_height * max(1, -(-STRIP_HEIGHT // block_height))
+
+    ranges = np.array([window.toranges() for window in windows], dtype=np.int64)
+    ranges = ranges.reshape(-1, 2, 2)
+    # windows sorted by last row: windows are ready in this order
+    order = np.argsort(ranges[:, 0, 1], kind="stable")
+    starts, stops = ranges[order, 0, 0], ranges[order, 0, 1]
+
+    # columns of the strips that intersect at least one window
+    nb_strips = -(-src.height // height)
+    lefts = np.full(nb_strips, src.width, dtype=np.int64)
+    rights = np.zeros(nb_strips, dtype=np.int64)
+    not_empty = (ranges[:, :, 1] > ranges[:, :, 0]).all(axis=1)
+    for (start, stop), (col_start, col_stop) in ranges[not_empty]:
+        strip_slice = slice(start // height, (stop - 1) // height + 1)
+        lefts[strip_slice] = np.minimum(lefts[strip_slice], col_start)
+        rights[strip_slice] = np.maximum(rights[strip_slice], col_stop)
+    # aligned on the columns of blocks
+    lefts = np.maximum(lefts // block_width * block_width, 0)
+    rights = np.minimum(-(-rights // block_width) * block_width, src.width)
+
+    nb_ready = 0
+    strips = []
+    for strip in np.flatnonzero(rights > lefts):
+        strip_window = Window(lefts[strip], strip * height, rights[strip] - lefts[strip],
+                              min(height, src.height - strip * height))
+        strip_datas = np.concatenate([other.read(bands, window=strip_window)
+                                      for other in srcs])
+        strips.append((strip_window.row_off, strip_window.col_off, strip_datas))
+        bottom = strip_window.row_off + strip_window.height
+
+        # windows whose last row has been read
+        first = nb_ready
+        nb_ready = np.searchsorted(stops, bottom, side="right")
+        yield order[first:nb_ready].tolist(), strips
+
+        # release the strips that are not used by the remaining windows
+        first_row = starts[nb_ready:].min() if nb_ready < len(stops) else bottom
+        strips = [strip for strip in strips if strip[0] + strip[2].shape[1] > first_row]
+
+    # empty windows after the last strip
+    if nb_ready < len(stops):
+        dtype = np.result_type(*[other.dtypes[band - 1] for other in srcs for band in bands])
+        empty = np.zeros((len(srcs) * len(bands), 0, 0), dtype=dtype)
+        yield order[nb_ready:].tolist(), [(src.height, 0, empty)]
+
+
+def _get_rows(strips, window: Window) -> np.ndarray:
+    """Get the data of the window from the strips. The data are not copied when the
+    rows of the window belong to one strip.
+
+    Args:
+        strips ([(int, int, np.ndarray)]):
+            Strips (index of the first row, index of the first column and data) sorted
+            by rows. The columns of every strip contain the columns of the window if the
+            window is not empty
+        window (Window):
+            Window to get
+
+    Returns:
+        np.ndarray: the data of the window for all the bands
+    """
+    (row_start, row_stop), (col_start, col_stop) = window.toranges()
+    datas = strips[0][2]
+    if row_stop <= row_start or col_stop <= col_start:
+        # empty window
+        return np.zeros((datas.shape[0], max(0, row_stop - row_start),
+                         max(0, col_stop - col_start)), dtype=datas.dtype)
+    parts = [datas[:, max(row_start, top) - top:row_stop - top,
+                   col_start - left:col_stop - left]
+             for top, left, datas in strips
+             if top < row_stop and top + datas.shape[1] > row_start]
+    return parts[0] if len(parts) == 1 else np.concatenate(parts, axis=1)
+
+
+def _init_worker(nodata, stats, categorical, masks, masks_key):
+    """Initialize a worker with the parameters of the stats and the cache of masks"""
+    _worker.nodata = nodata
+    _worker.stats = stats
+    _worker.categorical = categorical
+    _worker.masks = masks
+    _worker.masks_key = masks_key
+
+
+def _compute_stats_item(pack) -> List[Dict[str, float]]:
+    """Compute the stats of an item: index, data, geo transform, geometries, window
+    and prefix"""
+    i, data, transform, geometries, window, prefix = pack
+    mask = None
+    if _worker.masks is not None:
+        mask = _worker.masks.get(_worker.masks_key + (i,),
+                                 lambda: _geometry_mask(geometries, transform, window))
+    return _compute_stats((data, transform, geometries, window), _worker.nodata,
+                          _worker.stats, _worker.categorical, prefix, mask)
+
+
+def _geometry_mask(geom, transform, window) -> np.ndarray:
+    """Rasterize the geometries in the window: True inside the geometries"""
+    all_geoms = [(g, 1) for g in geom]
+    return features.rasterize(shapes=all_geoms,
+                              fill=0, out_shape=rasterio.windows.shape(window),
+                              transform=transform,
+                              dtype=rasterio.uint8).astype(bool)
+
+
 def _compute_stats(pack, nodata, stats: List[str] = None,
-                   categorical: bool = False, prefix_stats: str = ""):
+                   categorical: bool = False, prefix_stats: str = "", mask: np.ndarray = None):
     """Compute the statistics.
 
     Args:
@@ -287,6 +759,8 @@ def _compute_stats(pack, nodata, stats: List[str] = None,
             Whether to consider the input raster as categorical
         prefix_stats:
             A prefix to name the stats
+        mask:
+            The geometry rasterized in the window (computed if None)
 
     Returns:
         A list of statistics (one item per band). Statistics are provided as a dict that associates
@@ -295,11 +769,8 @@ def _compute_stats(pack, nodata, stats: List[str] = None,
     datas, transform, geom, window = pack
 
     # prepare the mask to apply to input dataset: any pixel outside the geom shall be masked
-    all_geoms = [(g, 1) for g in geom]
-    mask = features.rasterize(shapes=all_geoms,
-                              fill=0, out_shape=rasterio.windows.shape(window),
-                              transform=transform,
-                              dtype=rasterio.uint8).astype(bool)
+    if mask is None:
+        mask = _geometry_mask(geom, transform, window)
 
     # list of stats computed, one item per band
     all_stats = []
@@ -316,10 +787,12 @@ def _compute_stats(pack, nodata, stats: List[str] = None,
             # nothing here, fill with None and move on
             feature_stats = dict([(stat, None) for stat in stats])
         else:
-            # generate the statistics
-            feature_stats = _gen_stats(dataset, stats, categorical, prefix_stats)
+            # generate the statistics, sharing the intermediate results (sorted values...)
+            values = {}
+            feature_stats = _gen_stats(dataset, stats, categorical, prefix_stats, values)
             # generate the categorical statistics
-            feature_stats.update(_gen_stats_cat(dataset, stats, categorical, prefix_stats))
+            feature_stats.update(_gen_stats_cat(dataset, stats, categorical, prefix_stats,
+                                                values))
 
         # generate the counting stats
         if "count" in stats:
@@ -338,7 +811,7 @@ def _compute_stats(pack, nodata, stats: List[str] = None,
 
 
 def _gen_stats(dataset, stats: List[str] = None,
-               categorical: bool = False, prefix_stats: str = ""):
+               categorical: bool = False, prefix_stats: str = "", values: dict = None):
     """Generates the statistics
 
     Args:
@@ -350,49 +823,20 @@ def _gen_stats(dataset, stats: List[str] = None,
             Whether to consider the input raster as categorical
         prefix_stats:
             A prefix to name the stats
+        values:
+            The intermediate results already computed on the dataset (updated with
+            the intermediate results computed by this function)
 
     Returns:
         The list of statistics for the input dataset as a dict that associates the
         stats names and the stats values.
 
     """
-    feature_stats = dict()
-
-    # compute stats
-    functions = {
-        'min': np.ma.min,
-        'max': np.ma.max,
-        'mean': np.ma.mean,
-        'sum': np.ma.sum,
-        'std': np.ma.std,
-        'median': np.ma.median
-    }
-
-    for key, function in functions.items():
-        if key in stats:
-            feature_stats[f'{prefix_stats}{key}'] = float(function(dataset))
-
-    if 'range' in stats:
-        min_key = f'{prefix_stats}min'
-        rmin = feature_stats[min_key] if min_key in feature_stats.keys() else float(dataset.min())
-        max_key = f'{prefix_stats}max'
-        rmax = feature_stats[max_key] if max_key in feature_stats.keys() else float(dataset.max())
-        feature_stats[f'{prefix_stats}range'] = rmax - rmin
-
-    # compute percentiles on the compressed dataset (i.e. the numpy array without the masked values)
-    # because np.ma has no percentile computation capabilities
-    dataset_com = dataset.compressed()
-    for pctile in [s for s in stats if s.startswith('percentile_')]:
-        q = float(pctile.replace("percentile_", ''))
-        feature_stats[f'{prefix_stats}{pctile}'] = np.percentile(dataset_com, q)
-    if 'mad' in stats:
-        feature_stats[f'{prefix_stats}mad'] = median_abs_deviation(dataset_com.flatten())
-
-    return feature_stats
+    return _apply_kernels(_STATS, dataset, stats, prefix_stats, values)
 
 
 def _gen_stats_cat(dataset, stats: List[str] = None,
-                   categorical: bool = False, prefix_stats: str = ""):
+                   categorical: bool = False, prefix_stats: str = "", values: dict = None):
     """Generates the statistics
 
     Args:
@@ -404,37 +848,137 @@ def _gen_stats_cat(dataset, stats: List[str] = None,
             Whether to consider the input raster as categorical
         prefix_stats:
             A prefix to name the stats
+        values:
+            The intermediate results already computed on the dataset (updated with
+            the intermediate results computed by this function)
 
     Returns:
         The list of statistics for the input dataset as a dict that associates the
         stats names and the stats values.
 
     """
+    values = {} if values is None else values
 
-    # if categorical stats is requested, extract all unique values from the dataset
-    if categorical or 'majority' in stats or 'minority' in stats or 'unique' in stats:
-        keys, counts = np.unique(dataset.compressed(), return_counts=True)
-        # pixel_count is a dict that associates a unique value with the number
-        # of occurrences in the dataset
-        pixel_count = dict(zip([k.item() for k in keys],
-                               [c.item() for c in counts]))
-
-    # initialize the feature_stats dict
-    feature_stats = dict(pixel_count) if categorical else {}
-
-    def _key_assoc_val(d, func, exclude=None):
-        """return the key associated with the value returned by func
-        """
-        vs = list(d.values())
-        ks = list(d.keys())
-        key = ks[vs.index(func(vs))]
-        return key
+    # initialize the feature_stats dict with the number of occurrences of every unique value
+    feature_stats = {}
+    if categorical:
+        keys, counts = _get_intermediate('unique', dataset, values)
+        feature_stats = dict(zip(keys.tolist(), counts.tolist()))
 
-    if 'majority' in stats:
-        feature_stats[f'{prefix_stats}majority'] = float(_key_assoc_val(pixel_count, max))
-    if 'minority' in stats:
-        feature_stats[f'{prefix_stats}minority'] = float(_key_assoc_val(pixel_count, min))
-    if 'unique' in stats:
-        feature_stats[f'{prefix_stats}unique'] = len(list(pixel_count.keys()))
+    feature_stats.update(_apply_kernels(_CATEGORICAL_STATS, dataset, stats, prefix_stats, values))
+    return feature_stats
+
+
+def _apply_kernels(kernels: Dict[str, Tuple[Tuple[str, ...], callable]], dataset,
+                   stats: List[str], prefix_stats: str, values: dict = None):
+    """Apply the kernels of the requested stats, computing every intermediate result once.
+
+    Args:
+        kernels:
+            The registry of the kernels: it associates a stat name (or a prefix ending
+            with "_" for a family of stats parameterized by a number, e.g. percentile_90)
+            with the names of the intermediate results the kernel takes as arguments, and
+            the kernel function itself. The kernel of a family also takes the number.
+        dataset:
+            The dataset (numpy MaskedArray) from which stats are computed
+        stats:
+            The stats to compute
+        prefix_stats:
+            A prefix to name the stats
+        values:
+            The intermediate results already computed on the dataset
 
+    Returns:
+        The requested stats in the order of the registry
+    """
+    values = {} if values is None else values
+    feature_stats = dict()
+    for name, (intermediates, kernel) in kernels.items():
+        if name.endswith('_'):
+            requested = [(s, float(s[len(name):])) for s in stats if s.startswith(name)]
+        else:
+            requested = [(name,)] if name in stats else []
+        for stat, *params in requested:
+            args = [_get_intermediate(i, dataset, values) for i in intermediates]
+            feature_stats[f'{prefix_stats}{stat}'] = kernel(*args, *params)
     return feature_stats
+
+
+def _get_intermediate(name: str, dataset, values: dict):
+    """Get an intermediate result of the dataset, computing it (and the intermediate results
+    it depends on) only if it is not yet in values"""
+    if name == 'dataset':
+        return dataset
+    if name not in values:
+        depends, function = _INTERMEDIATES[name]
+        values[name] = function(*[_get_intermediate(d, dataset, values) for d in depends])
+    return values[name]
+
+
+def _sorted_median(sorted_values: np.ndarray):
+    """Median of the sorted values, as np.median does"""
+    if np.isnan(sorted_values[-1]):
+        return sorted_values[-1]
+    half, odd = divmod(sorted_values.size, 2)
+    return sorted_values[half + odd - 1:half + 1].mean()
+
+
+def _sorted_percentile(sorted_values: np.ndarray, q: float):
+    """Percentile of the sorted values, linearly interpolated as np.percentile does"""
+    if np.isnan(sorted_values[-1]):
+        return np.float64(np.nan)
+    index = (sorted_values.size - 1) * np.true_divide(q, 100)
+    previous = min(max(int(np.floor(index)), 0), sorted_values.size - 1)
+    gamma = index - previous
+    low = sorted_values[previous]
+    high = sorted_values[min(previous + 1, sorted_values.size - 1)]
+    diff = high - low
+    return np.float64(high - diff * (1 - gamma) if gamma >= 0.5 else low + diff * gamma)
+
+
+def _sorted_unique(sorted_values: np.ndarray):
+    """Unique values of the sorted values and their number of occurrences, as np.unique
+    does (all the nan values are counted as a single value)"""
+    starts = np.empty(sorted_values.size, dtype=bool)
+    starts[0] = True
+    np.not_equal(sorted_values[1:], sorted_values[:-1], out=starts[1:])
+    if np.isnan(sorted_values[-1]):
+        starts[np.searchsorted(sorted_values, np.nan) + 1:] = False
+    starts = np.flatnonzero(starts)
+    return sorted_values[starts], np.diff(np.append(starts, sorted_values.size))
+
+
+_INTERMEDIATES = {
+    'compressed': (('dataset',), lambda dataset: dataset.compressed()),
+    'sorted': (('compressed',), np.sort),
+    'sum': (('compressed',), np.sum),
+    'mean': (('sum', 'compressed'), lambda total, compressed: total / compressed.size),
+    'squares': (('compressed', 'mean'),
+                lambda compressed, mean: np.square(compressed - mean).sum()),
+    'median': (('sorted',), _sorted_median),
+    'unique': (('sorted',), _sorted_unique),
+}
+"""Intermediate results shared by the kernels of the stats: every intermediate result is
+associated with the intermediate results it depends on and the function that computes it
+(the masked dataset itself is the intermediate result "dataset")"""
+
+_STATS = {
+    'min': (('sorted',), lambda s: float(s[-1] if np.isnan(s[-1]) else s[0])),
+    'max': (('sorted',), lambda s: float(s[-1])),
+    'mean': (('mean',), float),
+    'sum': (('sum',), float),
+    'std': (('squares', 'compressed'), lambda squares, c: float(np.sqrt(squares / c.size))),
+    'median': (('median',), float),
+    'range': (('sorted',), lambda s: float(s[-1]) - float(s[-1] if np.isnan(s[-1]) else s[0])),
+    'percentile_': (('sorted',), _sorted_percentile),
+    'mad': (('compressed', 'median'),
+            lambda compressed, median: np.float64(np.median(np.abs(compressed - median)))),
+}
+"""Kernels of the stats computed on the valid values of a zone (see _apply_kernels)"""
+
+_CATEGORICAL_STATS = {
+    'majority': (('unique',), lambda unique: float(unique[0][np.argmax(unique[1])])),
+    'minority': (('unique',), lambda unique: float(unique[0][np.argmin(unique[1])])),
+    'unique': (('unique',), lambda unique: len(unique[0])),
+}
+"""Kernels of the stats computed on the unique values of a zone (see _apply_kernels)"""
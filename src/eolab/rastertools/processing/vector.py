@@ -170,6 +170,124 @@ def reproject(geoms: Union[gpd.GeoDataFrame, Path, str], raster: Union[Path, str
         return reprojected_geoms
 
 
+class GeometryCache:
+    """Geometries loaded once in memory and reprojected on demand.
+
+    The vector file is read on first use only. The reprojected geometries are memoized
+    per target CRS (only the geometries that have been requested are reprojected) and
+    the geometries that intersect a raster are selected with the spatial index, so that
+    many rasters can be processed without reading or reprojecting the geometries again.
+    """
+
+    def __init__(self, geoms: Union[gpd.GeoDataFrame, Path, str]):
+        """Constructor
+
+        Args:
+            geoms (str or Path or :obj:`gpd.GeoDataFrame`):
+                Filename of the vector data (if str) or GeoDataFrame
+        """
+        self._source = geoms
+        self._geometries = None
+        self._crs = None
+        self._reprojected = dict()
+
+    @property
+    def geometries(self) -> gpd.GeoDataFrame:
+        """Geometries in their original CRS"""
+        if self._geometries is None:
+            self._geometries = _get_geoms(self._source)
+        return self._geometries
+
+    @property
+    def crs(self) -> rasterio.crs.CRS:
+        """CRS of the geometries"""
+        if self._crs is None:
+            self._crs = _get_geoms_crs(self.geometries)
+        return self._crs
+
+    def query(self, raster: Union[Path, str], within: bool = False) -> np.ndarray:
+        """Get the positions of the geometries that intersect the raster bounds
+
+        Args:
+            raster (str or Path):
+                Raster image
+            within (bool, optional, default=False):
+                If true, select the geometries within the raster shape. Otherwise select
+                the geometries that intersect the raster shape.
+
+        Returns:
+            :obj:`np.ndarray`: Sorted positions of the selected geometries
+        """
+        file = raster.as_posix() if isinstance(raster, Path) else raster
+        with rasterio.open(file) as dataset:
+            l, b, r, t = dataset.bounds
+            px, py = ([l, l, r, r], [b, t, t, b])
+
+            if self.crs != dataset.crs:
+                px, py = warp.transform(dataset.crs, self.crs, [l, l, r, r], [b, t, t, b])
+
+        polygon = shapely.geometry.Polygon([(x, y) for x, y in zip(px, py)])
+        # predicate is applied as predicate(polygon, geometry)
+        predicate = "contains" if within else "intersects"
+        return np.sort(self.geometries.sindex.query(polygon, predicate=predicate))
+
+    def reproject(self, crs: rasterio.crs.CRS, positions: np.ndarray = None) -> gpd.GeoDataFrame:
+        """Get the geometries in the given CRS
+
+        Args:
+            crs (:obj:`rasterio.crs.CRS`):
+                Target CRS
+            positions (:obj:`np.ndarray`, optional, default=None):
+                Positions of the geometries to get. If None, all geometries are returned.
+
+        Returns:
+            :obj:`gpd.GeoDataFrame`: The geometries in the target CRS
+        """
+        geometries = self.geometries
+        if positions is not None:
+            geometries = geometries.iloc[positions]
+        else:
+            positions = np.arange(len(geometries.index))
+
+        if self.crs == crs:
+            return geometries
+
+        key = crs.to_wkt()
+        if key not in self._reprojected:
+            self._reprojected[key] = (np.empty(len(self.geometries.index), dtype=object),
+                                      np.zeros(len(self.geometries.index), dtype=bool))
+        values, done = self._reprojected[key]
+
+        # reproject the geometries that have not been reprojected yet
+        todo = positions[~done[positions]]
+        if len(todo) > 0:
+            values[todo] = np.asarray(self.geometries.geometry.iloc[todo].to_crs(crs).values,
+                                      dtype=object)
+            done[todo] = True
+
+        reprojected = gpd.GeoSeries(values[positions], index=geometries.index, crs=crs)
+        return geometries.set_geometry(reprojected)
+
+    def filter(self, raster: Union[Path, str], within: bool = False) -> gpd.GeoDataFrame:
+        """Get the geometries that intersect the raster bounds in the raster CRS.
+        Equivalent to reproject(filter(geoms, raster, within), raster).
+
+        Args:
+            raster (str or Path):
+                Raster image
+            within (bool, optional, default=False):
+                If true, select the geometries within the raster shape. Otherwise select
+                the geometries that intersect the raster shape.
+
+        Returns:
+            :obj:`gpd.GeoDataFrame`: The geometries that intersect the raster in its CRS
+        """
+        file = raster.as_posix() if isinstance(raster, Path) else raster
+        with rasterio.open(file) as dataset:
+            crs = dataset.crs
+        return self.reproject(crs, self.query(raster, within))
+
+
 def dissolve(geoms: Union[gpd.GeoDataFrame, Path, str],
              output: Union[Path, str] = None, driver: str = 'GeoJSON') -> gpd.GeoDataFrame:
     """Dissolves all geometries in one
@@ -0,0 +1,1104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Engine that computes the zonal statistics of all the geometries at once.
+
+The geometries are burnt block by block in a label raster (the label of a pixel is
+the index of the geometry + 1, 0 means that the pixel is outside all geometries) and
+the statistics of every geometry are computed by grouped reductions on the labels
+(numpy.bincount, numpy.minimum.reduceat...). Every block of the raster is thus read
+once whatever the number of geometries.
+
+A pixel can only have one label: overlapping geometries are split in several layers
+of geometries that do not overlap and one label raster is generated per layer.
+
+The accumulators of the geometries are merged block after block so that the memory
+does not depend on the extent of the geometries. In streaming mode, the median, the
+percentiles and the mad are also computed from a histogram of the values of every
+geometry: it is the right mode for geometries that are too large to be read at once.
+The histograms can be replaced by mergeable quantile sketches with a relative error bound
+that are filled in the same pass as the accumulators.
+
+Statistics per category are computed the same way: the category raster is resampled
+(nearest neighbour) on the blocks of the input image and the label of a pixel combines
+the geometry and the category of the pixel.
+
+The geometries burnt in the blocks can be kept in a :obj:`MaskCache` so that a stack of
+images of the same grid (e.g. a time series of a tile) rasterizes the geometries once. The
+size of the cache is bounded: the least recently used masks are removed from the cache.
+
+Without geometries, the label raster is the footprint of the image (pixels valid in at
+least one band) read from the masks of the blocks: the stats of the whole image are
+computed without vectorizing its footprint.
+
+The blocks are distributed over the workers of the executor (see
+:obj:`eolab.rastertools.processing.executor`): every worker reduces the blocks it
+reads and the partial results are merged in the order of the blocks so that the
+statistics do not depend on the number of workers.
+"""
+import os
+from collections import OrderedDict, defaultdict
+import hashlib
+import sys
+import threading
+from typing import List, Dict, Union
+
+import numpy as np
+import geopandas as gpd
+import rasterio
+from rasterio import features, warp
+from rasterio.enums import MaskFlags
+from rasterio.windows import Window
+from shapely.geometry import box
+from tqdm import tqdm
+
+from eolab.rastertools.processing.executor import PROCESSES, THREADS, create_executor
+from eolab.rastertools.processing.executor import close_at_shutdown, get_executor_type, imap
+
+
+REDUCIBLE_STATS = ["count", "valid", "nodata", "min", "max", "mean", "std", "sum", "range"]
+"""List of stats that can be computed by grouped reductions"""
+
+STREAMING_STATS = REDUCIBLE_STATS + ["median", "mad"]
+"""List of stats that can be computed in streaming mode (in addition to percentile_xx)"""
+
+DEFAULT_BINS = 1024
+"""Default number of bins of the histograms used in streaming mode"""
+
+MASK_CACHE_SIZE = 512 * 2**20
+"""Default maximum size (in bytes) of the masks kept in a MaskCache"""
+
+_worker = threading.local()
+"""Context of a worker: input image opened once and geometries to burn"""
+
+
+def is_reducible(stats: List[str], categorical: bool = False) -> bool:
+    """Check if the stats can be computed by the label raster engine
+
+    Args:
+        stats ([str]):
+            List of stats to compute
+        categorical (bool, optional, default=False):
+            Whether to treat the input raster as categorical
+
+    Returns:
+        bool: True if all the stats can be computed by grouped reductions
+    """
+    return not categorical and all(stat in REDUCIBLE_STATS for stat in stats)
+
+
+def is_streamable(stats: List[str], categorical: bool = False) -> bool:
+    """Check if the stats can be computed in streaming mode
+
+    Args:
+        stats ([str]):
+            List of stats to compute
+        categorical (bool, optional, default=False):
+            Whether to treat the input raster as categorical
+
+    Returns:
+        bool: True if all the stats can be computed from accumulators and histograms
+    """
+    return not categorical and all(stat in STREAMING_STATS or stat.startswith("percentile_")
+                                   for stat in stats)
+
+
+def compute_zonal_stats_by_labels(geoms: gpd.GeoDataFrame,
+                                  image: Union[str, List[str]],
+                                  bands: List[int] = [1],
+                                  stats: List[str] = ["min", "max", "mean", "std"],
+                                  block_size: int = 1024,
+                                  masks: "MaskCache" = None) -> List[List[Dict[str, float]]]:
+    """Compute the statistics of an input image for each feature in the geometries
+    by grouped reductions on a label raster. Only the stats defined in REDUCIBLE_STATS
+    can be computed.
+
+    Args:
+        geoms (GeoDataFrame):
+            Geometries where to compute stats
+        image (str or [str]):
+            Filename of the input image to process or list of images of the same grid.
+            The images of a list are read together, block after block.
+        bands ([int], optional, default=[1]):
+            List of bands to process in the input image
+        stats ([str], optional, default=["min", "max","mean", "std"]):
+            List of stats to computed
+        block_size (int, optional, default=1024):
+            Size of the blocks read in the input image
+        masks (MaskCache, optional, default=None):
+            Cache of the rasterized geometries
+
+    Returns:
+        statistics: a list of list of dictionnaries. First list on ROI, second on bands
+        (bands of the first image, then bands of the second image... when a list of images
+        is given). Dict associates the stat names and the stat values.
+    """
+    if not is_reducible(stats):
+        raise ValueError(f"Stats must be in {REDUCIBLE_STATS}")
+
+    geometries = geoms.geometry.reset_index(drop=True)
+    nb_geoms = len(geometries)
+    layers = _split_in_layers(geometries)
+
+    images = [image] if isinstance(image, str) else list(image)
+    with rasterio.open(images[0]) as src:
+        dtype = np.dtype(src.dtypes[bands[0] - 1])
+        windows = list(_block_windows(src.width, src.height, block_size))
+    all_counts, accumulators = _accumulate(images, geometries, layers, bands, windows, masks)
+
+    statistics = []
+    for i in range(1, nb_geoms + 1):
+        statistics.append([accumulator.get_stats(i, all_counts[i], stats, dtype)
+                           for accumulator in accumulators])
+    return statistics
+
+
+def compute_zonal_stats_streaming(geoms: gpd.GeoDataFrame,
+                                  image: Union[str, List[str]],
+                                  bands: List[int] = [1],
+                                  stats: List[str] = ["min", "max", "mean", "std"],
+                                  bins: int = DEFAULT_BINS,
+                                  block_size: int = 1024,
+                                  masks: "MaskCache" = None,
+                                  accuracy: float = None) -> List[List[Dict[str, float]]]:
+    """Compute the statistics of an input image for each feature in the geometries
+    in streaming mode: the raster is read block by block so that the memory is bounded
+    by the block size whatever the extent of the geometries.
+
+    The median, the percentiles and the mad are computed from a histogram of every
+    geometry whose bins range from the min to the max of the geometry. They are
+    exact for integer rasters when the range of the values of the geometry is lower
+    than the number of bins, otherwise the error is bounded by the bin width. The
+    raster is read twice when these stats are requested: the first pass computes the
+    min and max of the geometries, the second one computes the histograms. Only the non
+    empty bins are kept: memory of the histograms is proportional to the number of non empty
+    bins, lower than the number of pixels of the geometries and than the number of
+    geometries x the number of bins.
+
+    When an accuracy is given, these stats are computed from quantile sketches instead
+    of histograms: the raster is read once and the median and the percentiles have a
+    relative error lower than the accuracy (the mad is approximated from the sketch).
+    Memory of the sketches is proportional to the number of geometries x the number of
+    orders of magnitude of their values / accuracy.
+
+    When no geometries are given, the stats are computed on the footprint of the first
+    image (pixels that are valid in at least one band, see vector.get_raster_shape)
+    without vectorizing it.
+
+    Args:
+        geoms (GeoDataFrame):
+            Geometries where to compute stats. If None, stats are computed on the
+            footprint of the image.
+        image (str or [str]):
+            Filename of the input image to process or list of images of the same grid.
+            The images of a list are read together, block after block.
+        bands ([int], optional, default=[1]):
+            List of bands to process in the input image
+        stats ([str], optional, default=["min", "max","mean", "std"]):
+            List of stats to computed
+        bins (int, optional, default=1024):
+            Number of bins of the histograms
+        block_size (int, optional, default=1024):
+            Size of the blocks read in the input image
+        masks (MaskCache, optional, default=None):
+            Cache of the rasterized geometries
+        accuracy (float, optional, default=None):
+            Relative accuracy of the quantile sketches. If None, histograms are used.
+
+    Returns:
+        statistics: a list of list of dictionnaries. First list on ROI, second on bands
+        (bands of the first image, then bands of the second image... when a list of images
+        is given). Dict associates the stat names and the stat values.
+    """
+    if not is_streamable(stats):
+        raise ValueError(f"Stats must be percentile_xx or in {STREAMING_STATS}")
+
+    if geoms is None:
+        # a single zone: the footprint of the image
+        geometries, layers, nb_geoms = None, None, 1
+    else:
+        geometries = geoms.geometry.reset_index(drop=True)
+        nb_geoms = len(geometries)
+        layers = _split_in_layers(geometries)
+    quantiles = [stat for stat in stats if stat == "median" or stat == "mad"
+                 or stat.startswith("percentile_")]
+
+    images = [image] if isinstance(image, str) else list(image)
+    with rasterio.open(images[0]) as src:
+        dtype = np.dtype(src.dtypes[bands[0] - 1])
+        windows = list(_block_windows(src.width, src.height, block_size))
+    sketches = None
+    if quantiles and accuracy:
+        # quantiles are sketched in the same pass as the other stats
+        sketches = [_ZonalSketch(accuracy) for _ in range(len(images) * len(bands))]
+    all_counts, accumulators = _accumulate(images, geometries, layers, bands, windows, masks,
+                                           sketches)
+
+    histograms = []
+    if quantiles and not sketches:
+        histograms = [_ZonalHistogram(accumulator.min, accumulator.max, bins,
+                                      np.issubdtype(dtype, np.integer))
+                      for accumulator in accumulators]
+        _accumulate_histograms(images, geometries, layers, bands, windows, histograms, masks)
+
+    statistics = []
+    for i in range(1, nb_geoms + 1):
+        geom_stats = []
+        for j, accumulator in enumerate(accumulators):
+            # quantile stats are computed by the histogram, others by the accumulator
+            feature_stats = accumulator.get_stats(i, all_counts[i], stats, dtype)
+            if sketches and accumulator.count[i] > 0:
+                feature_stats.update(sketches[j].get_stats(i, quantiles, accumulator.min[i],
+                                                           accumulator.max[i]))
+            elif quantiles and accumulator.count[i] > 0:
+                feature_stats.update(histograms[j].get_stats(i, quantiles))
+            geom_stats.append(feature_stats)
+        statistics.append(geom_stats)
+    return statistics
+
+
+def compute_zonal_stats_by_category_labels(geoms: gpd.GeoDataFrame, image: str,
+                                           categories: str,
+                                           bands: List[int] = [1],
+                                           stats: List[str] = ["min", "max", "mean", "std"],
+                                           category_labels: Dict[str, str] = None,
+                                           block_size: int = 1024,
+                                           masks: "MaskCache" = None):
+    """Compute the statistics of an input image for each category of a category raster
+    in each feature of the geometries, by grouped reductions on compound labels
+    (geometry, category). Only the stats defined in REDUCIBLE_STATS can be computed.
+
+    The category raster is resampled on the grid of the input image with the nearest
+    neighbour method: the category of a pixel is the category at the center of the pixel.
+    Pixels outside the category raster or whose category is nodata do not belong to any
+    category.
+
+    Args:
+        geoms (GeoDataFrame):
+            Geometries where to compute stats
+        image (str):
+            Filename of the input image to process
+        categories (str):
+            Filename of the raster of categories
+        bands ([int], optional, default=[1]):
+            List of bands to process in the input image
+        stats ([str], optional, default=["min", "max","mean", "std"]):
+            List of stats to computed
+        category_labels (Dict[str, str], optional, default=None):
+            Dict that associates the category values and category names
+        block_size (int, optional, default=1024):
+            Size of the blocks read in the input image
+        masks (MaskCache, optional, default=None):
+            Cache of the rasterized geometries
+
+    Returns:
+        statistics: a list of list of dictionnaries. First list on ROI, second on bands.
+        Dict associates the stat names prefixed by the category name and the stat values.
+    """
+    if not is_reducible(stats):
+        raise ValueError(f"Stats must be in {REDUCIBLE_STATS}")
+
+    geometries = geoms.geometry.reset_index(drop=True)
+    nb_zones = len(geometries) + 1
+    layers = _split_in_layers(geometries)
+
+    with rasterio.open(image) as src:
+        dtype = np.dtype(src.dtypes[bands[0] - 1])
+        windows = list(_block_windows(src.width, src.height, block_size))
+
+    # index of the categories in the order of their appearance
+    classes = dict()
+    all_counts = np.zeros(0, dtype=np.int64)
+    accumulators = [_ZonalAccumulator(0) for _ in bands]
+    for values, (uniques, counts), *partials in _map_blocks(_reduce_block_categories, [image],
+                                                            geometries, layers, bands, windows,
+                                                            categories=categories, masks=masks):
+        # convert the labels of the block in global labels
+        ids = np.array([classes.setdefault(value, len(classes)) for value in values.tolist()],
+                       dtype=np.int64)
+        uniques = ids[uniques // nb_zones] * nb_zones + uniques % nb_zones
+        all_counts = np.append(all_counts,
+                               np.zeros(len(classes) * nb_zones - len(all_counts), np.int64))
+        all_counts[uniques] += counts
+        for partial, accumulator in zip(partials, accumulators):
+            labels = ids[partial[0] // nb_zones] * nb_zones + partial[0] % nb_zones
+            accumulator.resize(len(all_counts))
+            accumulator.merge((labels, *partial[1:]))
+
+    for accumulator in accumulators:
+        accumulator.resize(len(all_counts))
+
+    statistics = []
+    for zone in range(1, nb_zones):
+        geom_stats = [dict() for _ in bands]
+        for value in sorted(classes):
+            label = classes[value] * nb_zones + zone
+            if all_counts[label] == 0:
+                continue
+            name = str(int(value)) if float(value).is_integer() else str(value)
+            if category_labels:
+                name = category_labels.get(name, name)
+            for feature_stats, accumulator in zip(geom_stats, accumulators):
+                category_stats = accumulator.get_stats(label, all_counts[label], stats, dtype)
+                feature_stats.update({f"{name}{key}": val
+                                      for key, val in category_stats.items()})
+        statistics.append(geom_stats)
+    return statistics
+
+
+def _accumulate(images: List[str], geometries: gpd.GeoSeries, layers: np.ndarray,
+                bands: List[int], windows: List[Window], masks: "MaskCache" = None,
+                sketches: List["_ZonalSketch"] = None):
+    """Accumulate the values of the pixels of every geometry block by block (and fill
+    the quantile sketches if any)
+
+    Returns:
+        The number of pixels of every label and the accumulators (one per band of
+        every image)
+    """
+    nb_labels = (1 if geometries is None else len(geometries)) + 1
+    all_counts = np.zeros(nb_labels, dtype=np.int64)
+    accumulators = [_ZonalAccumulator(nb_labels) for _ in range(len(images) * len(bands))]
+    function = _reduce_block if sketches is None else _reduce_block_sketches
+    for partials in _map_blocks(function, images, geometries, layers, bands, windows,
+                                histograms=sketches, masks=masks):
+        uniques, counts = partials[0]
+        all_counts[uniques] += counts
+        for partial, accumulator in zip(partials[1:], accumulators):
+            accumulator.merge(partial)
+        for partial, sketch in zip(partials[len(accumulators) + 1:], sketches or []):
+            sketch.merge(partial)
+    return all_counts, accumulators
+
+
+def _accumulate_histograms(images: List[str], geometries: gpd.GeoSeries, layers: np.ndarray,
+                           bands: List[int], windows: List[Window],
+                           histograms: List["_ZonalHistogram"], masks: "MaskCache" = None):
+    """Accumulate the histograms of every geometry block by block"""
+    for partials in _map_blocks(_reduce_block_histograms, images, geometries, layers, bands,
+                                windows, histograms=histograms, masks=masks):
+        for partial, histogram in zip(partials, histograms):
+            histogram.merge(partial)
+
+
+def _map_blocks(function, images: List[str], geometries: gpd.GeoSeries, layers: np.ndarray,
+                bands: List[int], windows: List[Window], histograms=None, categories=None,
+                masks: "MaskCache" = None):
+    """Distribute the blocks over the workers and generate the results of the
+    function in the order of the blocks. Blocks that do not intersect any geometry
+    generate None and are skipped.
+    """
+    if get_executor_type(THREADS) == PROCESSES or geometries is None:
+        # the masks would be copied in every process and lost (and there is no
+        # geometry to burn when the stats are computed on the footprint of the image)
+        masks = None
+    masks_key = None
+    if masks is not None:
+        with rasterio.open(images[0]) as src:
+            masks_key = (MaskCache.grid_key(src), MaskCache.geometries_key(geometries))
+
+    disable = os.getenv("RASTERTOOLS_NOTQDM", 'False').lower() in ['true', '1']
+    with create_executor(THREADS,
+                         initializer=_init_worker,
+                         initargs=(images, geometries, layers, bands, histograms,
+                                   categories, masks, masks_key)) as executor:
+        results = imap(executor, function, windows)
+        for result in tqdm(results, total=len(windows), disable=disable, desc="zonalstats"):
+            if result is not None:
+                yield result
+
+
+def _init_worker(images, geometries, layers, bands, histograms, categories, masks, masks_key):
+    """Initialize a worker: open the input images (and the category raster) once for
+    all the blocks that the worker will process.
+    """
+    _worker.srcs = [close_at_shutdown(rasterio.open(image)) for image in images]
+    _worker.src = _worker.srcs[0]
+    _worker.categories = close_at_shutdown(rasterio.open(categories)) if categories else None
+    _worker.geometries = geometries
+    _worker.layers = layers
+    _worker.bands = bands
+    _worker.histograms = histograms
+    _worker.masks = masks
+    _worker.masks_key = masks_key
+
+
+def _reduce_block(window: Window):
+    """Reduce the pixels of a block: number of pixels per label and partial
+    accumulators of every band. None if no geometry intersects the block."""
+    block = _read_block(window)
+    if block is None:
+        return None
+    labels, valids, datas, _ = block
+    results = [np.unique(labels, return_counts=True)]
+    for valid, data in zip(valids, datas):
+        results.append(_ZonalAccumulator.reduce(labels[valid], data[valid]))
+    return results
+
+
+def _reduce_block_sketches(window: Window):
+    """Reduce the pixels of a block: number of pixels per label, partial accumulators
+    and partial sketches of every band. None if no geometry intersects the block."""
+    block = _read_block(window)
+    if block is None:
+        return None
+    labels, valids, datas, _ = block
+    results = [np.unique(labels, return_counts=True)]
+    for valid, data in zip(valids, datas):
+        results.append(_ZonalAccumulator.reduce(labels[valid], data[valid]))
+    for valid, data, sketch in zip(valids, datas, _worker.histograms):
+        results.append(sketch.reduce(labels[valid], data[valid]))
+    return results
+
+
+def _reduce_block_histograms(window: Window):
+    """Reduce the pixels of a block in partial histograms (one per band).
+    None if no geometry intersects the block."""
+    block = _read_block(window)
+    if block is None:
+        return None
+    labels, valids, datas, _ = block
+    return [histogram.reduce(labels[valid], data[valid])
+            for valid, data, histogram in zip(valids, datas, _worker.histograms)]
+
+
+def _reduce_block_categories(window: Window):
+    """Reduce the pixels of a block per geometry and category: values of the categories
+    in the block, number of pixels per label and partial accumulators of every band.
+    Labels are local to the block: category index in the block x nb zones + zone.
+    None if no geometry intersects the block."""
+    block = _read_block(window)
+    if block is None:
+        return None
+    labels, valids, datas, classes = block
+    inside = ~np.isnan(classes)
+    values, indexes = np.unique(classes[inside], return_inverse=True)
+    labels = indexes.reshape(-1) * (len(_worker.geometries) + 1) + labels[inside]
+    results = [values, np.unique(labels, return_counts=True)]
+    for valid, data in zip(valids, datas):
+        valid = valid[inside]
+        results.append(_ZonalAccumulator.reduce(labels[valid], data[inside][valid]))
+    return results
+
+
+def _read_block(window: Window):
+    """Read a block of the rasters and burn the geometries that intersect it. This
+    method can be called safely by several workers since it only reads the input
+    images opened by the worker.
+
+    Returns:
+        The labels of the pixels inside the geometries, the mask of the valid pixels
+        (one per band of every image), the values of the pixels (one array per band of
+        every image) and the categories
+        of the pixels (NaN when the pixel has no category, None when there is no category
+        raster). Pixels inside overlapping geometries appear once per geometry. None if
+        no geometry intersects the block.
+    """
+    src = _worker.src
+    if _worker.geometries is None:
+        burnt = _footprint_block(window)
+    elif _worker.masks is None:
+        burnt = _burn_block(window)
+    else:
+        key = _worker.masks_key + (window.flatten(),)
+        burnt = _worker.masks.get(key, lambda: _burn_block(window))
+    if burnt is None:
+        return None
+    positions, labels = burnt
+
+    bands = _worker.bands
+    datas = np.concatenate([other.read(bands, window=window).reshape(len(bands), -1)[:, positions]
+                            for other in _worker.srcs])
+    nodatas = [other.nodata for other in _worker.srcs for _ in bands]
+    classes = None
+    if _worker.categories is not None:
+        # categories at the center of the pixels of the block
+        classes = np.full((window.height, window.width), np.nan)
+        warp.reproject(rasterio.band(_worker.categories, 1), classes,
+                       dst_transform=src.window_transform(window), dst_crs=src.crs,
+                       dst_nodata=np.nan, resampling=warp.Resampling.nearest)
+        classes = classes.reshape(-1)[positions]
+    return (labels, [_valid_mask(data, nodata) for data, nodata in zip(datas, nodatas)],
+            datas, classes)
+
+
+def _burn_block(window: Window):
+    """Burn the geometries that intersect a block, layer after layer
+
+    Returns:
+        The positions (index in the flattened block) and the labels of the pixels inside
+        the geometries. Pixels inside overlapping geometries appear once per geometry.
+        None if no geometry intersects the block.
+    """
+    src = _worker.src
+    geometries = _worker.geometries
+    layers = _worker.layers
+
+    # geometries whose bounding box intersects the block
+    candidates = geometries.sindex.query(box(*src.window_bounds(window)))
+    if len(candidates) == 0:
+        return None
+
+    transform = src.window_transform(window)
+    all_positions, all_labels = [], []
+    for layer in np.unique(layers[candidates]):
+        shapes = [(geometries.iloc[i], i + 1)
+                  for i in candidates[layers[candidates] == layer]]
+        labels = features.rasterize(shapes, out_shape=(window.height, window.width),
+                                    transform=transform, fill=0, dtype=np.int32).reshape(-1)
+        positions = np.flatnonzero(labels).astype(np.int32)
+        all_positions.append(positions)
+        all_labels.append(labels[positions])
+
+    return np.concatenate(all_positions), np.concatenate(all_labels)
+
+
+def _footprint_block(window: Window):
+    """Get the pixels of a block that are valid in at least one band of the image
+
+    Returns:
+        The positions (index in the flattened block) and the labels (1) of the valid
+        pixels. None if the block does not contain any valid pixel.
+    """
+    src = _worker.src
+    if all(MaskFlags.all_valid in flags for flags in src.mask_flag_enums):
+        positions = np.arange(window.height * window.width, dtype=np.int32)
+    else:
+        masks = src.read_masks(window=window)
+        positions = np.flatnonzero(np.any(masks > 0, axis=0)).astype(np.int32)
+        if len(positions) == 0:
+            return None
+    return positions, np.ones(len(positions), dtype=np.int32)
+
+
+class MaskCache:
+    """Cache of the geometries burnt in a raster grid. The masks are identified by the
+    grid of the raster (crs, transform and shape), the set of geometries and a key that
+    identifies the mask in the grid (e.g. a block or a geometry). A stack of images
+    of the same grid processed with the same geometries rasterizes the geometries once.
+
+    The size of the cache is bounded by a number of bytes (size of the numpy arrays of the
+    masks): the least recently used masks are removed when it is exceeded, so that a run
+    over many grids (e.g. many tiles) does not keep the masks of all the grids.
+
+    The cache is shared by the workers of the "serial" and "threads" backends. It is not
+    used with the "processes" backend since the masks computed by the workers would be
+    lost.
+    """
+
+    def __init__(self, max_size: int = MASK_CACHE_SIZE):
+        """Constructor
+
+        Args:
+            max_size (int, optional, default=MASK_CACHE_SIZE):
+                Maximum size (in bytes) of the masks kept in the cache
+        """
+        self.max_size = max_size
+        self.size = 0
+        self._masks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._masks)
+
+    def clear(self):
+        """Remove all the masks of the cache"""
+        with self._lock:
+            self._masks.clear()
+            self.size = 0
+
+    def get(self, key: tuple, function):
+        """Get a mask of the cache or compute it if it is not in the cache
+
+        Args:
+            key (tuple):
+                Key of the mask (see grid_key and geometries_key)
+            function (Callable):
+                Function with no argument that computes the mask
+
+        Returns:
+            The mask
+        """
+        with self._lock:
+            if key in self._masks:
+                self._masks.move_to_end(key)
+                return self._masks[key][0]
+        mask = function()
+        size = _nbytes(mask)
+        with self._lock:
+            if key not in self._masks and size <= self.max_size:
+                self._masks[key] = mask, size
+                self.size += size
+                # remove the least recently used masks
+                while self.size > self.max_size:
+                    _, (_, removed) = self._masks.popitem(last=False)
+                    self.size -= removed
+        return mask
+
+    @staticmethod
+    def grid_key(src) -> tuple:
+        """Get the key of the grid of a raster
+
+        Args:
+            src (rasterio.DatasetReader):
+                The raster
+
+        Returns:
+            tuple: the crs, the geo transform and the shape of the raster
+        """
+        crs = src.crs.to_wkt() if src.crs else None
+        return crs, tuple(src.transform), src.shape
+
+    @staticmethod
+    def geometries_key(geometries) -> str:
+        """Get the key of a set of geometries
+
+        Args:
+            geometries (Iterable[shapely geometry]):
+                The geometries in the order of their labels
+
+        Returns:
+            str: digest of the geometries
+        """
+        digest = hashlib.sha1()
+        for geometry in geometries:
+            wkb = geometry.wkb
+            digest.update(len(wkb).to_bytes(8, "little"))
+            digest.update(wkb)
+        return digest.hexdigest()
+
+
+def _nbytes(value) -> int:
+    """Get the size in bytes of a mask (arrays, windows, tuples or lists of them)"""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(_nbytes(item) for item in value)
+    return sys.getsizeof(value)
+
+
+class _ZonalAccumulator:
+    """Accumulates the values of the pixels per label: count, sum, min, max and the
+    sum of squared differences to the mean (merged block after block with the
+    parallel algorithm of Chan et al.)
+    """
+
+    def __init__(self, size: int):
+        """Constructor
+
+        Args:
+            size (int):
+                Number of labels
+        """
+        self.count = np.zeros(size, dtype=np.int64)
+        self.sum = np.zeros(size, dtype=np.float64)
+        self.m2 = np.zeros(size, dtype=np.float64)
+        self.min = np.full(size, np.inf)
+        self.max = np.full(size, -np.inf)
+
+    def resize(self, size: int):
+        """Add labels to the accumulator
+
+        Args:
+            size (int):
+                New number of labels (greater or equal than the current one)
+        """
+        extent = size - len(self.count)
+        if extent > 0:
+            self.count = np.append(self.count, np.zeros(extent, dtype=np.int64))
+            self.sum = np.append(self.sum, np.zeros(extent))
+            self.m2 = np.append(self.m2, np.zeros(extent))
+            self.min = np.append(self.min, np.full(extent, np.inf))
+            self.max = np.append(self.max, np.full(extent, -np.inf))
+
+    @staticmethod
+    def reduce(labels: np.ndarray, values: np.ndarray):
+        """Reduce the values of the pixels of a block per label
+
+        Args:
+            labels (np.ndarray):
+                Labels of the pixels
+            values (np.ndarray):
+                Values of the pixels
+
+        Returns:
+            The labels present in the block and, for every label, the count, the sum,
+            the sum of squared differences to the mean, the min and the max
+        """
+        order = np.argsort(labels, kind="stable")
+        values = values[order].astype(np.float64)
+        uniques, starts = np.unique(labels[order], return_index=True)
+        if len(uniques) == 0:
+            return uniques, *([np.zeros(0)] * 5)
+
+        count = np.diff(np.append(starts, len(values)))
+        total = np.add.reduceat(values, starts)
+        deviations = values - np.repeat(total / count, count)
+        m2 = np.add.reduceat(deviations ** 2, starts)
+        return (uniques, count, total, m2,
+                np.minimum.reduceat(values, starts), np.maximum.reduceat(values, starts))
+
+    def merge(self, partial):
+        """Merge the partial accumulator of a block (see reduce)
+
+        Args:
+            partial:
+                The partial accumulator of a block
+        """
+        uniques, count, total, m2, vmin, vmax = partial
+        if len(uniques) == 0:
+            return
+
+        # merge the variance of the block with the variance of the previous blocks
+        previous = self.count[uniques]
+        merged = previous + count
+        with np.errstate(divide='ignore', invalid='ignore'):
+            delta = total / count - np.where(previous > 0, self.sum[uniques] / previous, 0)
+            correction = np.where(previous > 0, delta ** 2 * previous * count / merged, 0)
+        self.m2[uniques] += m2 + correction
+        self.count[uniques] = merged
+        self.sum[uniques] += total
+        self.min[uniques] = np.minimum(self.min[uniques], vmin)
+        self.max[uniques] = np.maximum(self.max[uniques], vmax)
+
+    def get_stats(self, label: int, all_count: int, stats: List[str],
+                  dtype: np.dtype) -> Dict[str, float]:
+        """Get the statistics of a label
+
+        Args:
+            label (int):
+                The label
+            all_count (int):
+                Number of pixels (valid or not) that have the label
+            stats ([str]):
+                The stats to compute
+            dtype (np.dtype):
+                Type of the input data. Stats of floating data are computed
+                with the precision of the data like numpy.ma does.
+
+        Returns:
+            The statistics as a dict that associates the stats names and the stats values.
+        """
+        count = int(self.count[label])
+        if count == 0:
+            # nothing here, fill with None
+            feature_stats = dict([(stat, None) for stat in stats])
+        else:
+            cast = dtype.type if np.issubdtype(dtype, np.floating) else np.float64
+            mean = self.sum[label] / count
+            values = {
+                'min': self.min[label],
+                'max': self.max[label],
+                'mean': cast(mean),
+                'sum': cast(self.sum[label]),
+                'std': cast(np.sqrt(self.m2[label] / count))
+            }
+            feature_stats = dict()
+            for key, value in values.items():
+                if key in stats:
+                    feature_stats[key] = float(value)
+            if 'range' in stats:
+                feature_stats['range'] = float(self.max[label]) - float(self.min[label])
+
+        # generate the counting stats
+        if "count" in stats:
+            feature_stats['count'] = count
+        if 'nodata' in stats:
+            feature_stats['nodata'] = int(all_count) - count
+        if 'valid' in stats:
+            feature_stats['valid'] = 1.0 * count / (all_count + 1e-5)
+
+        return feature_stats
+
+
+class _SparseCounts:
+    """Counts of the values of the pixels per label and bucket. Only the non empty buckets
+    are kept (sorted sparse indexes label x size + bucket) so that the memory is bounded by
+    the number of non empty buckets whatever the number of labels.
+    """
+
+    def __init__(self, size: int):
+        """Constructor
+
+        Args:
+            size (int):
+                Number of buckets of every label
+        """
+        self.size = size
+        self.indexes = np.zeros(0, dtype=np.int64)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self._partials = []
+        self._pending = 0
+
+    def merge(self, partial):
+        """Merge the partial counts of a block (see reduce)
+
+        Args:
+            partial:
+                The indexes of the non empty buckets of a block and their counts
+        """
+        self._partials.append(partial)
+        self._pending += len(partial[0])
+        # the partials are compacted when they outgrow the counts
+        if self._pending > max(len(self.indexes), 65536):
+            self._compact()
+
+    def _compact(self):
+        """Merge the pending partial counts in the counts"""
+        if not self._partials:
+            return
+        indexes = np.concatenate([self.indexes] + [indexes for indexes, _ in self._partials])
+        counts = np.concatenate([self.counts] + [counts for _, counts in self._partials])
+        self.indexes, inverse = np.unique(indexes, return_inverse=True)
+        self.counts = np.bincount(inverse.reshape(-1), weights=counts,
+                                  minlength=len(self.indexes)).astype(np.int64)
+        self._partials = []
+        self._pending = 0
+
+    def _get_counts(self, label: int):
+        """Get the non empty buckets of a label (sorted) and their counts"""
+        self._compact()
+        start, end = np.searchsorted(self.indexes, [label * self.size, (label + 1) * self.size])
+        return self.indexes[start:end] - label * self.size, self.counts[start:end]
+
+
+class _ZonalHistogram(_SparseCounts):
+    """Histograms of the values of the pixels per label. The bins of a label range
+    from the min to the max of the label. For integer data, bins have a width of 1
+    when the range of the label is lower than the number of bins so that the
+    histogram is exact (as well as for labels with a constant value). Only the non
+    empty bins are kept.
+    """
+
+    def __init__(self, vmin: np.ndarray, vmax: np.ndarray, bins: int, integer: bool):
+        """Constructor
+
+        Args:
+            vmin (np.ndarray):
+                Min value of every label
+            vmax (np.ndarray):
+                Max value of every label
+            bins (int):
+                Number of bins of every histogram
+            integer (bool):
+                Whether the data are integer values
+        """
+        super().__init__(bins)
+        self.bins = bins
+        valid = vmax >= vmin
+        self.vmin = np.where(valid, vmin, 0)
+        span = np.where(valid, vmax - vmin, 0)
+        self.exact = (integer & (span < bins)) | (span == 0)
+        self.width = np.where(self.exact, 1, span / bins)
+        self.width[self.width == 0] = 1
+
+    def reduce(self, labels: np.ndarray, values: np.ndarray):
+        """Reduce the values of the pixels of a block in partial histograms
+
+        Args:
+            labels (np.ndarray):
+                Labels of the pixels
+            values (np.ndarray):
+                Values of the pixels
+
+        Returns:
+            The indexes of the non empty bins (label x bins + bin) and their counts
+        """
+        index = np.floor((values.astype(np.float64) - self.vmin[labels]) / self.width[labels])
+        index = np.clip(index, 0, self.bins - 1).astype(np.int64)
+        return np.unique(labels.astype(np.int64) * self.bins + index, return_counts=True)
+
+    def get_stats(self, label: int, stats: List[str]) -> Dict[str, float]:
+        """Get the quantile stats (median, percentile_xx, mad) of a label
+
+        Args:
+            label (int):
+                The label
+            stats ([str]):
+                The stats to compute
+
+        Returns:
+            The statistics as a dict that associates the stats names and the stats values.
+        """
+        bins, counts = self._get_counts(label)
+        # value of every bin: exact value or center of the bin
+        offset = 0 if self.exact[label] else 0.5
+        values = self.vmin[label] + (bins + offset) * self.width[label]
+
+        feature_stats = dict()
+        median = _weighted_percentile(values, counts, 50)
+        for stat in stats:
+            if stat == "median":
+                feature_stats[stat] = median
+            elif stat == "mad":
+                deviations = np.abs(values - median)
+                order = np.argsort(deviations)
+                feature_stats[stat] = _weighted_percentile(deviations[order], counts[order], 50)
+            else:
+                q = float(stat.replace("percentile_", ''))
+                feature_stats[stat] = _weighted_percentile(values, counts, q)
+        return feature_stats
+
+
+class _ZonalSketch(_SparseCounts):
+    """Mergeable quantile sketches of the values of the pixels per label. The values are
+    counted in buckets of logarithmic width so that every bucket value is within a relative
+    error (the accuracy) of the values it counts: the median and the percentiles have the
+    same relative error bound whatever the distribution of the values (see DDSketch,
+    Masson et al. 2019). The sketches are filled in a single pass and only the non empty
+    buckets are kept.
+    """
+
+    def __init__(self, accuracy: float):
+        """Constructor
+
+        Args:
+            accuracy (float):
+                Relative accuracy of the quantiles, in range ]0, 1[
+        """
+        self.accuracy = accuracy
+        self.log_gamma = np.log((1 + accuracy) / (1 - accuracy))
+        # bucket of the smallest and greatest float64 values (in absolute value)
+        self.offset = int(np.ceil(746 / self.log_gamma)) + 1
+        # bucket 0 is for zeros, buckets of negative values are lower than 0
+        super().__init__(4 * self.offset + 1)
+
+    def reduce(self, labels: np.ndarray, values: np.ndarray):
+        """Reduce the values of the pixels of a block in partial sketches
+
+        Args:
+            labels (np.ndarray):
+                Labels of the pixels
+            values (np.ndarray):
+                Values of the pixels
+
+        Returns:
+            The indexes of the non empty buckets (label x buckets + bucket) and their counts
+        """
+        values = values.astype(np.float64)
+        magnitudes = np.abs(values)
+        nonzero = magnitudes > 0
+        buckets = np.zeros(len(values), dtype=np.int64)
+        buckets[nonzero] = np.ceil(np.log(magnitudes[nonzero]) / self.log_gamma) + self.offset
+        buckets = np.sign(values).astype(np.int64) * buckets + 2 * self.offset
+        return np.unique(labels.astype(np.int64) * self.size + buckets, return_counts=True)
+
+    def get_stats(self, label: int, stats: List[str], vmin: float,
+                  vmax: float) -> Dict[str, float]:
+        """Get the quantile stats (median, percentile_xx, mad) of a label
+
+        Args:
+            label (int):
+                The label
+            stats ([str]):
+                The stats to compute
+            vmin (float):
+                Min value of the label, used to bound the values of the buckets
+            vmax (float):
+                Max value of the label, used to bound the values of the buckets
+
+        Returns:
+            The statistics as a dict that associates the stats names and the stats values.
+        """
+        buckets, counts = self._get_counts(label)
+        # value of every bucket: value with the lowest relative error to the bucket bounds
+        buckets = buckets - 2 * self.offset
+        signs = np.sign(buckets)
+        exponents = np.abs(buckets) - self.offset
+        values = signs * 2 * np.exp(exponents * self.log_gamma) / (1 + np.exp(self.log_gamma))
+        # the values of the label are in range [vmin, vmax]
+        values = np.clip(values, vmin, vmax)
+
+        feature_stats = dict()
+        median = _weighted_percentile(values, counts, 50)
+        for stat in stats:
+            if stat == "median":
+                feature_stats[stat] = median
+            elif stat == "mad":
+                deviations = np.abs(values - median)
+                order = np.argsort(deviations)
+                feature_stats[stat] = _weighted_percentile(deviations[order], counts[order], 50)
+            else:
+                q = float(stat.replace("percentile_", ''))
+                feature_stats[stat] = _weighted_percentile(values, counts, q)
+        return feature_stats
+
+
+def _weighted_percentile(values: np.ndarray, counts: np.ndarray, q: float) -> float:
+    """Compute a percentile of sorted values that occur several times, with the
+    linear interpolation of numpy.percentile
+
+    Args:
+        values (np.ndarray):
+            Sorted values
+        counts (np.ndarray):
+            Number of occurrences of every value
+        q (float):
+            Percentile to compute (in range [0, 100])
+
+    Returns:
+        float: the percentile
+    """
+    cumcounts = np.cumsum(counts)
+    position = q / 100. * (cumcounts[-1] - 1)
+    lower = int(np.floor(position))
+    upper = min(lower + 1, cumcounts[-1] - 1)
+    vlower = values[np.searchsorted(cumcounts, lower, side="right")]
+    vupper = values[np.searchsorted(cumcounts, upper, side="right")]
+    return float(vlower + (vupper - vlower) * (position - lower))
+
+
+def _valid_mask(data: np.ndarray, nodata) -> np.ndarray:
+    """Mask of the valid pixels of the data, i.e. pixels that are not nodata"""
+    if nodata and np.isnan(nodata):
+        return ~np.isnan(data)
+    else:
+        return ~(data == nodata)
+
+
+def _block_windows(width: int, height: int, block_size: int):
+    """Generate the windows of the blocks that cover a raster"""
+    for row in range(0, height, block_size):
+        for col in range(0, width, block_size):
+            yield Window(col, row, min(block_size, width - col), min(block_size, height - row))
+
+
+def _split_in_layers(geometries: gpd.GeoSeries) -> np.ndarray:
+    """Split the geometries in layers of geometries that do not overlap
+
+    Args:
+        geometries (GeoSeries):
+            The geometries with a RangeIndex
+
+    Returns:
+        np.ndarray: the index of the layer of every geometry
+    """
+    layers = np.zeros(len(geometries), dtype=int)
+    valid = ~(geometries.isna() | geometries.is_empty)
+    if not valid.any():
+        return layers
+
+    # pairs of geometries whose interiors intersect
+    left, right = geometries.sindex.query(geometries[valid], predicate="intersects")
+    left = np.flatnonzero(valid)[left]
+    keep = left < right
+    left, right = left[keep], right[keep]
+    if len(left) > 0:
+        touches = geometries.iloc[left].reset_index(drop=True).touches(
+            geometries.iloc[right].reset_index(drop=True))
+        overlaps = ~touches.to_numpy()
+        left, right = left[overlaps], right[overlaps]
+
+    # every geometry goes in the first layer that does not contain one of
+    # the previous geometries it overlaps
+    previous = defaultdict(list)
+    for i, j in zip(left, right):
+        previous[j].append(i)
+    for j in sorted(previous.keys()):
+        used = set(layers[previous[j]])
+        layer = 0
+        while layer in used:
+            layer += 1
+        layers[j] = layer
+
+    return layers
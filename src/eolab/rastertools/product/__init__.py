@@ -21,5 +21,9 @@ RasterType.add(json.load(importlib.resources.open_binary("eolab.rastertools.prod
 def s2_maja_mask(in_ar, out_ar, xoff, yoff, xsize, ysize,
                  raster_xsize, raster_ysize, buf_radius, gt, **kwargs):
     """Computes the mask band from the Sentinel2 L2A MAJA cloud mask
+
+    The mask band of the generated VRTs is evaluated by the built-in GDAL equivalent of
+    this function (see :obj:`eolab.rastertools.product.vrt.NATIVE_MASKFUNCS`). This python
+    pixel function is only used when the native evaluation is disabled.
     """
     out_ar[:] = np.where(np.sum(in_ar, axis=0) == 0, 1, 0)
@@ -3,22 +3,29 @@
 """
 Data Model for raster product enabling to extract bands, timestamp, etc.
 """
+from contextlib import closing
 from typing import Dict, List, Union, Tuple
 from pathlib import Path
 from datetime import datetime
+import hashlib
+import json
 import logging
+import os
 import re
+import shutil
+import sqlite3
 import tarfile
+import time
 import zipfile
-import tempfile
 from uuid import uuid4
 
 from osgeo import gdal
 import rasterio
 
-from eolab.rastertools import utils
+from eolab.rastertools import __version__, utils
 from eolab.rastertools.product import RasterType
-from eolab.rastertools.product.vrt import add_masks_to_vrt, set_band_descriptions
+from eolab.rastertools.product.scratch import get_scratchdir, release, transcode
+from eolab.rastertools.product.vrt import masked_vrt, set_band_descriptions, write_vrt
 from eolab.rastertools.processing.vector import crop
 
 __author__ = "Olivier Queyrut"
@@ -29,6 +36,17 @@ __license__ = "Apache v2.0"
 _logger = logging.getLogger(__name__)
 
 
+ARCHIVES_INDEX = "archives.sqlite"
+"""Name of the SQLite index of the archives members, stored in the cache dir"""
+
+CACHE_MAX_AGE = 30
+"""Default number of days after which the unused entries of the cache of VRTs are removed"""
+
+SCRATCH_FILES = "scratch.json"
+"""Name of the list of the files transcoded in the scratch dir, stored in the entries of the
+cache of VRTs"""
+
+
 class RasterProduct:
     """Data model for a raster product that handles :
 
@@ -66,6 +84,9 @@ class RasterProduct:
         self._file = utils.to_path(file)
         self._vrt_outputdir = vrt_outputdir
         self._in_memory_vrts = []
+        # files transcoded in the scratch dir and copies pinned while the product is used
+        self._transcoded_files = []
+        self._scratch_copies = []
 
         # try to identify the type of raster product from the input file name
         self._rastertype = RasterType.find(self._file)
@@ -83,11 +104,9 @@ class RasterProduct:
                               "unknown raster type")
                 raise ValueError(f"Unrecognized raster type for input file {file}")
 
-            # extract bands files and masks files
-            bands_regexp = self.rastertype.get_bands_regexp()
-            masks_regexp = self.rastertype.get_mask_regexp()
-            self._bands_files, self._masks_files = \
-                _extract_bands(self.file, bands_regexp, masks_regexp)
+            # bands files and masks files are extracted on demand (not needed when the
+            # raster is in the cache of VRTs)
+            self._bands_files, self._masks_files = None, None
 
         else:
             # inputfile is a regular image file.
@@ -112,10 +131,12 @@ class RasterProduct:
         self.free_in_memory_vrts()
 
     def free_in_memory_vrts(self):
-        """Free in memory vrts"""
+        """Free in memory vrts and release the copies of the scratch dir they reference"""
         for vrt in self._in_memory_vrts:
             gdal.Unlink(vrt.as_posix())
         self._in_memory_vrts = []
+        release(self._scratch_copies)
+        self._scratch_copies = []
 
     @property
     def file(self) -> Path:
@@ -138,6 +159,8 @@ class RasterProduct:
         value is the path to the band. If all bands are in the same file, the
         dictionary contains only one key named "all".
         """
+        if self._bands_files is None:
+            self.__extract_bands()
         return self._bands_files
 
     @property
@@ -145,8 +168,22 @@ class RasterProduct:
         """Dictionary of available mask bands. Key is the identifier of the mask band,
         value is the path to the band.
         """
+        if self._masks_files is None:
+            self.__extract_bands()
         return self._masks_files
 
+    def __extract_bands(self):
+        """Extract the bands files and masks files from the archive"""
+        bands_regexp = self.rastertype.get_bands_regexp()
+        masks_regexp = self.rastertype.get_mask_regexp()
+        self._bands_files, self._masks_files = \
+            _extract_bands(self.file, bands_regexp, masks_regexp)
+
+    @property
+    def vrt_outputdir(self):
+        """Dir where the generated VRT image(s) are stored. None if they are in memory"""
+        return self._vrt_outputdir
+
     @property
     def is_archive(self):
         """Whether the raster product is an archive (zip, tar, dir, ...) or
@@ -233,13 +270,24 @@ class RasterProduct:
                 Whether to create the VRT product with a maskband that is a composition
                 of all the given masks.
 
+        If the environment variable RASTERTOOLS_CACHEDIR is set (see option --cachedir) and
+        the VRTs are generated in memory, the VRTs are stored in the cache dir and reused by
+        the next calls (including the calls in other runs) for the same product, bands, masks
+        and ROI.
+
+        If the environment variable RASTERTOOLS_SCRATCHDIR is set (see option --scratchdir),
+        the VRTs reference local GeoTIFF copies of the JPEG2000 files of the product.
+
         Returns:
             str: Raster path (either a path to a regular image or
                  a memory path such as /vsimem/...)"""
 
+        cachedir = get_cachedir()
         if self.is_archive is False:
             # general case: product is a regular raster image
             rasterfile = self.file
+        elif self._vrt_outputdir is None and cachedir is not None:
+            rasterfile = self.__get_cached_raster(cachedir, bands, masks, roi, create_maskband)
         else:
             selected_bands, band_descriptions = self.__get_bands(bands)
             selected_masks, mask_descriptions = self.__get_masks(masks)
@@ -274,17 +322,137 @@ class RasterProduct:
                 # get the number of bands and masks to separate them in the generated VRT
                 nb_bands = len(selected_bands)
                 nb_masks = len(selected_masks)
-                masked_image = self.__apply_masks(rasterfile, nb_bands, nb_masks, uuid=uuid)
+                masked_image = self.__apply_masks(rasterfile, nb_bands, nb_masks,
+                                                  band_descriptions, uuid=uuid)
                 if in_memory:
                     self._in_memory_vrts.append(masked_image)
 
-                # add band descriptions only
-                set_band_descriptions(masked_image, band_descriptions)
-
                 rasterfile = masked_image
 
         return rasterfile.as_posix()
 
+    def __get_cached_raster(self, cachedir: Path,
+                            bands: Union[str, List[str]] = "all",
+                            masks: Union[str, List[str]] = "all",
+                            roi: Union[Path, str] = None,
+                            create_maskband: bool = True) -> Path:
+        """Gets the raster from the cache of VRTs, creating the VRTs in the cache if they
+        do not exist yet.
+
+        Every entry of the cache is a dir named after a hash of the product path, its mtime
+        and size (the mtime and size of all its files for a dir), the definition of the
+        rastertype, the bands, the masks, the content of the ROI and the version of rastertools.
+        The VRTs of an entry are generated in a temporary dir renamed atomically so that
+        concurrent runs never read an incomplete entry.
+
+        The mtime of an entry is updated every time it is used. When an entry is added, the
+        entries that have not been used for RASTERTOOLS_CACHEMAXAGE days (see get_cache_max_age)
+        are removed.
+
+        Args:
+            cachedir (Path):
+                Dir of the cache
+            bands (str or [str], default="all"):
+                List of bands ids to get in the generated raster
+            masks (str or [str], default="all"):
+                List of masks bands ids to get in the generated raster
+            roi (Path or str, optional, default=None):
+                Region of interest for cropping the raster
+            create_maskband (bool, optional, default=True):
+                Whether to create the VRT product with a maskband
+
+        Returns:
+            Path: path to the raster file in the cache
+        """
+        roi = utils.to_path(roi).resolve() if roi else None
+        entry = cachedir.joinpath(self.__get_cache_key(bands, masks, roi, create_maskband))
+        try:
+            # mark the entry as used (before it can be pruned by a concurrent run)
+            os.utime(entry)
+            cached = True
+        except FileNotFoundError:
+            cached = False
+        if cached:
+            _logger.debug(f"Reusing the VRT of {self.file} in the cache {entry}")
+        else:
+            _logger.debug(f"Adding the VRT of {self.file} to the cache {entry}")
+            builddir = cachedir.joinpath(f"{entry.name}-{uuid4()}")
+            builddir.mkdir(parents=True)
+            try:
+                # absolute paths so that the VRTs can be used from any working dir
+                with RasterProduct(self.file.resolve(), vrt_outputdir=builddir) as product:
+                    product.get_raster(bands, masks, roi, create_maskband)
+                    if product._transcoded_files:
+                        builddir.joinpath(SCRATCH_FILES).write_text(
+                            json.dumps(product._transcoded_files))
+                try:
+                    builddir.rename(entry)
+                except OSError:
+                    # the entry has been added by a concurrent run
+                    if not entry.is_dir():
+                        raise
+            finally:
+                shutil.rmtree(builddir, ignore_errors=True)
+            _prune_cache(cachedir, get_cache_max_age())
+
+        scratch_files = entry.joinpath(SCRATCH_FILES)
+        if scratch_files.exists():
+            # pin the copies referenced by the VRTs and transcode again the copies removed
+            # from the scratch dir since the entry was created: they have the same names,
+            # the VRTs are still valid
+            self._scratch_copies.extend(
+                transcode(json.loads(scratch_files.read_text()), self.file.resolve()))
+
+        # the raster is the last VRT generated by get_raster
+        basename = utils.get_basename(self.file)
+        candidates = [entry.joinpath(f"{basename}{suffix}.vrt")
+                      for suffix in ["-mask", "-clipped", ""]]
+        return next(f for f in candidates if f.exists())
+
+    def __get_cache_key(self, bands: Union[str, List[str]], masks: Union[str, List[str]],
+                        roi: Path, create_maskband: bool) -> str:
+        """Gets the key of the raster in the cache of VRTs"""
+        if self.file.is_dir():
+            # the mtime of a dir does not change when a file is rewritten in place
+            files = [Path(root, name) for root, _, names in os.walk(self.file, followlinks=True)
+                     for name in names]
+            stats = sorted([f.relative_to(self.file).as_posix(), f.stat().st_mtime_ns,
+                            f.stat().st_size] for f in files)
+        else:
+            stat = self.file.stat()
+            stats = [stat.st_mtime_ns, stat.st_size]
+        scratchdir = get_scratchdir()
+        roi_hash = None
+        if roi is not None:
+            # hash the content of the ROI, including the sidecar files of a shapefile
+            roi_files = sorted(roi.parent.glob(f"{roi.stem}.*")) \
+                if roi.suffix.lower() == ".shp" else [roi]
+            digest = hashlib.sha256()
+            for roi_file in roi_files:
+                digest.update(roi_file.name.encode())
+                digest.update(roi_file.read_bytes())
+            roi_hash = digest.hexdigest()
+
+        rastertype = self.rastertype
+        key = {
+            "version": __version__,
+            "file": self.file.resolve().as_posix(),
+            "stats": stats,
+            "rastertype": [rastertype.name, rastertype.product_pattern,
+                           rastertype.bands_pattern, rastertype.date_format,
+                           rastertype.maskfunc, rastertype.nodata, rastertype.masknodata,
+                           [[channel.value, rastertype.get_band_id(channel),
+                             rastertype.get_band_description(channel)]
+                            for channel in rastertype.channels],
+                           rastertype.get_mask_ids(), rastertype.get_mask_descriptions()],
+            "bands": bands,
+            "masks": masks,
+            "roi": roi_hash,
+            "maskband": create_maskband,
+            "scratchdir": scratchdir.as_posix() if scratchdir else None
+        }
+        return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
     def __get_bands(self, bands: Union[str, List[str]] = "all"):
         """Gets the bands files and descriptions corresponding to the given bands ids.
 
@@ -401,6 +569,12 @@ class RasterProduct:
             bands.extend([masks_files[id] for id in self.rastertype.get_mask_ids()])
             nodatavals.append(str(self.rastertype.masknodata))
 
+        # reference the local copies of the JPEG2000 files (see option --scratchdir)
+        if get_scratchdir() is not None:
+            self._transcoded_files = bands
+            bands = transcode(bands, self.file)
+            self._scratch_copies.extend(bands)
+
         # Create a VRT image with GDAL
         rasterfile = outdir.joinpath(f"{uuid}{basename}.vrt")
         ds = gdal.BuildVRT(rasterfile.as_posix(),
@@ -441,9 +615,13 @@ class RasterProduct:
 
         return clipped_image
 
-    def __apply_masks(self, input_vrt: Path, nb_bands: int, nb_masks: int, uuid: str = "") -> Path:
+    def __apply_masks(self, input_vrt: Path, nb_bands: int, nb_masks: int,
+                      descriptions: List[str] = None, uuid: str = "") -> Path:
         """Use the masks files to mask the raster data.
 
+        The masked VRT is generated in memory from the input VRT (without any temporary file)
+        and written once to the output dir.
+
         Args:
             input_vrt (Path):
                 The input VRT to mask
@@ -451,6 +629,8 @@ class RasterProduct:
                 Number of bands in the input vrt
             nb_masks (int):
                 Number of masks in the input vrt
+            descriptions ([str], optional, default=None):
+                Descriptions of the bands
             uuid (str):
                 Unique identifier when the VRT is created in memory
 
@@ -461,35 +641,64 @@ class RasterProduct:
         outdir = utils.to_path(self._vrt_outputdir, "/vsimem/")
         basename = utils.get_basename(self.file)
 
-        # create a tempdir for generated temporary files
-        tempdir = Path(tempfile.gettempdir())
-
-        # create a new vrt with only bands_files
-        # it must be written to disk so that we can read it and add a maskband
-        temp_image = tempdir.joinpath(f"{uuid}{basename}-temp.vrt")
-        ds = gdal.BuildVRT(temp_image.as_posix(), input_vrt.as_posix(),
-                           bandList=range(1, nb_bands + 1))
-        # free resource from GDAL
-        del ds
-
-        # Add mask band
+        # create a new vrt with only the bands and a mask band computed from the masks
         _logger.debug("Adding band masks")
+        bands_index = list(range(1, nb_bands + 1))
         masks_index = list(range(nb_bands + 1, nb_bands + nb_masks + 1))
-        vrt_new_content = add_masks_to_vrt(temp_image, input_vrt, masks_index,
-                                           self.rastertype.maskfunc)
-        driver = gdal.GetDriverByName('VRT')
-        vrt = gdal.Open(vrt_new_content)
+        vrt_content = masked_vrt(input_vrt, bands_index, masks_index, self.rastertype.maskfunc,
+                                 descriptions=descriptions)
         masked_image = outdir.joinpath(f"{uuid}{basename}-mask.vrt")
-        copy_ds = driver.CreateCopy(masked_image.as_posix(), vrt, strict=0)
-        del copy_ds
-        # delete temp image
-        temp_image.unlink()
-        # free resource from GDAL
-        del vrt
+        write_vrt(vrt_content, masked_image)
 
         return masked_image
 
 
+def get_cachedir() -> Path:
+    """Get the dir of the persistent cache of VRTs defined by the environment variable
+    RASTERTOOLS_CACHEDIR (see option --cachedir).
+
+    Returns:
+        Path: the dir of the cache, None if the cache is disabled
+    """
+    cachedir = os.getenv("RASTERTOOLS_CACHEDIR")
+    return Path(cachedir).absolute() if cachedir else None
+
+
+def get_cache_max_age() -> float:
+    """Get the number of days after which the unused entries of the cache of VRTs are removed,
+    defined by the environment variable RASTERTOOLS_CACHEMAXAGE.
+
+    Returns:
+        float: the number of days
+    """
+    max_age = os.getenv("RASTERTOOLS_CACHEMAXAGE")
+    return float(max_age) if max_age else CACHE_MAX_AGE
+
+
+def _prune_cache(cachedir: Path, max_age: float):
+    """Remove the entries of the cache of VRTs that have not been used for max_age days
+    (the temporary dirs of the entries being generated are kept)
+
+    Args:
+        cachedir (Path):
+            Dir of the cache
+        max_age (float):
+            Number of days
+    """
+    oldest = time.time() - max_age * 86400
+    for entry in cachedir.iterdir():
+        # entries are named after a sha256 digest
+        if entry.is_dir() and re.fullmatch("[0-9a-f]{64}", entry.name):
+            try:
+                unused = entry.stat().st_mtime < oldest
+            except FileNotFoundError:
+                # removed by a concurrent run
+                continue
+            if unused:
+                _logger.debug(f"Removing the unused entry {entry} from the cache")
+                shutil.rmtree(entry, ignore_errors=True)
+
+
 def _extract_bands(inputfile: Path,
                    bands_pattern: str,
                    masks_pattern: str = None,
@@ -550,18 +759,8 @@ def _extract_bands_from_archive(inputfile: Path,
     mask_regexp = re.compile(masks_pattern) if has_mask else None
 
     suffix = utils.get_suffixes(inputfile)
-    if suffix in [".zip", ".gz"]:
-        # zip or gzip
-        rootpath = "/vsizip/"
-        with zipfile.ZipFile(inputfile.as_posix()) as myzip:
-            names = myzip.namelist()
-
-    else:
-        # tar or tar.gz
-        rootpath = "/vsitar/"
-        with tarfile.open(inputfile.as_posix(),
-                          mode='r:gz' if inputfile.suffix == "gz" else 'r') as mytar:
-            names = [tarinfo.name for tarinfo in mytar.getmembers()]
+    rootpath = "/vsizip/" if suffix in [".zip", ".gz"] else "/vsitar/"
+    names = _get_archive_members(inputfile)
 
     for name in names:
         m = band_regexp.match(name)
@@ -580,6 +779,62 @@ def _extract_bands_from_archive(inputfile: Path,
     return bands_files, masks_files
 
 
+def _get_archive_members(inputfile: Path) -> List[str]:
+    """Gets the names of the members of an archive (zip, gz, tar or targz).
+
+    When the cache dir is set (see get_cachedir), the names are stored in a SQLite index
+    of the cache dir, keyed by the path, the mtime and the size of the archive, so that
+    the archive is listed only once: listing a tar.gz decompresses the whole archive.
+
+    Args:
+        inputfile (Path):
+            Archive to list
+
+    Returns:
+        [str]: Names of the members of the archive
+    """
+    cachedir = get_cachedir()
+    if cachedir is None:
+        return _list_archive_members(inputfile)
+
+    path = inputfile.resolve().as_posix()
+    stat = inputfile.stat()
+    cachedir.mkdir(parents=True, exist_ok=True)
+    with closing(sqlite3.connect(cachedir.joinpath(ARCHIVES_INDEX).as_posix(),
+                                 timeout=60)) as index:
+        with index:
+            index.execute("CREATE TABLE IF NOT EXISTS archives (path TEXT PRIMARY KEY, "
+                          "mtime INTEGER, size INTEGER, members TEXT)")
+        row = index.execute("SELECT members FROM archives WHERE path = ? AND mtime = ? "
+                            "AND size = ?", (path, stat.st_mtime_ns, stat.st_size)).fetchone()
+        if row is not None:
+            _logger.debug(f"Reusing the list of the members of {inputfile} in the index")
+            return json.loads(row[0])
+
+        names = _list_archive_members(inputfile)
+        with index:
+            index.execute("INSERT OR REPLACE INTO archives VALUES (?, ?, ?, ?)",
+                          (path, stat.st_mtime_ns, stat.st_size, json.dumps(names)))
+    return names
+
+
+def _list_archive_members(inputfile: Path) -> List[str]:
+    """Lists the names of the members of an archive (zip, gz, tar or targz)"""
+    suffix = utils.get_suffixes(inputfile)
+    if suffix in [".zip", ".gz"]:
+        # zip or gzip
+        with zipfile.ZipFile(inputfile.as_posix()) as myzip:
+            names = myzip.namelist()
+
+    else:
+        # tar or tar.gz
+        with tarfile.open(inputfile.as_posix(),
+                          mode='r:gz' if suffix.endswith(".gz") else 'r') as mytar:
+            names = [tarinfo.name for tarinfo in mytar]
+
+    return names
+
+
 def _extract_bands_from_dir(inputfile: Path,
                             bands_pattern: str,
                             masks_pattern: str = None) -> Tuple[Dict[str, str], Dict[str, str]]:
@@ -603,18 +858,19 @@ def _extract_bands_from_dir(inputfile: Path,
     has_mask = masks_pattern is not None
     mask_regexp = re.compile(masks_pattern) if has_mask else None
 
-    # the archive may have been extracted, find files in it
-    for path in inputfile.glob("**/*"):
-        if path.is_file():
-            m = band_regexp.match(path.name)
+    # the archive may have been extracted, find files in it (os.walk gets the type of the
+    # entries from the dir listing, without a stat of every path)
+    for dirpath, _, filenames in os.walk(inputfile, followlinks=True):
+        for filename in filenames:
+            m = band_regexp.match(filename)
             if m:
                 key = m.group("bands") if "bands" in band_regexp.groupindex else 'all'
-                bands_files[key] = path.as_posix()
+                bands_files[key] = Path(dirpath, filename).as_posix()
 
             elif has_mask:
-                m = mask_regexp.match(path.name)
+                m = mask_regexp.match(filename)
                 if m:
                     key = m.group("bands") if "bands" in band_regexp.groupindex else 'all'
-                    masks_files[key] = path.as_posix()
+                    masks_files[key] = Path(dirpath, filename).as_posix()
 
     return bands_files, masks_files
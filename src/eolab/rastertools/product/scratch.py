@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Scratch dir of local copies of the JPEG2000 band files of the raster products.
+
+Reading a JPEG2000 file decodes the codeblocks of the requested window, and reading it
+through /vsizip or /vsitar also decompresses the archive: the overlapping windows of the
+tools decode the same codeblocks many times. When the environment variable
+RASTERTOOLS_SCRATCHDIR is set (see option --scratchdir), the JPEG2000 files of the products
+are transcoded once to tiled and compressed (lossless) GeoTIFFs in this dir, and the VRTs
+of the products reference these copies. The size of the scratch dir is bounded by the
+environment variable RASTERTOOLS_SCRATCHSIZE (in MB): the least recently used copies are
+deleted when it is exceeded.
+
+The copies are pinned as long as they are used (see transcode and release) and the pinned
+copies are never deleted. A pinned copy is kept open with a shared lock so that the copies
+used by the other runs are not deleted either.
+"""
+from typing import List
+from pathlib import Path
+import hashlib
+import json
+import logging
+import os
+import threading
+from uuid import uuid4
+
+try:
+    import fcntl
+except ImportError:
+    # no file locks (Windows): only the copies pinned by the current run are kept
+    fcntl = None
+
+from osgeo import gdal
+
+from eolab.rastertools.processing.executor import THREADS, create_executor
+
+__author__ = "Olivier Queyrut"
+__copyright__ = "Copyright 2019, CNES"
+__license__ = "Apache v2.0"
+
+
+_logger = logging.getLogger(__name__)
+
+
+SCRATCH_SIZE = 10240
+"""Default maximum size (in MB) of the scratch dir"""
+
+CREATION_OPTIONS = ["TILED=YES", "COMPRESS=DEFLATE", "PREDICTOR=2", "BIGTIFF=IF_SAFER"]
+"""Creation options of the GeoTIFF copies of the JPEG2000 files"""
+
+_pins = {}
+"""Copies pinned by the current run: number of pins and file descriptor holding the lock"""
+
+_pins_lock = threading.Lock()
+"""Lock of the pinned copies"""
+
+
+def get_scratchdir() -> Path:
+    """Get the scratch dir defined by the environment variable RASTERTOOLS_SCRATCHDIR
+    (see option --scratchdir).
+
+    Returns:
+        Path: the scratch dir, None if the JPEG2000 files are read directly
+    """
+    scratchdir = os.getenv("RASTERTOOLS_SCRATCHDIR")
+    return Path(scratchdir).absolute() if scratchdir else None
+
+
+def get_scratch_size() -> int:
+    """Get the maximum size (in bytes) of the scratch dir defined by the environment
+    variable RASTERTOOLS_SCRATCHSIZE (in MB).
+
+    Returns:
+        int: the maximum size of the scratch dir
+    """
+    size = os.getenv("RASTERTOOLS_SCRATCHSIZE")
+    return int(float(size) * 2**20) if size else SCRATCH_SIZE * 2**20
+
+
+def transcode(files: List[str], container: Path) -> List[str]:
+    """Get local copies of the JPEG2000 files in the scratch dir and pin them: they are not
+    deleted from the scratch dir until they are released (see release). The missing copies
+    are transcoded in parallel, then the least recently used copies are deleted when the
+    size of the scratch dir exceeds the limit (except the pinned copies).
+
+    The copies are named after a hash of the path of the file and of its modification time
+    and size, or of the modification time and size of the archive that contains it: they are
+    never reused for a modified file.
+
+    Args:
+        files ([str]):
+            Paths of the files (e.g. /vsizip/... paths)
+        container (Path):
+            Product (archive or dir) that contains the files
+
+    Returns:
+        [str]: the paths of the files where the JPEG2000 files are replaced by their copies,
+        the files unchanged if the scratch dir is not set
+    """
+    scratchdir = get_scratchdir()
+    if scratchdir is None:
+        return files
+
+    copies = {}
+    for file in files:
+        if file.lower().endswith(".jp2"):
+            # regular file of a dir product or member of an archive
+            stat = Path(file).stat() if Path(file).is_file() else container.stat()
+            key = [file, stat.st_mtime_ns, stat.st_size]
+            digest = hashlib.sha256(json.dumps(key).encode()).hexdigest()
+            copies[file] = scratchdir.joinpath(f"{digest}.tif")
+
+    # a copy can be deleted by a concurrent run before it is pinned: transcode it again
+    unpinned = copies
+    for _ in range(3):
+        missing = [(file, copy) for file, copy in unpinned.items() if not copy.exists()]
+        if missing:
+            scratchdir.mkdir(parents=True, exist_ok=True)
+            with create_executor(THREADS) as executor:
+                list(executor.map(_transcode_file, *zip(*missing)))
+        unpinned = {file: copy for file, copy in unpinned.items() if not _pin(copy)}
+        if not unpinned:
+            break
+    else:
+        release([copy.as_posix() for copy in copies.values() if copy not in unpinned.values()])
+        raise IOError(f"Failed to keep the copies of {list(unpinned)} in the scratch dir")
+
+    # mark the copies as the most recently used
+    for copy in copies.values():
+        os.utime(copy)
+    _evict(scratchdir, get_scratch_size())
+
+    return [copies[file].as_posix() if file in copies else file for file in files]
+
+
+def release(files: List[str]):
+    """Release the copies pinned by transcode. The files that are not copies in the scratch
+    dir are ignored.
+
+    Args:
+        files ([str]):
+            Paths returned by transcode
+    """
+    with _pins_lock:
+        for file in set(files):
+            pin = _pins.get(file)
+            if pin is not None:
+                pin[0] -= 1
+                if pin[0] == 0:
+                    os.close(pin[1])
+                    del _pins[file]
+
+
+def _pin(copy: Path) -> bool:
+    """Pin the copy: open it with a shared lock. Returns False if the copy has been deleted."""
+    with _pins_lock:
+        pin = _pins.get(copy.as_posix())
+        if pin is not None:
+            pin[0] += 1
+            return True
+        try:
+            fd = os.open(copy, os.O_RDONLY)
+        except FileNotFoundError:
+            return False
+        if fcntl is not None:
+            # waits for a concurrent run that is deleting the copy
+            fcntl.flock(fd, fcntl.LOCK_SH)
+        try:
+            deleted = os.fstat(fd).st_ino != os.stat(copy).st_ino
+        except FileNotFoundError:
+            deleted = True
+        if deleted:
+            os.close(fd)
+            return False
+        _pins[copy.as_posix()] = [1, fd]
+        return True
+
+
+def _transcode_file(file: str, copy: Path):
+    """Transcode the file to a tiled GeoTIFF generated in a temporary file renamed atomically
+    so that concurrent runs never read an incomplete copy."""
+    _logger.debug(f"Transcoding {file} to {copy}")
+    tmpfile = copy.with_name(f"{copy.stem}-{uuid4()}.tmp")
+    try:
+        ds = gdal.Translate(tmpfile.as_posix(), file, format="GTiff",
+                            creationOptions=CREATION_OPTIONS)
+        if ds is None:
+            raise IOError(f"Failed to transcode {file}")
+        # free resource from GDAL
+        del ds
+        os.replace(tmpfile, copy)
+    finally:
+        if tmpfile.exists():
+            tmpfile.unlink()
+
+
+def _evict(scratchdir: Path, max_size: int):
+    """Delete the least recently used copies until the size of the scratch dir is lower
+    than the maximum size. The copies pinned by any run are never deleted."""
+    entries = []
+    for copy in scratchdir.glob("*.tif"):
+        try:
+            entries.append((copy.stat(), copy))
+        except FileNotFoundError:
+            # deleted by a concurrent run
+            pass
+    size = sum(stat.st_size for stat, _ in entries)
+    for stat, copy in sorted(entries, key=lambda entry: entry[0].st_mtime_ns):
+        if size <= max_size:
+            break
+        if _delete_unpinned(copy):
+            size -= stat.st_size
+
+
+def _delete_unpinned(copy: Path) -> bool:
+    """Delete the copy if no run pins it. Returns True if the copy does not exist anymore."""
+    with _pins_lock:
+        if copy.as_posix() in _pins:
+            return False
+        try:
+            fd = os.open(copy, os.O_RDONLY)
+        except FileNotFoundError:
+            return True
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            _logger.debug(f"Removing {copy} from the scratch dir")
+            copy.unlink(missing_ok=True)
+            return True
+        except BlockingIOError:
+            # pinned by a concurrent run
+            return False
+        finally:
+            os.close(fd)
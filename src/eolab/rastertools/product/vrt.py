@@ -15,8 +15,20 @@ __copyright__ = "Copyright 2019, CNES"
 __license__ = "Apache v2.0"
 
 
-def _file2vrt(xml_element, file: str, bands: List[int]):
-    """Adds a simple source to the vrt.
+NATIVE_MASKFUNCS = {
+    "eolab.rastertools.product.s2_maja_mask": ("mul", "-1:0,0:1,1:0")
+}
+"""Built-in GDAL pixel functions equivalent to python mask functions. Every python function
+is associated with the name of the GDAL pixel function and the look-up table applied to the
+values of the masks before calling the pixel function (e.g. s2_maja_mask is the product of
+the masks converted to 1 where they are 0 and to 0 elsewhere). Evaluating the mask with a
+built-in pixel function avoids to call back python (and to take the GIL) for every block.
+The built-in pixel functions combine two sources at least: a single mask is the look-up
+table applied to its values and the mask band is a plain band with no pixel function."""
+
+
+def _file2vrt(xml_element, file: str, bands: List[int], lut: str = None, fh=None):
+    """Adds a simple source (or a complex source when a look-up table is set) to the vrt.
 
     Args:
         xml_element:
@@ -25,8 +37,13 @@ def _file2vrt(xml_element, file: str, bands: List[int]):
             Raster file that contains the bands used as masks
         bands (int):
             Bands of the raster image to use as masks
+        lut (str, optional, default=None):
+            Look-up table applied to the values of the bands (e.g. "0:1,1:0"). If set, the
+            bands are added as complex sources instead of simple sources.
+        fh (optional, default=None):
+            GDAL dataset of the raster file if it is already opened
     """
-    fh = gdal.Open(file)
+    fh = gdal.Open(file) if fh is None else fh
     if fh is not None:
         for band in bands:
             rasterband = fh.GetRasterBand(band)
@@ -35,7 +52,8 @@ def _file2vrt(xml_element, file: str, bands: List[int]):
                 block_size_x, block_size_y = rasterband.GetBlockSize()
 
                 # add a source
-                simplesource = ET.SubElement(xml_element, "SimpleSource")
+                simplesource = ET.SubElement(xml_element,
+                                             "SimpleSource" if lut is None else "ComplexSource")
 
                 sourcefilename = ET.SubElement(simplesource, "SourceFilename")
                 sourcefilename.attrib["relativeToVRT"] = '1'
@@ -66,11 +84,15 @@ def _file2vrt(xml_element, file: str, bands: List[int]):
                 dstrect.attrib["xSize"] = str(fh.RasterXSize)
                 dstrect.attrib["ySize"] = str(fh.RasterYSize)
 
+                # set the look-up table applied to the source values
+                if lut is not None:
+                    ET.SubElement(simplesource, "LUT").text = lut
+
     # free gdal resource
     del fh
 
 
-def _func2vrt(xml_element, funcname: str, funcdef: str = None):
+def _func2vrt(xml_element, funcname: str, funcdef: str = None, language: str = "Python"):
     """Adds a pixel function to the vrt.
 
     Args:
@@ -81,14 +103,18 @@ def _func2vrt(xml_element, funcname: str, funcdef: str = None):
         funcdef (str, optional, default=None):
             Function definition (without its signature). If None, the function funcname
             must be available in the scope
+        language (str, optional, default="Python"):
+            Language of the pixel function. If None, funcname is a built-in GDAL pixel
+            function (e.g. mul)
     """
     # Name of the pixel function
     pixelfunctiontype = ET.SubElement(xml_element, "PixelFunctionType")
     pixelfunctiontype.text = funcname
 
     # Language of the pixel function
-    pixelfunctionlang = ET.SubElement(xml_element, "PixelFunctionLanguage")
-    pixelfunctionlang.text = "Python"
+    if language is not None:
+        pixelfunctionlang = ET.SubElement(xml_element, "PixelFunctionLanguage")
+        pixelfunctionlang.text = language
 
     # Definition of the pixel function
     if funcdef is not None:
@@ -103,9 +129,12 @@ def _func2vrt(xml_element, funcname: str, funcdef: str = None):
 
 
 def add_masks_to_vrt(src_vrt: Union[Path, str], maskfile: Union[Path, str], bands: List[int] = [1],
-                     funcname: str = None, funcdef: str = None) -> str:
+                     funcname: str = None, funcdef: str = None, native: bool = True) -> str:
     """Adds a mask bands to the vrt.
 
+    When the pixel function has a built-in GDAL equivalent (see NATIVE_MASKFUNCS), the mask
+    is evaluated by GDAL itself and the VRT can be read without GDAL_VRT_ENABLE_PYTHON.
+
     Args:
         src_vrt (pathlib.Path or str):
             Vrt input image
@@ -119,6 +148,8 @@ def add_masks_to_vrt(src_vrt: Union[Path, str], maskfile: Union[Path, str], band
         funcdef (str, optional, default=None):
             Function definition (without its signature). If None, the function funcname
             must be available in the scope
+        native (bool, optional, default=True):
+            Whether to replace the pixel function by its built-in GDAL equivalent if any
 
     Returns:
         (str): XML content (vrt format) with the added mask band.
@@ -129,17 +160,127 @@ def add_masks_to_vrt(src_vrt: Union[Path, str], maskfile: Union[Path, str], band
     with open(svrt) as vrtContent:
         tree = ET.parse(vrtContent)
         root = tree.getroot()
-        vrtmaskband = ET.SubElement(root, 'MaskBand')
-        vrtrasterband = ET.SubElement(vrtmaskband, "VRTRasterBand")
-        vrtrasterband.attrib["dataType"] = "Byte"
-        vrtrasterband.attrib["subClass"] = "VRTDerivedRasterBand"
-        if funcname is not None:
-            _func2vrt(vrtrasterband, funcname, funcdef)
-        _file2vrt(vrtrasterband, mask, bands)
+        _maskband2vrt(root, mask, bands, funcname, funcdef, native)
 
         return ET.tostring(root)
 
 
+def _maskband2vrt(xml_element, maskfile: str, bands: List[int], funcname: str = None,
+                  funcdef: str = None, native: bool = True, fh=None):
+    """Adds a mask band computed from the bands of a raster to the vrt.
+
+    Args:
+        xml_element:
+            VRTDataset XML element that will contain the mask band
+        maskfile (str):
+            Raster file that contains the bands used as masks
+        bands ([int]):
+            Bands of the raster image to use as masks
+        funcname (str, optional, default=None):
+            Fully qualified name of the pixel function used to compute the mask
+        funcdef (str, optional, default=None):
+            Function definition (without its signature)
+        native (bool, optional, default=True):
+            Whether to replace the pixel function by its built-in GDAL equivalent if any
+        fh (optional, default=None):
+            GDAL dataset of the mask file if it is already opened
+    """
+    vrtmaskband = ET.SubElement(xml_element, 'MaskBand')
+    vrtrasterband = ET.SubElement(vrtmaskband, "VRTRasterBand")
+    vrtrasterband.attrib["dataType"] = "Byte"
+    vrtrasterband.attrib["subClass"] = "VRTDerivedRasterBand"
+    lut = None
+    if native and funcdef is None and funcname in NATIVE_MASKFUNCS:
+        pixelfunction, lut = NATIVE_MASKFUNCS[funcname]
+        if len(bands) > 1:
+            _func2vrt(vrtrasterband, pixelfunction, language=None)
+        else:
+            del vrtrasterband.attrib["subClass"]
+    elif funcname is not None:
+        _func2vrt(vrtrasterband, funcname, funcdef)
+    _file2vrt(vrtrasterband, maskfile, bands, lut, fh)
+
+
+def masked_vrt(src_vrt: Union[Path, str], bands: List[int], masks: List[int],
+               funcname: str = None, funcdef: str = None, native: bool = True,
+               descriptions: List[str] = None) -> bytes:
+    """Creates a vrt that contains some bands of a raster and a mask band computed from
+    other bands of the same raster.
+
+    Unlike add_masks_to_vrt, the vrt is entirely generated in memory from the metadata
+    of the raster: no intermediate vrt has to be built and written to disk. The sources
+    of the generated vrt are relative to the directory of the raster.
+
+    Args:
+        src_vrt (pathlib.Path or str):
+            Input raster (e.g. vrt in memory) that contains the bands and the masks
+        bands ([int]):
+            Bands of the input raster to copy in the generated vrt
+        masks ([int]):
+            Bands of the input raster to use as masks
+        funcname (str, optional, default=None):
+            Fully qualified name of the pixel function (e.g. indices.vrt.s2_maja_mask)
+            used to compute the mask from the masks bands.
+        funcdef (str, optional, default=None):
+            Function definition (without its signature). If None, the function funcname
+            must be available in the scope
+        native (bool, optional, default=True):
+            Whether to replace the pixel function by its built-in GDAL equivalent if any
+        descriptions ([str], optional, default=None):
+            Descriptions of the bands
+
+    Returns:
+        (bytes): XML content (vrt format) of the masked raster.
+    """
+    svrt = src_vrt.as_posix() if isinstance(src_vrt, Path) else src_vrt
+    fh = gdal.Open(svrt)
+    if fh is None:
+        raise IOError(f"Unable to open the raster {svrt}")
+
+    root = ET.Element("VRTDataset")
+    root.attrib["rasterXSize"] = str(fh.RasterXSize)
+    root.attrib["rasterYSize"] = str(fh.RasterYSize)
+    projection = fh.GetProjection()
+    if projection:
+        ET.SubElement(root, "SRS").text = projection
+    geotransform = fh.GetGeoTransform(can_return_null=True)
+    if geotransform is not None:
+        ET.SubElement(root, "GeoTransform").text = ", ".join(repr(v) for v in geotransform)
+
+    for i, band in enumerate(bands, 1):
+        rasterband = fh.GetRasterBand(band)
+        vrtrasterband = ET.SubElement(root, "VRTRasterBand")
+        vrtrasterband.attrib["dataType"] = gdal.GetDataTypeName(rasterband.DataType)
+        vrtrasterband.attrib["band"] = str(i)
+        if descriptions is not None and i <= len(descriptions):
+            ET.SubElement(vrtrasterband, "Description").text = descriptions[i - 1]
+        nodata = rasterband.GetNoDataValue()
+        if nodata is not None:
+            ET.SubElement(vrtrasterband, "NoDataValue").text = repr(nodata)
+        _file2vrt(vrtrasterband, svrt, [band], fh=fh)
+
+    _maskband2vrt(root, svrt, masks, funcname, funcdef, native, fh)
+
+    # free gdal resource
+    del fh
+    return ET.tostring(root)
+
+
+def write_vrt(content: bytes, dst_vrt: Union[Path, str]):
+    """Writes the XML content of a vrt to a file (e.g. in /vsimem/)
+
+    Args:
+        content (bytes):
+            XML content (vrt format)
+        dst_vrt (pathlib.Path or str):
+            Output file
+    """
+    dvrt = dst_vrt.as_posix() if isinstance(dst_vrt, Path) else dst_vrt
+    fp = gdal.VSIFOpenL(dvrt, "wb")
+    gdal.VSIFWriteL(content, 1, len(content), fp)
+    gdal.VSIFCloseL(fp)
+
+
 def set_band_descriptions(src_vrt: Union[Path, str], descriptions: List[str]):
     """Set the descriptions of the bands in a VRT image.
 
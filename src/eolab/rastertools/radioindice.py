@@ -4,11 +4,12 @@
 This module defines a command line named radioindice that computes radiometric
 indices on raster images: ndvi, ndwi, etc..
 """
+from contextlib import ExitStack
 import logging
 import logging.config
 import os
 from pathlib import Path
-from typing import List
+from typing import List, Union
 import threading
 
 import rasterio
@@ -19,11 +20,16 @@ from eolab.rastertools import utils
 from eolab.rastertools import Rastertool, Windowable
 from eolab.rastertools.processing import algo
 from eolab.rastertools.processing import RadioindiceProcessing
+from eolab.rastertools.processing.executor import THREADS, close_at_shutdown, create_executor
+from eolab.rastertools.processing.executor import imap
 from eolab.rastertools.product import BandChannel, RasterProduct
 
 
 _logger = logging.getLogger(__name__)
 
+_worker = threading.local()
+"""Context of a worker: input image opened once and indices to compute"""
+
 
 class Radioindice(Rastertool, Windowable):
     """Raster tool that computes radiometric indices of a raster product.
@@ -426,8 +432,16 @@ class Radioindice(Rastertool, Windowable):
                         # indice is valid, add it to the list of indices to compute
                         indices.append(indice)
 
-            # get the raster
-            raster = product.get_raster(roi=self.roi)
+            # get the raster with only the channels needed by the indices when
+            # the bands are stored in separate files
+            channels = [channel for channel in product.channels
+                        if any(channel in indice.channels for indice in indices)]
+            if product.is_archive and "all" not in product.bands_files:
+                ids = [product.rastertype.get_band_id(channel) for channel in channels]
+                raster = product.get_raster(bands=ids, roi=self.roi)
+            else:
+                raster = product.get_raster(roi=self.roi)
+                channels = product.channels
 
             # STEP 2: Compute the indices
             outputs = []
@@ -435,41 +449,60 @@ class Radioindice(Rastertool, Windowable):
                 # merge is True, compute all indices and generate a single image
                 _logger.info(f"Compute indices: {' '.join(indice.name for indice in indices)}")
                 indice_image = outdir.joinpath(f"{utils.get_basename(inputfile)}-indices.tif")
-                compute_indices(raster, product.channels, indice_image.as_posix(),
-                                indices, self.window_size)
-                outputs.append(indice_image.as_posix())
-            else:
-                # merge is False, compute all indices and generate one image per indice
-                for i, indice in enumerate(indices):
-                    _logger.info(f"Compute {indice.name}")
-                    indice_image = outdir.joinpath(
-                        f"{utils.get_basename(inputfile)}-{indice.name}.tif")
-                    compute_indices(raster, product.channels, indice_image.as_posix(),
-                                    [indice], self.window_size)
-                    outputs.append(indice_image.as_posix())
+                outputs = [indice_image.as_posix()]
+                compute_indices(raster, channels, outputs[0], indices, self.window_size)
+            elif len(indices) > 0:
+                # merge is False, compute all indices in a single pass and generate
+                # one image per indice
+                _logger.info(f"Compute {' '.join(indice.name for indice in indices)}")
+                outputs = [outdir.joinpath(
+                    f"{utils.get_basename(inputfile)}-{indice.name}.tif").as_posix()
+                    for indice in indices]
+                compute_indices(raster, channels, outputs, indices, self.window_size)
 
         # return the list of generated files
         return outputs
 
 
 def compute_indices(input_image: str, image_channels: List[BandChannel],
-                    indice_image: str, indices: List[RadioindiceProcessing],
+                    indice_image: Union[str, List[str]], indices: List[RadioindiceProcessing],
                     window_size: tuple = (1024, 1024)):
     """Compute the indices on the input image and produce a multiple bands
-    image (one band per indice)
+    image (one band per indice) or one image per indice.
+
+    All indices are computed in a single pass over the windows of the input image:
+    the channels needed by the indices are read once per window.
 
     Args:
         input_image (str):
             Path of the raster to compute
         image_channels ([:obj:`eolab.rastertools.product.BandChannel`]):
             Ordered list of bands in the raster
-        indice_image (str):
-            Path of the output raster image
+        indice_image (str or [str]):
+            Path of the output raster image (one band per indice) or list of paths
+            of the output raster images (one image per indice, in the order of indices)
         indices ([:obj:`eolab.rastertools.processing.RadioindiceProcessing`]):
             List of indices to compute
         window_size (tuple(int, int), optional, default=(1024, 1024)):
             Size of windows for splitting the processed image in small parts
     """
+    merge = isinstance(indice_image, str)
+    if not merge and len(indice_image) != len(indices):
+        raise ValueError("The number of output images must be equal to the number of indices")
+
+    # bands to read (union of the channels of all indices) and position of the
+    # channels of every indice in the array read
+    bands = sorted({image_channels.index(channel) + 1
+                    for indice in indices for channel in indice.channels})
+    positions = [[bands.index(image_channels.index(channel) + 1) for channel in indice.channels]
+                 for indice in indices]
+
+    # dtype of output data: in a merged image, all indices have the dtype of the first one
+    if merge:
+        dtypes = [indices[0].dtype or rasterio.float32] * len(indices)
+    else:
+        dtypes = [indice.dtype or rasterio.float32 for indice in indices]
+
     with rasterio.Env(GDAL_VRT_ENABLE_PYTHON=True):
         with rasterio.open(input_image) as src:
             profile = src.profile
@@ -481,45 +514,69 @@ def compute_indices(input_image: str, image_channels: List[BandChannel],
             if src.height < blockysize:
                 blockysize = utils.highest_power_of_2(src.height)
 
-            # dtype of output data
-            dtype = indices[0].dtype or rasterio.float32
-
             # setup profile for output image
             profile.update(driver='GTiff',
-                           blockxsize=blockysize, blockysize=blockxsize, tiled=True,
-                           dtype=dtype, nodata=indices[0].nodata,
-                           count=len(indices))
-
-            with rasterio.open(indice_image, "w", **profile) as dst:
-                # Materialize a list of destination block windows
-                windows = [window for ij, window in dst.block_windows()]
-
-                # disable status of tqdm progress bar
-                disable = os.getenv("RASTERTOOLS_NOTQDM", 'False').lower() in ['true', '1']
+                           blockxsize=blockysize, blockysize=blockxsize, tiled=True)
 
-                # compute every indices
+        with ExitStack() as stack:
+            if merge:
+                profile.update(dtype=dtypes[0], nodata=indices[0].nodata, count=len(indices))
+                dst = stack.enter_context(rasterio.open(indice_image, "w", **profile))
                 for i, indice in enumerate(indices, 1):
-                    # Get the bands necessary to compute the indice
-                    bands = [image_channels.index(channel) + 1 for channel in indice.channels]
-
-                    read_lock = threading.Lock()
-                    write_lock = threading.Lock()
-
-                    def process(window):
-                        """Read input raster, compute indice and write output raster"""
-                        with read_lock:
-                            src_array = src.read(bands, window=window, masked=True)
-                            src_array[src_array == src.nodata] = ma.masked
-                            src_array = src_array.astype(dtype)
-
-                        # The computation can be performed concurrently
-                        result = indice.algo(src_array).astype(dtype).filled(indice.nodata)
-
-                        with write_lock:
-                            dst.write_band(i, result, window=window)
+                    dst.set_band_description(i, indice.name)
+                dsts = [(dst, i) for i in range(1, len(indices) + 1)]
+            else:
+                dsts = []
+                for indice, image, dtype in zip(indices, indice_image, dtypes):
+                    profile.update(dtype=dtype, nodata=indice.nodata, count=1)
+                    dst = stack.enter_context(rasterio.open(image, "w", **profile))
+                    dst.set_band_description(1, indice.name)
+                    dsts.append((dst, 1))
+
+            # Materialize a list of destination block windows
+            windows = [window for ij, window in dsts[0][0].block_windows()]
+
+            # disable status of tqdm progress bar
+            disable = os.getenv("RASTERTOOLS_NOTQDM", 'False').lower() in ['true', '1']
+
+            # compute every indices: windows are distributed over the workers
+            # and the outputs are written by the calling thread only
+            with create_executor(THREADS,
+                                 initializer=_init_worker,
+                                 initargs=(input_image, bands, indices,
+                                           positions, dtypes)) as executor:
+                results = imap(executor, _compute_indices, windows)
+                for window, result in tqdm(zip(windows, results), total=len(windows),
+                                           disable=disable,
+                                           desc=f"{' '.join(i.name for i in indices)}"):
+                    for (dst, band), data in zip(dsts, result):
+                        dst.write_band(band, data, window=window)
+
+
+def _init_worker(input_image, bands, indices, positions, dtypes):
+    """Initialize a worker: open the input image once for all the windows
+    that the worker will process.
+    """
+    with rasterio.Env(GDAL_VRT_ENABLE_PYTHON=True):
+        _worker.src = close_at_shutdown(rasterio.open(input_image))
+    _worker.bands = bands
+    _worker.indices = indices
+    _worker.positions = positions
+    _worker.dtypes = dtypes
 
-                    # compute using concurrent.futures.ThreadPoolExecutor and tqdm
-                    for window in tqdm(windows, disable=disable, desc=f"{indice.name}"):
-                        process(window)
 
-                    dst.set_band_description(i, indice.name)
+def _compute_indices(window):
+    """Read a window of the input raster and compute all the indices. This method can
+    be called safely by several workers since it only reads the input image opened
+    by the worker.
+    """
+    src = _worker.src
+    with rasterio.Env(GDAL_VRT_ENABLE_PYTHON=True):
+        src_array = src.read(_worker.bands, window=window, masked=True)
+    src_array[src_array == src.nodata] = ma.masked
+
+    results = []
+    for indice, positions, dtype in zip(_worker.indices, _worker.positions, _worker.dtypes):
+        indice_array = src_array[positions].astype(dtype)
+        results.append(indice.algo(indice_array).astype(dtype).filled(indice.nodata))
+    return results
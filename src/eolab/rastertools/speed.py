@@ -13,16 +13,21 @@ import threading
 from typing import List
 
 import rasterio
-from tqdm.contrib.concurrent import thread_map
+from tqdm import tqdm
 
 from eolab.rastertools import utils
 from eolab.rastertools import Rastertool
 from eolab.rastertools.processing import algo
+from eolab.rastertools.processing.executor import THREADS, close_at_shutdown, create_executor
+from eolab.rastertools.processing.executor import imap
 from eolab.rastertools.product import RasterProduct
 
 
 _logger = logging.getLogger(__name__)
 
+_worker = threading.local()
+"""Context of a worker: input products opened once and processing configuration"""
+
 
 class Speed(Rastertool):
     """Raster tool that computes the time derivative (speed) of raster images.
@@ -159,20 +164,34 @@ def compute_speed(date0: datetime, date1: datetime,
                 # Materialize a list of destination block windows
                 windows = [window for ij, window in dst.block_windows()]
 
-                read_lock = threading.Lock()
-                write_lock = threading.Lock()
+                disable = os.getenv("RASTERTOOLS_NOTQDM", 'False').lower() in ['true', '1']
+                with create_executor(THREADS,
+                                     initializer=_init_worker,
+                                     initargs=(product0, product1, bands, interval)) as executor:
+                    results = imap(executor, _process_speed, windows)
+                    for window, result in tqdm(zip(windows, results), total=len(windows),
+                                               disable=disable, desc="speed"):
+                        dst.write(result, window=window)
 
-                def process(window):
-                    """Read input rasters, compute speed and write output raster"""
-                    with read_lock:
-                        data0 = src0.read(bands, window=window, masked=True).astype(dtype)
-                        data1 = src1.read(bands, window=window, masked=True).astype(dtype)
 
-                    # The computation can be performed concurrently
-                    result = algo.speed(data0, data1, interval).astype(dtype).filled(src0.nodata)
+def _init_worker(product0, product1, bands, interval):
+    """Initialize a worker: open the input products once for all the windows
+    that the worker will process.
+    """
+    with rasterio.Env(GDAL_VRT_ENABLE_PYTHON=True):
+        _worker.src0 = close_at_shutdown(product0.open())
+        _worker.src1 = close_at_shutdown(product1.open())
+    _worker.bands = bands
+    _worker.interval = interval
+
 
-                    with write_lock:
-                        dst.write(result, window=window)
+def _process_speed(window):
+    """Read input rasters and compute speed of a window. This method can be called
+    safely by several workers since it only reads the inputs opened by the worker.
+    """
+    dtype = rasterio.float32
+    with rasterio.Env(GDAL_VRT_ENABLE_PYTHON=True):
+        data0 = _worker.src0.read(_worker.bands, window=window, masked=True).astype(dtype)
+        data1 = _worker.src1.read(_worker.bands, window=window, masked=True).astype(dtype)
 
-                disable = os.getenv("RASTERTOOLS_NOTQDM", 'False').lower() in ['true', '1']
-                thread_map(process, windows, disable=disable, desc="speed")
+    return algo.speed(data0, data1, _worker.interval).astype(dtype).filled(_worker.src0.nodata)
@@ -52,6 +52,7 @@ class Tiling(Rastertool):
         super().__init__()
 
         self._grid = gpd.read_file(geometry_file)
+        self._grid_cache = vector.GeometryCache(self._grid)
         self._output_basename = None
         self._output_subdir = False
 
@@ -140,6 +141,7 @@ class Tiling(Rastertool):
                     # log given ids which are not in the grid
                     _logger.error(f"The grid column \"{id_column}\" does not contain "
                                   f"the following values: {str(invalid_ids)}")
+        self._grid_cache = vector.GeometryCache(self._grid)
         return self
 
     def process_file(self, inputfile: str):
@@ -157,8 +159,11 @@ class Tiling(Rastertool):
         # STEP 1: Prepare the input image so that it can be processed
         with RasterProduct(inputfile, vrt_outputdir=self.vrt_dir) as product:
 
-            # STEP 2: Prepare grid (reproject it to raster's CRS)
-            grid = vector.reproject(self.grid, inputfile)
+            # STEP 2: Prepare grid (keep the tiles that overlap the raster bounds and
+            # reproject them to raster's CRS)
+            grid = self._grid_cache.filter(inputfile)
+            for i in self.grid.index.difference(grid.index):
+                _logger.error("Input shape " + str(i) + " does not overlap raster")
 
             # STEP 3: apply tiling
             outputs = []
@@ -6,27 +6,33 @@ of rasters at different dates from a list of rasters that may contain gaps (due
 to clouds for instance). The timeseries is generated with a linear interpolation
 thus enabling to fill gaps.
 """
+from contextlib import ExitStack
 from datetime import datetime, timedelta
-from itertools import repeat
 import logging
 import logging.config
-import multiprocessing
 import os
 from pathlib import Path
+import tempfile
+import threading
 from typing import Dict, List
 
 import numpy as np
 import rasterio
-from tqdm.contrib.concurrent import process_map
+from tqdm import tqdm
 
 from eolab.rastertools import utils
 from eolab.rastertools import Rastertool, Windowable
 from eolab.rastertools.processing import algo
+from eolab.rastertools.processing.executor import PROCESSES, create_executor, get_executor_type
+from eolab.rastertools.processing.executor import close_at_shutdown, imap
 from eolab.rastertools.product import RasterProduct
 
 
 _logger = logging.getLogger(__name__)
 
+_worker = threading.local()
+"""Context of a worker: input rasters opened once and processing configuration"""
+
 
 class Timeseries(Rastertool, Windowable):
     """Raster tool that generates the time series of raster images. The timeseries is
@@ -158,14 +164,18 @@ def compute_timeseries(products_per_date: Dict[float, RasterProduct], timeseries
         window_size (tuple(int, int), optional, default=(1024, 1024)):
             Size of windows for splitting the process in small parts
     """
-    with rasterio.Env(GDAL_VRT_ENABLE_PYTHON=True):
+    executor_type = get_executor_type(PROCESSES)
 
-        # open all input rasters
+    with rasterio.Env(GDAL_VRT_ENABLE_PYTHON=True), tempfile.TemporaryDirectory() as tmpdir, \
+            ExitStack() as products:
+
+        # resolve the raster of every product once: the workers only read them
         products_dates = sorted(products_per_date.keys())
+        rasters = [_get_raster(products_per_date[date], executor_type, tmpdir, products)
+                   for date in products_dates]
 
-        for i, date in enumerate(products_dates):
-            product = products_per_date[date]
-            with product.open() as src:
+        for i, raster in enumerate(rasters):
+            with rasterio.open(raster) as src:
                 # check if srcs have same size and are geographically overlapping
                 if i == 0:
                     refcount = src.count
@@ -204,53 +214,61 @@ def compute_timeseries(products_per_date: Dict[float, RasterProduct], timeseries
         dtype = refprofile.get("dtype")
         nodata = refprofile.get("nodata")
 
-        # create empty output files with correct metadata
-        for i, img in enumerate(timeseries_images):
-            with rasterio.open(img, mode="w", **refprofile) as dst:
-                if i == 0:
-                    # with rasterio.open(timeseries_images[0], mode="w", **profile) as dst:
-                    windows = [window for ij, window in dst.block_windows()]
+        disable = os.getenv("RASTERTOOLS_NOTQDM", 'False').lower() in ['true', '1']
+
+        # the outputs are only written by the main process while the workers
+        # read the inputs and interpolate the windows
+        with ExitStack() as stack:
+            dsts = [stack.enter_context(rasterio.open(img, mode="w", **refprofile))
+                    for img in timeseries_images]
+            for dst in dsts:
                 for j, band in enumerate(bands, 1):
                     dst.set_band_description(j, descriptions[band - 1])
+            windows = [window for ij, window in dsts[0].block_windows()]
+
+            with create_executor(executor_type,
+                                 initializer=_init_worker,
+                                 initargs=(products_dates, rasters,
+                                           timeseries_dates, bands, nodata)) as executor:
+                outputs = imap(executor, _interpolate, windows)
+                for window, output in tqdm(zip(windows, outputs), total=len(windows),
+                                           disable=disable):
+                    for i, dst in enumerate(dsts):
+                        dst.write(output[i].astype(dtype), window=window)
+
+
+def _get_raster(product: RasterProduct, executor_type: str, vrt_outputdir: str,
+                products: ExitStack) -> str:
+    """Get the raster of a product that can be opened by all the workers. In memory
+    VRTs are not shared between processes: when the workers are processes, the VRT
+    of an archive product is generated in the vrt_outputdir by a new product that
+    is freed when the products stack is closed.
+    """
+    if executor_type == PROCESSES and product.is_archive and product.vrt_outputdir is None:
+        product = products.enter_context(RasterProduct(product.file,
+                                                       vrt_outputdir=vrt_outputdir))
+    return product.get_raster()
+
 
-        m = multiprocessing.Manager()
-        write_lock = m.Lock()
-
-        kwargs = {
-            "total": len(windows),
-            "disable": os.getenv("RASTERTOOLS_NOTQDM", 'False').lower() in ['true', '1']
-        }
-        max_workers = os.getenv("RASTERTOOLS_MAXWORKERS")
-        if max_workers is not None:
-            kwargs["max_workers"] = int(max_workers)
-        process_map(_interpolate,
-                    repeat(products_dates), repeat(products_per_date),
-                    repeat(timeseries_dates), repeat(timeseries_images),
-                    windows, repeat(bands),
-                    repeat(dtype), repeat(nodata),
-                    repeat(write_lock),
-                    **kwargs)
-
-
-def _interpolate(products_dates, products_per_date,
-                 timeseries_dates, timeseries_images,
-                 window, bands,
-                 dtype, nodata,
-                 write_lock):
+def _init_worker(products_dates, rasters, timeseries_dates, bands, nodata):
+    """Initialize a worker: open the input rasters once for all the windows
+    that the worker will process.
+    """
+    with rasterio.Env(GDAL_VRT_ENABLE_PYTHON=True):
+        _worker.srcs = [close_at_shutdown(rasterio.open(raster)) for raster in rasters]
+    _worker.products_dates = products_dates
+    _worker.timeseries_dates = timeseries_dates
+    _worker.bands = bands
+    _worker.nodata = nodata
+
+
+def _interpolate(window):
     """Internal method that performs the interpolation for a specific window.
-    This method can be called safely by several processes thanks to the locks
-    that prevent from reading / writing files simultaneously.
+    This method can be called safely by several workers since it only reads
+    the input rasters opened by the worker.
     """
-    datas = list()
-    for date in products_dates:
-        product = products_per_date[date]
-        with product.open() as src:
-            data = src.read(bands, window=window, masked=True)
-            datas.append(data)
-
-    output = algo.interpolated_timeseries(products_dates, datas, timeseries_dates, nodata)
-
-    with write_lock:
-        for i, img in enumerate(timeseries_images):
-            with rasterio.open(img, mode="r+") as dst:
-                dst.write(output[i].astype(dtype), window=window)
+    with rasterio.Env(GDAL_VRT_ENABLE_PYTHON=True):
+        datas = [src.read(_worker.bands, window=window, masked=True) for src in _worker.srcs]
+
+    return algo.interpolated_timeseries(_worker.products_dates, datas,
+                                        _worker.timeseries_dates, _worker.nodata)
@@ -14,7 +14,13 @@ Several options are provided:
   filenames (because the raster is of a known type), generate one chart
   per statistics (x=time, y=stats)
 
+When several raster images share the same grid (e.g. a time series of a tile), the geometries
+are prepared (filtered and reprojected) and rasterized once for all the images. In stack mode,
+the images are read together and the statistics of all the images are written in a single
+table in long format (one row per zone, date, band and stat).
+
 """
+from contextlib import ExitStack
 from typing import List, Dict
 import datetime
 import logging
@@ -22,7 +28,9 @@ import logging.config
 from pathlib import Path
 import json
 import numpy as np
+import pandas as pd
 import geopandas as gpd
+from shapely.geometry import box
 
 import rasterio
 
@@ -30,7 +38,10 @@ from eolab.rastertools import utils
 from eolab.rastertools import Rastertool, RastertoolConfigurationException
 from eolab.rastertools.processing import compute_zonal_stats, compute_zonal_stats_per_category
 from eolab.rastertools.processing import extract_zonal_outliers, plot_stats
+from eolab.rastertools.processing.stats import compute_zonal_stats_stack
 from eolab.rastertools.processing import vector
+from eolab.rastertools.processing.zonal import DEFAULT_BINS, MaskCache, is_streamable
+from eolab.rastertools.processing.zonal import is_reducible, compute_zonal_stats_streaming
 from eolab.rastertools.product import RasterProduct
 
 
@@ -101,10 +112,17 @@ class Zonalstats(Rastertool):
         self._output_format = "ESRI Shapefile"
 
         self._geometries = None
+        self._geometries_cache = None
         self._within = False
 
         self._sigma = None
 
+        self._streaming = False
+        self._bins = DEFAULT_BINS
+        self._accuracy = None
+
+        self._stack = False
+
         self._chart_file = None
         self._geometry_index = 'ID'
         self._display_chart = False
@@ -117,6 +135,10 @@ class Zonalstats(Rastertool):
         self._generated_stats = list()
         self._generated_stats_dates = list()
 
+        # geometries and categories prepared for a grid and the rasterized geometries
+        self._prepared = dict()
+        self._masks = MaskCache()
+
     @property
     def generated_stats_per_date(self):
         """After processing one or several files, this method enables to retrieve a dictionary
@@ -197,6 +219,27 @@ class Zonalstats(Rastertool):
         """Number of sigmas for identifying outliers"""
         return self._sigma
 
+    @property
+    def streaming(self) -> bool:
+        """Whether to compute the stats in streaming mode"""
+        return self._streaming
+
+    @property
+    def bins(self) -> int:
+        """Number of bins of the histograms in streaming mode"""
+        return self._bins
+
+    @property
+    def accuracy(self) -> float:
+        """Relative accuracy of the quantile sketches in streaming mode (None if the
+        quantiles are computed from histograms)"""
+        return self._accuracy
+
+    @property
+    def stack(self) -> bool:
+        """Whether to compute the stats of all the input files together"""
+        return self._stack
+
     @property
     def chart_file(self) -> str:
         """Name of the chart file to generate"""
@@ -296,7 +339,9 @@ class Zonalstats(Rastertool):
             possible to chain the with... calls (fluent API)
         """
         self._geometries = geometries
+        self._geometries_cache = vector.GeometryCache(geometries) if geometries else None
         self._within = within
+        self._clear_cache()
         return self
 
     def with_outliers(self, sigma: float):
@@ -320,6 +365,59 @@ class Zonalstats(Rastertool):
         self._sigma = sigma
         return self
 
+    def with_streaming(self, streaming: bool = True, bins: int = None, accuracy: float = None):
+        """Set up the streaming mode: the raster is read block by block so that the memory
+        does not depend on the extent of the geometries. The median, percentiles and mad
+        are computed from histograms: they are exact for integer rasters when the range
+        of values in a geometry is lower than the number of bins. When an accuracy is set,
+        they are computed in a single pass from quantile sketches whose relative error is
+        lower than the accuracy.
+
+        Args:
+            streaming (bool, optional, default=True):
+                Whether to compute the stats in streaming mode
+            bins (int, optional, default=None):
+                Number of bins of the histograms. If None, it is set to 1024
+            accuracy (float, optional, default=None):
+                Relative accuracy of the quantile sketches, in range ]0, 1[. If None,
+                histograms are used.
+
+        Returns:
+            :obj:`eolab.rastertools.Zonalstats`: the current instance so that it is
+            possible to chain the with... calls (fluent API)
+        """
+        if streaming and not is_streamable(self._stats, self._categorical):
+            raise RastertoolConfigurationException(
+                "Stats majority, minority, unique and categorical option can not "
+                "be computed in streaming mode")
+        bins = bins or DEFAULT_BINS
+        if bins < 1:
+            raise RastertoolConfigurationException("Number of bins must be positive")
+        if accuracy is not None and not 0 < accuracy < 1:
+            raise RastertoolConfigurationException("Accuracy must be in range ]0, 1[")
+        self._streaming = streaming
+        self._bins = bins
+        self._accuracy = accuracy
+        return self
+
+    def with_stack(self, stack: bool = True):
+        """Set up the stack mode: the input files (that must have the same grid, e.g.
+        a time series of a tile) are read together. The windows of the geometries are
+        computed and the geometries are rasterized once for all the files. The stats
+        of all the files are written in a single CSV table in long format with the
+        columns zone, date, band, stat and value.
+
+        Args:
+            stack (bool, optional, default=True):
+                Whether to compute the stats in stack mode
+
+        Returns:
+            :obj:`eolab.rastertools.Zonalstats`: the current instance so that it is
+            possible to chain the with... calls (fluent API)
+        """
+        self._stack = stack
+        return self
+
     def with_chart(self, chart_file: str = None, geometry_index: str = 'ID', display: bool = False):
         """Set up the charting capability
 
@@ -359,6 +457,7 @@ class Zonalstats(Rastertool):
         """
         self._category_file = category_file
         self._category_index = category_index
+        self._clear_cache()
         # get the category file type
         if category_file:
             suffix = utils.get_suffixes(category_file)
@@ -393,6 +492,10 @@ class Zonalstats(Rastertool):
         Returns:
             [str]: List of generated statistical images (posix paths) that have been generated
         """
+        if self.stack:
+            # all the files are processed together in postprocess_files
+            return list()
+
         _logger.info(f"Processing file {inputfile}")
 
         # STEP 1: Prepare the input image so that it can be processed
@@ -405,42 +508,17 @@ class Zonalstats(Rastertool):
 
             # open raster to get metadata
             raster = product.get_raster()
-            with rasterio.open(raster) as rst:
-                bound = int(rst.count)
-                indexes = rst.indexes
-                descr = rst.descriptions
-
-                geotransform = rst.get_transform()
-                width = np.abs(geotransform[1])
-                height = np.abs(geotransform[5])
-                area_square_meter = width * height
-
+            grid, bands, descr, area_square_meter = self.__get_metadata(raster)
             date_str = product.get_date_string('%Y%m%d-%H%M%S')
 
-            # check band index and handle all bands options (when bands is None)
-            if self.bands is None or len(self.bands) == 0:
-                bands = indexes
-            else:
-                bands = self.bands
-            if min(bands) < 1 or max(bands) > bound:
-                raise ValueError(f"Invalid bands, all values are not in range [1, {bound}]")
-
-            # check the prefix
-            if self.prefix and len(self.prefix) != len(bands):
-                raise ValueError("Number of prefix does not equal the number of bands.")
-
             # STEP 2: Prepare the geometries where to compute zonal stats
-            if self.geometries:
-                # reproject & filter input geometries to fit the raster extent
-                geometries = vector.reproject(
-                    vector.filter(self.geometries, raster, self.within), raster)
-            else:
-                # if no geometry is defined, get the geometry from raster shape
-                geometries = vector.get_raster_shape(raster)
+            whole_image = self.__is_whole_image()
+            geometries = self.__get_geometries(raster, grid, whole_image)
 
             # STEP 3: Compute the statistics
             geom_stats = self.compute_stats(raster, bands, geometries,
-                                            descr, date_str, area_square_meter)
+                                            descr, date_str, area_square_meter, grid,
+                                            whole_image)
 
             self._generated_stats.append(geom_stats)
             if date_str:
@@ -469,6 +547,81 @@ class Zonalstats(Rastertool):
 
             return outputs
 
+    def __get_metadata(self, raster: str):
+        """Get the metadata of the raster and check the bands and the prefix
+
+        Args:
+            raster (str):
+                Input image to process
+
+        Returns:
+            The key of the grid of the raster, the bands to process, the bands descriptions
+            and the area represented by a pixel
+        """
+        with rasterio.open(raster) as rst:
+            grid = MaskCache.grid_key(rst)
+            bound = int(rst.count)
+            indexes = rst.indexes
+            descr = rst.descriptions
+
+            geotransform = rst.get_transform()
+            width = np.abs(geotransform[1])
+            height = np.abs(geotransform[5])
+            area_square_meter = width * height
+
+        # check band index and handle all bands options (when bands is None)
+        if self.bands is None or len(self.bands) == 0:
+            bands = indexes
+        else:
+            bands = self.bands
+        if min(bands) < 1 or max(bands) > bound:
+            raise ValueError(f"Invalid bands, all values are not in range [1, {bound}]")
+
+        # check the prefix
+        if self.prefix and len(self.prefix) != len(bands):
+            raise ValueError("Number of prefix does not equal the number of bands.")
+
+        return grid, bands, descr, area_square_meter
+
+    def __is_whole_image(self) -> bool:
+        """Whether the stats can be computed on the whole image without vectorizing its
+        shape: no geometry nor category is set and the stats can be computed block by
+        block (exactly, or approximately when the streaming mode is set)"""
+        return (not self.geometries and self.category_file is None
+                and is_streamable(self.stats, self.categorical)
+                and (self.streaming or is_reducible(self.stats, self.categorical)))
+
+    def __get_geometries(self, raster: str, grid: tuple,
+                         whole_image: bool = False) -> gpd.GeoDataFrame:
+        """Get the geometries where to compute zonal stats
+
+        Args:
+            raster (str):
+                Input image to process
+            grid (tuple):
+                Key of the grid of the raster
+            whole_image (bool, optional, default=False):
+                Whether the stats are computed on the whole image. The geometry is
+                then the bounds of the raster instead of its vectorized shape.
+
+        Returns:
+            GeoDataFrame: the geometries in the crs of the raster
+        """
+        if self.geometries:
+            # reproject & filter input geometries to fit the raster extent
+            # (the geometries are read once, then reprojected once per crs)
+            geometries = self._get_prepared(
+                ("geometries", grid),
+                lambda: self._geometries_cache.filter(raster, self.within)).copy()
+        elif whole_image:
+            # the stats are computed block by block: no need to vectorize the raster shape
+            with rasterio.open(raster) as src:
+                geometries = gpd.GeoDataFrame(geometry=[box(*src.bounds)], crs=src.crs)
+        else:
+            # if no geometry is defined, get the geometry from raster shape
+            geometries = vector.get_raster_shape(raster)
+        return geometries
+
     def postprocess_files(self, inputfiles: List[str], outputfiles: List[str]) -> List[str]:
         """Generate the chart if requested after computing stats for each input file
 
@@ -481,6 +634,9 @@ class Zonalstats(Rastertool):
             [str]: A list containing the chart file if requested
         """
         additional_outputs = []
+        if self.stack:
+            additional_outputs.extend(self.process_stack(inputfiles))
+
         if self.chart_file and len(self.generated_stats_per_date) > 0:
             _logger.info("Generating chart")
             plot_stats(self.chart_file, self.generated_stats_per_date,
@@ -489,10 +645,100 @@ class Zonalstats(Rastertool):
 
         return additional_outputs
 
+    def process_stack(self, inputfiles: List[str]) -> List[str]:
+        """Compute the stats of all the input files together (stack mode)
+
+        Args:
+            inputfiles ([str]):
+                Input images to process. They must have the same grid.
+
+        Returns:
+            [str]: List containing the generated table (if an output dir is set)
+        """
+        if self.category_file is not None:
+            raise ValueError("Stats per category can not be computed in stack mode")
+        if self.sigma:
+            raise ValueError("Outliers can not be computed in stack mode")
+
+        _logger.info(f"Processing the stack of {len(inputfiles)} files")
+        with ExitStack() as stack:
+            products = [stack.enter_context(RasterProduct(inputfile, vrt_outputdir=self.vrt_dir))
+                        for inputfile in inputfiles]
+            rasters = [product.get_raster() for product in products]
+            grid, bands, descr, area_square_meter = self.__get_metadata(rasters[0])
+            geometries = self.__get_geometries(rasters[0], grid)
+
+            _logger.info("Compute statistics")
+            statistics = compute_zonal_stats_stack(
+                geometries, rasters,
+                bands=bands,
+                stats=self.stats,
+                categorical=self.categorical,
+                streaming=self.streaming,
+                bins=self.bins,
+                masks=self._masks,
+                accuracy=self.accuracy)
+
+            records = []
+            for inputfile, product, date_stats in zip(inputfiles, products, statistics):
+                date_str = product.get_date_string('%Y%m%d-%H%M%S')
+                geom_stats = self.__to_geoms(date_stats, geometries.copy(), bands, descr,
+                                             date_str, area_square_meter)
+                self._generated_stats.append(geom_stats)
+                if date_str:
+                    timestamp = datetime.datetime.strptime(date_str, '%Y%m%d-%H%M%S')
+                    self._generated_stats_dates.append(timestamp)
+                records.extend(self.__stats_to_records(geom_stats, bands,
+                                                       date_str or utils.get_basename(inputfile)))
+
+        outputs = []
+        if self.outputdir:
+            outputfile = Path(self.outputdir).joinpath(
+                f"{utils.get_basename(inputfiles[0])}-stats-stack.csv")
+            table = pd.DataFrame.from_records(records,
+                                              columns=["zone", "date", "band", "stat", "value"])
+            table.to_csv(outputfile.as_posix(), index=False)
+            outputs.append(outputfile.as_posix())
+        return outputs
+
+    def __stats_to_records(self, geom_stats: gpd.GeoDataFrame, bands: List[int], date: str):
+        """Convert the statistics of the geometries in records (zone, date, band, stat, value)
+
+        Args:
+            geom_stats (GeoDataFrame):
+                Geometries with the statistics (see __stats_to_geoms)
+            bands ([int]):
+                List of bands in the input image to process
+            date (str):
+                Date of the raster
+
+        Returns:
+            [tuple]: list of records
+        """
+        if self.geometry_index in geom_stats.columns:
+            zones = geom_stats[self.geometry_index].tolist()
+        else:
+            zones = geom_stats.index.tolist()
+
+        prefix = self.prefix or [""] * len(bands)
+        records = []
+        for i, band in enumerate(bands):
+            band_name = prefix[i] or f"b{band}"
+            metadata = utils.get_metadata_name(band, prefix[i], "")
+            columns = [col for col in geom_stats.columns
+                       if col.startswith(metadata) and col[len(metadata):] not in ["name", "date"]]
+            for col in columns:
+                stat = col[len(metadata):]
+                records.extend((zone, date, band_name, stat, value)
+                               for zone, value in zip(zones, geom_stats[col].tolist()))
+        return records
+
     def compute_stats(self, raster: str, bands: List[int],
                       geometries: gpd.GeoDataFrame,
                       descr: List[str], date: str,
-                      area_square_meter: int) -> List[List[Dict[str, float]]]:
+                      area_square_meter: int,
+                      grid: tuple = None,
+                      whole_image: bool = False) -> List[List[Dict[str, float]]]:
         """Compute the stats
 
         Args:
@@ -509,6 +755,12 @@ class Zonalstats(Rastertool):
                 Timestamp of the input raster
             area_square_meter (int):
                 Area represented by a pixel
+            grid (tuple, optional, default=None):
+                Key of the grid of the raster (see MaskCache.grid_key). The categories
+                prepared for the grid are reused by the next rasters of the same grid.
+            whole_image (bool, optional, default=False):
+                Whether to compute the stats on the footprint of the raster (pixels valid
+                in at least one band) block by block instead of the geometries.
 
         Returns:
             [[{str: float}]]: a list of list of dictionnaries. Dict associates
@@ -520,14 +772,13 @@ class Zonalstats(Rastertool):
             # prepare the categories data
             if self.category_file_type == "vector":
                 # clip categories to the raster bounds and reproject in the raster crs
-                class_geom = vector.reproject(
-                    vector.clip(self.category_file, raster),
-                    raster)
+                class_geom = self._get_prepared(
+                    ("categories", grid),
+                    lambda: vector.reproject(vector.clip(self.category_file, raster), raster),
+                    grid is not None)
             else:  # filetype is raster
-                # vectorize the raster and reproject in the raster crs
-                class_geom = vector.reproject(
-                    vector.vectorize(self.category_file, raster, self.category_index),
-                    raster)
+                # the raster is vectorized only if the stats can not be computed on labels
+                class_geom = self.category_file
 
             # compute the statistics per category
             statistics = compute_zonal_stats_per_category(
@@ -536,14 +787,34 @@ class Zonalstats(Rastertool):
                 stats=self.stats,
                 categories=class_geom,
                 category_index=self.category_index,
-                category_labels=self.category_labels)
+                category_labels=self.category_labels,
+                masks=self._masks)
+        elif whole_image:
+            # read the raster block by block, the footprint is given by the masks
+            statistics = compute_zonal_stats_streaming(
+                None, raster,
+                bands=bands,
+                stats=self.stats,
+                bins=self.bins,
+                accuracy=self.accuracy)
         else:
             statistics = compute_zonal_stats(
                 geometries, raster,
                 bands=bands,
                 stats=self.stats,
-                categorical=self.categorical)
-
+                categorical=self.categorical,
+                streaming=self.streaming,
+                bins=self.bins,
+                masks=self._masks,
+                accuracy=self.accuracy)
+
+        return self.__to_geoms(statistics, geometries, bands, descr, date, area_square_meter)
+
+    def __to_geoms(self, statistics: List[List[Dict[str, float]]],
+                   geometries: gpd.GeoDataFrame, bands: List[int], descr: List[str],
+                   date: str, area_square_meter: int) -> gpd.GeoDataFrame:
+        """Apply the area to the statistics and append them to the geodataframe
+        (see __stats_to_geoms)"""
         # apply area
         if self.area:
             [d.update({key: area_square_meter * val})
@@ -554,6 +825,32 @@ class Zonalstats(Rastertool):
         geom_stats = self.__stats_to_geoms(statistics, geometries, bands, descr, date)
         return geom_stats
 
+    def _get_prepared(self, key: tuple, function, cache: bool = True):
+        """Get data prepared for a grid (e.g. geometries reprojected in the grid crs)
+        or prepare them if they are not in the cache
+
+        Args:
+            key (tuple):
+                Key of the data (e.g. type of data and key of the grid)
+            function (Callable):
+                Function with no argument that prepares the data
+            cache (bool, optional, default=True):
+                Whether to keep the data in the cache
+
+        Returns:
+            The prepared data
+        """
+        if not cache:
+            return function()
+        if key not in self._prepared:
+            self._prepared[key] = function()
+        return self._prepared[key]
+
+    def _clear_cache(self):
+        """Clear the geometries prepared and rasterized for the grids already processed"""
+        self._prepared.clear()
+        self._masks.clear()
+
     def __stats_to_geoms(self, statistics_data: List[List[Dict[str, float]]],
                          geometries: gpd.GeoDataFrame,
                          bands: List[int], descr: List[str], date: str) -> gpd.GeoDataFrame:
@@ -162,3 +162,34 @@ def test_bresenham_line():
     for theta in range(0, 360, 15):
         assert results[i] == [(x, y) for x, y, r in algo._bresenham_line(theta, 5)]
         i += 1
+
+
+def test_interpolated_timeseries():
+    dates = [0., 10., 20., 30.]
+    # 1 band, 1 x 5 pixels at 4 dates
+    data = np.array([
+        [[[1, 5, 7, 3, 9]]],
+        [[[2, 6, 8, 4, 9]]],
+        [[[4, 7, 9, 5, 9]]],
+        [[[8, 8, 1, 6, 9]]]], dtype=np.float32)
+    mask = np.array([
+        [[[False, True, False, True, True]]],
+        [[[False, False, True, True, True]]],
+        [[[False, True, False, True, True]]],
+        [[[False, False, True, False, True]]]])
+    series = [ma.masked_array(data[i], mask[i]) for i in range(len(dates))]
+    output_dates = [-5., 0., 5., 15., 20., 25., 35.]
+
+    output = algo.interpolated_timeseries(dates, series, output_dates, -1)
+    assert output.shape == (7, 1, 1, 5)
+
+    # pixel with all dates valid
+    assert (output[:, 0, 0, 0] == [1, 1, 1.5, 3, 4, 6, 8]).all()
+    # pixel with gaps: constant before the first and after the last valid dates
+    assert (output[:, 0, 0, 1] == [6, 6, 6, 6.5, 7, 7.5, 8]).all()
+    # pixel with two valid dates
+    assert (output[:, 0, 0, 2] == [7, 7, 7.5, 8.5, 9, 9, 9]).all()
+    # pixel with a single valid date
+    assert (output[:, 0, 0, 3] == [6, 6, 6, 6, 6, 6, 6]).all()
+    # pixel without valid date
+    assert (output[:, 0, 0, 4] == [-1, -1, -1, -1, -1, -1, -1]).all()
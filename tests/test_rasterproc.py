@@ -1,9 +1,14 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import threading
+from pathlib import Path
+
+import pytest
 import rasterio as rio
 
 from eolab.rastertools.processing import RasterProcessing, compute_sliding
+from eolab.rastertools.processing.executor import close_at_shutdown, create_executor, imap
 
 from . import utils4test
 
@@ -53,3 +58,91 @@ def test_compute_sliding():
         assert (data_transform == data_dest).all()
 
     utils4test.clear_outdir()
+
+
+def test_compute_sliding_executors(monkeypatch):
+    # create output dir and clear its content if any
+    utils4test.create_outdir()
+
+    input_image = utils4test.indir + "toulouse-mnh.tif"
+    output_image = utils4test.outdir + "toulouse-mnh-out.tif"
+
+    with rio.open(input_image) as orig:
+        data_transform = orig.read() * 2.0
+
+    # default executor of the processing
+    for executor in ["serial", "threads", "processes"]:
+        proc = RasterProcessing("Processing per band", algo=algo2D, per_band_algo=True,
+                                executor=executor)
+        compute_sliding(input_image, output_image, proc, window_size=(128, 128), window_overlap=0)
+
+        with rio.open(output_image) as dest:
+            assert (data_transform == dest.read()).all()
+
+    # executor forced by the environment variable
+    monkeypatch.setenv("RASTERTOOLS_EXECUTOR", "serial")
+    proc = RasterProcessing("Processing all bands", algo=algo3D, executor="threads")
+    compute_sliding(input_image, output_image, proc, window_size=(128, 128), window_overlap=8)
+
+    with rio.open(output_image) as dest:
+        assert (data_transform == dest.read()).all()
+
+    monkeypatch.setenv("RASTERTOOLS_EXECUTOR", "invalid")
+    with pytest.raises(ValueError):
+        compute_sliding(input_image, output_image, proc, window_size=(128, 128))
+
+    utils4test.clear_outdir()
+
+
+class Resource:
+    """Resource that creates a file when it is closed"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def close(self):
+        Path(self.path).touch()
+
+
+def _init_resource(outdir):
+    close_at_shutdown(Resource(f"{outdir}/{threading.get_ident()}.closed"))
+
+
+def test_executor_imap_bounded(monkeypatch):
+    monkeypatch.setenv("RASTERTOOLS_MAXWORKERS", "2")
+    submitted = []
+
+    def _items():
+        for i in range(100):
+            submitted.append(i)
+            yield i
+
+    for executor in ["serial", "threads"]:
+        submitted.clear()
+        with create_executor(executor) as pool:
+            for i, result in enumerate(imap(pool, lambda x: 2 * x, _items())):
+                assert result == 2 * i
+                # twice the number of workers pending and the next item
+                assert len(submitted) - i <= 5
+
+        # the tasks are no longer submitted when the results are not consumed
+        submitted.clear()
+        with create_executor(executor) as pool:
+            results = imap(pool, lambda x: 2 * x, _items())
+            assert next(results) == 0
+            results.close()
+        assert len(submitted) <= 6
+
+
+@pytest.mark.parametrize("executor", ["serial", "threads", "processes"])
+def test_executor_close_at_shutdown(monkeypatch, tmp_path, executor):
+    monkeypatch.setenv("RASTERTOOLS_MAXWORKERS", "2")
+    with create_executor(executor, initializer=_init_resource,
+                         initargs=(tmp_path.as_posix(),)) as pool:
+        assert list(imap(pool, abs, range(-10, 0))) == list(range(10, 0, -1))
+        assert not list(tmp_path.glob("*.closed"))
+    # the resource of every worker is closed
+    assert len(list(tmp_path.glob("*.closed"))) >= 1
+
+    with pytest.raises(RuntimeError):
+        close_at_shutdown(Resource(f"{tmp_path}/main.closed"))
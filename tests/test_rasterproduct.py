@@ -3,14 +3,19 @@
 
 import pytest
 import filecmp
+import os
+import tarfile
+import time
 import zipfile
 from pathlib import Path
 from datetime import datetime
 
+import numpy as np
 import rasterio
 
 from eolab.rastertools.product import RasterType, BandChannel
-from eolab.rastertools.product import RasterProduct
+from eolab.rastertools.product import RasterProduct, rasterproduct, scratch
+from eolab.rastertools.product.vrt import add_masks_to_vrt, masked_vrt, write_vrt
 
 from . import utils4test
 
@@ -332,3 +337,290 @@ def test_create_product_special_cases():
     assert msg in str(exc.value)
 
     utils4test.clear_outdir()
+
+
+def test_add_masks_to_vrt_native(tmp_path):
+    # three bands of masks: a pixel is valid when all masks are 0
+    data = np.zeros((3, 20, 30), dtype=np.uint8)
+    data[0, 2:5, 3:9] = 1
+    data[1, 10, :] = 4
+    data[2, 15:, 20:] = 255
+    maskfile = (tmp_path / "masks.tif").as_posix()
+    with rasterio.open(maskfile, "w", driver="GTiff", width=30, height=20, count=3,
+                       dtype="uint8", transform=rasterio.Affine(1, 0, 0, 0, -1, 20)) as dst:
+        dst.write(data)
+    src_vrt = (tmp_path / "masks.vrt").as_posix()
+    with open(src_vrt, "w") as f:
+        f.write('<VRTDataset rasterXSize="30" rasterYSize="20"><VRTRasterBand dataType="Byte" '
+                'band="1"><SimpleSource><SourceFilename relativeToVRT="1">masks.tif'
+                '</SourceFilename><SourceBand>1</SourceBand></SimpleSource></VRTRasterBand>'
+                '</VRTDataset>')
+
+    funcname = "eolab.rastertools.product.s2_maja_mask"
+    content = add_masks_to_vrt(src_vrt, maskfile, [1, 2, 3], funcname)
+    assert b"PixelFunctionLanguage" not in content and b"<LUT>" in content
+    masked_vrt = (tmp_path / "masked.vrt").as_posix()
+    with open(masked_vrt, "wb") as f:
+        f.write(content)
+
+    # the mask is evaluated by GDAL without any call to python
+    with rasterio.Env(GDAL_VRT_ENABLE_PYTHON=False):
+        with rasterio.open(masked_vrt) as dataset:
+            mask = dataset.read_masks(1)
+    assert np.array_equal(mask > 0, data.sum(axis=0) == 0)
+
+    # the python pixel function is kept on demand
+    content = add_masks_to_vrt(src_vrt, maskfile, [1, 2, 3], funcname, native=False)
+    assert b"<PixelFunctionLanguage>Python" in content and b"<LUT>" not in content
+
+
+def test_add_masks_to_vrt_native_single_mask(tmp_path):
+    # a single band of masks: the built-in pixel functions need two sources at least
+    data = np.zeros((1, 20, 30), dtype=np.uint8)
+    data[0, 2:5, 3:9] = 1
+    data[0, 15:, 20:] = 255
+    maskfile = (tmp_path / "masks.tif").as_posix()
+    with rasterio.open(maskfile, "w", driver="GTiff", width=30, height=20, count=1,
+                       dtype="uint8", transform=rasterio.Affine(1, 0, 0, 0, -1, 20)) as dst:
+        dst.write(data)
+    src_vrt = (tmp_path / "masks.vrt").as_posix()
+    with open(src_vrt, "w") as f:
+        f.write('<VRTDataset rasterXSize="30" rasterYSize="20"><VRTRasterBand dataType="Byte" '
+                'band="1"><SimpleSource><SourceFilename relativeToVRT="1">masks.tif'
+                '</SourceFilename><SourceBand>1</SourceBand></SimpleSource></VRTRasterBand>'
+                '</VRTDataset>')
+
+    funcname = "eolab.rastertools.product.s2_maja_mask"
+    content = add_masks_to_vrt(src_vrt, maskfile, [1], funcname)
+    assert b"PixelFunctionType" not in content and b"<LUT>" in content
+    masked_vrt = (tmp_path / "masked.vrt").as_posix()
+    with open(masked_vrt, "wb") as f:
+        f.write(content)
+
+    with rasterio.Env(GDAL_VRT_ENABLE_PYTHON=False):
+        with rasterio.open(masked_vrt) as dataset:
+            mask = dataset.read_masks(1)
+    assert np.array_equal(mask > 0, data[0] == 0)
+
+
+def test_masked_vrt_in_memory(tmp_path):
+    # three bands of data followed by three bands of masks
+    data = np.arange(3 * 20 * 30, dtype=np.int16).reshape((3, 20, 30))
+    masks = np.zeros((3, 20, 30), dtype=np.int16)
+    masks[0, 2:5, 3:9] = 1
+    masks[2, 15:, 20:] = 2
+    raster = (tmp_path / "raster.tif").as_posix()
+    transform = rasterio.Affine(10, 0, 300000, 0, -10, 5000000)
+    with rasterio.open(raster, "w", driver="GTiff", width=30, height=20, count=6, dtype="int16",
+                       crs="EPSG:32631", transform=transform, nodata=-10000) as dst:
+        dst.write(np.concatenate([data, masks]))
+
+    content = masked_vrt(raster, [1, 2, 3], [4, 5, 6], "eolab.rastertools.product.s2_maja_mask",
+                         descriptions=["b1", "b2", "b3"])
+    masked_image = (tmp_path / "raster-mask.vrt").as_posix()
+    write_vrt(content, masked_image)
+
+    with rasterio.open(masked_image) as dataset:
+        assert dataset.count == 3
+        assert dataset.crs == "EPSG:32631" and dataset.transform == transform
+        assert dataset.nodatavals == (-10000, -10000, -10000)
+        assert dataset.descriptions == ("b1", "b2", "b3")
+        assert np.array_equal(dataset.read(), data)
+        assert np.array_equal(dataset.read_masks(1) > 0, masks.sum(axis=0) == 0)
+
+    # the input raster can not be opened
+    with pytest.raises(IOError):
+        masked_vrt((tmp_path / "missing.tif").as_posix(), [1, 2, 3], [4, 5, 6])
+
+
+def test_rasterproduct_cache(monkeypatch, tmp_path):
+    monkeypatch.setenv("RASTERTOOLS_CACHEDIR", tmp_path.as_posix())
+    file = utils4test.indir + "S2B_MSIL1C_20191008T105029_N0208_R051_T30TYP_20191008T125041.zip"
+
+    # the VRT is created in the cache
+    with RasterProduct(file) as prod:
+        raster = prod.get_raster(bands=["B04", "B08"], masks=None)
+        other = prod.get_raster(bands=["B04"], masks=None)
+    assert raster.startswith(tmp_path.as_posix())
+    assert other != raster and len(list(tmp_path.iterdir())) == 2
+    with rasterio.open(raster) as dataset:
+        assert dataset.count == 2
+
+    # the VRT is reused without listing the archive again
+    def extract_bands(*args):
+        raise AssertionError("archive must not be listed")
+    monkeypatch.setattr(rasterproduct, "_extract_bands", extract_bands)
+    with RasterProduct(file) as prod:
+        assert prod.get_raster(bands=["B04", "B08"], masks=None) == raster
+    assert len(list(tmp_path.iterdir())) == 2
+
+
+def test_rasterproduct_cache_key(tmp_path):
+    archive = tmp_path / "CACHEKEY_20200101.zip"
+    with zipfile.ZipFile(archive, "w") as myzip:
+        myzip.writestr("CACHEKEY_20200101_B1.tif", "")
+    rastertype = {"name": "CACHEKEY", "product_pattern": "^CACHEKEY_(?P<date>[0-9]*).*$",
+                  "bands_pattern": "^.*_(?P<bands>{})\\.tif$", "date_format": "%Y%m%d",
+                  "bands": [{"channel": "blue", "identifier": "B1"}]}
+
+    def get_cache_key():
+        RasterType.add({"rastertypes": [rastertype]})
+        product = RasterProduct(archive)
+        return product._RasterProduct__get_cache_key("all", None, None, True)
+
+    try:
+        key = get_cache_key()
+        assert get_cache_key() == key
+        # a rastertype redefined with the same name does not reuse the VRTs
+        rastertype["bands_pattern"] = "^.*_(?P<bands>{})\\.TIF$"
+        assert get_cache_key() != key
+    finally:
+        RasterType.rastertypes.pop("CACHEKEY")
+
+
+def test_prune_cache(tmp_path):
+    old = time.time() - 31 * 86400
+    entries = {name: tmp_path / name for name in ["a" * 64, "b" * 64, "c" * 64 + "-tmp"]}
+    for entry in entries.values():
+        entry.mkdir()
+        entry.joinpath("product.vrt").write_text("")
+    os.utime(entries["a" * 64], (old, old))
+    os.utime(entries["c" * 64 + "-tmp"], (old, old))
+
+    # only the entries unused for 30 days are removed (not the entries being generated)
+    rasterproduct._prune_cache(tmp_path, 30)
+    assert sorted(entry.name for entry in tmp_path.iterdir()) == ["b" * 64, "c" * 64 + "-tmp"]
+
+
+def test_archive_members_index(monkeypatch, tmp_path):
+    monkeypatch.setenv("RASTERTOOLS_CACHEDIR", tmp_path.joinpath("cache").as_posix())
+    archive = tmp_path / "SENTINEL2B_20181023-105107-455_L2A_T30TYP_D.tar.gz"
+    with tarfile.open(archive, "w:gz") as mytar:
+        for name in ["FRE_B2.tif", "FRE_B3.tif", "CLM_R1.tif", "README.txt"]:
+            mytar.addfile(tarfile.TarInfo(f"product/SENTINEL2B_{name}"))
+    bands_pattern = "^.*SENTINEL2.*_FRE_(?P<bands>B2|B3)\\.tif$"
+    masks_pattern = "^.*SENTINEL2.*_(?P<bands>CLM_R1)\\.tif$"
+
+    bands, masks = rasterproduct._extract_bands(archive, bands_pattern, masks_pattern)
+    assert sorted(bands) == ["B2", "B3"] and list(masks) == ["CLM_R1"]
+    assert bands["B2"] == f"/vsitar/{archive.as_posix()}/product/SENTINEL2B_FRE_B2.tif"
+    assert tmp_path.joinpath("cache", rasterproduct.ARCHIVES_INDEX).exists()
+
+    # the members are read from the index: the archive is not listed again
+    def list_archive_members(inputfile):
+        raise AssertionError("archive must not be listed")
+    with monkeypatch.context() as m:
+        m.setattr(rasterproduct, "_list_archive_members", list_archive_members)
+        assert rasterproduct._extract_bands(archive, bands_pattern, masks_pattern) == \
+            (bands, masks)
+
+    # the index is updated when the archive is modified
+    with tarfile.open(archive, "w:gz") as mytar:
+        mytar.addfile(tarfile.TarInfo("product/SENTINEL2B_FRE_B2.tif"))
+    bands, masks = rasterproduct._extract_bands(archive, bands_pattern, masks_pattern)
+    assert list(bands) == ["B2"] and masks == {}
+
+
+def test_list_archive_members_targz(monkeypatch, tmp_path):
+    archive = tmp_path / "SENTINEL2B_20181023-105107-455_L2A_T30TYP_D.TAR.GZ"
+    with tarfile.open(archive, "w:gz") as mytar:
+        mytar.addfile(tarfile.TarInfo("product/SENTINEL2B_FRE_B2.tif"))
+    tar = tmp_path / "SENTINEL2B_20181023-105107-455_L2A_T30TYP_D.tar"
+    with tarfile.open(tar, "w") as mytar:
+        mytar.addfile(tarfile.TarInfo("product/SENTINEL2B_FRE_B3.tif"))
+
+    # the tar.gz archives are decompressed with gzip
+    modes = []
+    tarfile_open = tarfile.open
+
+    def open_tar(name, mode="r", **kwargs):
+        modes.append(mode)
+        return tarfile_open(name, mode=mode, **kwargs)
+    monkeypatch.setattr(tarfile, "open", open_tar)
+    assert rasterproduct._list_archive_members(archive) == ["product/SENTINEL2B_FRE_B2.tif"]
+    assert rasterproduct._list_archive_members(tar) == ["product/SENTINEL2B_FRE_B3.tif"]
+    assert modes == ["r:gz", "r"]
+
+
+def _write_jp2(jp2, data):
+    with rasterio.open(jp2, "w", driver="JP2OpenJPEG", width=data.shape[2],
+                       height=data.shape[1], count=1, dtype=data.dtype,
+                       QUALITY=100, REVERSIBLE="YES") as dst:
+        dst.write(data)
+
+
+def test_transcode_scratch(monkeypatch, tmp_path):
+    monkeypatch.setenv("RASTERTOOLS_SCRATCHDIR", tmp_path.joinpath("scratch").as_posix())
+    data = np.arange(64 * 64, dtype=np.uint16).reshape(1, 64, 64)
+    archive = tmp_path / "product.zip"
+    with zipfile.ZipFile(archive, "w") as myzip:
+        for name in ["B2.jp2", "B3.jp2"]:
+            _write_jp2(tmp_path / name, data)
+            myzip.write(tmp_path / name, name)
+    b2, b3 = [f"/vsizip/{archive.as_posix()}/{name}" for name in ["B2.jp2", "B3.jp2"]]
+
+    files = scratch.transcode([b2, "mask.tif"], archive)
+    assert files[1] == "mask.tif"
+    assert Path(files[0]).parent == tmp_path / "scratch"
+    with rasterio.open(files[0]) as src:
+        assert src.driver == "GTiff" and src.profile["tiled"]
+        np.testing.assert_array_equal(src.read(), data)
+
+    # the copy is reused, it is not removed while it is pinned
+    assert scratch.transcode([b2], archive) == files[:1]
+    monkeypatch.setenv("RASTERTOOLS_SCRATCHSIZE", "0")
+    copies = scratch.transcode([b3], archive)
+    assert Path(copies[0]).exists() and Path(files[0]).exists()
+
+    # the copy is removed when the size limit is exceeded and it is released
+    scratch.release(files)
+    scratch.release(files)
+    scratch.transcode([b3], archive)
+    assert not Path(files[0]).exists()
+    scratch.release(copies)
+    scratch.release(copies)
+
+    # the copy of a file of a dir is not reused when the file is modified
+    jp2 = tmp_path / "B4.jp2"
+    _write_jp2(jp2, data)
+    copy = scratch.transcode([jp2.as_posix()], tmp_path)
+    scratch.release(copy)
+    _write_jp2(jp2, data + 1)
+    new_copy = scratch.transcode([jp2.as_posix()], tmp_path)
+    assert new_copy != copy
+    with rasterio.open(new_copy[0]) as src:
+        np.testing.assert_array_equal(src.read(), data + 1)
+    scratch.release(new_copy)
+
+    # the files are unchanged when the scratch dir is not set
+    monkeypatch.delenv("RASTERTOOLS_SCRATCHDIR")
+    assert scratch.transcode([b2], archive) == [b2]
+
+
+def test_rasterproduct_scratch(monkeypatch, tmp_path):
+    monkeypatch.setenv("RASTERTOOLS_SCRATCHDIR", tmp_path.joinpath("scratch").as_posix())
+    monkeypatch.setenv("RASTERTOOLS_SCRATCHSIZE", "0")
+    products = []
+    for i, date in enumerate(["20191008T105029", "20191018T105029"]):
+        data = np.full((1, 32, 32), i + 1, dtype=np.uint16)
+        archive = tmp_path / f"S2B_MSIL1C_{date}_N0208_R051_T30TYP_{date}.zip"
+        with zipfile.ZipFile(archive, "w") as myzip:
+            for band in ["B02", "B03"]:
+                jp2 = tmp_path / f"T30TYP_{date}_{band}.jp2"
+                _write_jp2(jp2, data)
+                myzip.write(jp2, jp2.name)
+        products.append(archive)
+
+    # two products open at once: the copies of the first one are kept while it is open
+    with RasterProduct(products[0]) as product0, RasterProduct(products[1]) as product1:
+        raster0 = product0.get_raster(bands=["B02", "B03"], masks=None)
+        raster1 = product1.get_raster(bands=["B02", "B03"], masks=None)
+        assert len(list(tmp_path.joinpath("scratch").glob("*.tif"))) == 4
+        for i, raster in enumerate([raster0, raster1]):
+            with rasterio.open(raster) as src:
+                assert (src.read() == i + 1).all()
+
+    # the copies are removed by the next transcoding once the products are closed
+    with RasterProduct(products[0]) as product0:
+        product0.get_raster(bands=["B02"], masks=None)
+        assert len(list(tmp_path.joinpath("scratch").glob("*.tif"))) == 1
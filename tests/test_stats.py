@@ -1,6 +1,14 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import geopandas as gpd
+import numpy as np
+import pytest
+import rasterio
+from rasterio.windows import Window
+from shapely.geometry import Point, box
+
 from eolab.rastertools.processing import stats, vector
+from eolab.rastertools.processing import zonal
 
 from . import utils4test
 
@@ -284,3 +292,530 @@ def test_compute_zonal_stats_per_category():
     for geom_stats, ref_stats in zip(statistics, ref):
         for i, band in enumerate(bands):
             assert geom_stats[i] == ref_stats[i]
+
+
+def test_compute_zonal_stats_by_labels():
+    raster = utils4test.indir + "tif_file.tif"
+    stats_to_compute = zonal.REDUCIBLE_STATS
+    bands = [1, 2, 3, 4]
+
+    # overlapping and touching geometries, geometries partially outside the raster
+    with rasterio.open(raster) as src:
+        left, bottom, right, top = src.bounds
+        xres, yres = src.res
+    geoms = [box(left + i * 50 * xres, bottom + j * 40 * yres,
+                 left + (i + 1) * 50 * xres, bottom + (j + 1) * 40 * yres)
+             for i in range(5) for j in range(3)]
+    geoms.append(box(left + 25 * xres, bottom + 20 * yres, left + 120 * xres, bottom + 90 * yres))
+    geoms.append(box(left - 10 * xres, top - 30 * yres, left + 30 * xres, top + 10 * yres))
+    geoms.append(box(left + 30 * xres, bottom + 30 * yres,
+                     left + 30.2 * xres, bottom + 30.2 * yres))
+    geometries = gpd.GeoDataFrame(geometry=geoms, crs=src.crs)
+
+    assert (zonal._split_in_layers(geometries.geometry) == [0] * 15 + [1, 0, 2]).all()
+
+    statistics = zonal.compute_zonal_stats_by_labels(geometries, raster, bands=bands,
+                                                     stats=stats_to_compute, block_size=128)
+    ref = stats._compute_zonal_stats_per_geometry(geometries, raster, bands=bands,
+                                                  stats=stats_to_compute)
+
+    assert len(statistics) == len(geometries.index)
+    for geom_stats, ref_stats in zip(statistics, ref):
+        assert len(geom_stats) == len(bands)
+        for band_stats, band_ref in zip(geom_stats, ref_stats):
+            assert band_stats.keys() == band_ref.keys()
+            for key, val in band_ref.items():
+                assert band_stats[key] == (None if val is None else pytest.approx(val))
+
+    # the geometry that does not contain any pixel center has no stats
+    assert statistics[-1][0]["count"] == 0
+    assert statistics[-1][0]["mean"] is None
+
+    with pytest.raises(ValueError):
+        zonal.compute_zonal_stats_by_labels(geometries, raster, stats=["median"])
+
+
+def test_compute_zonal_stats_streaming():
+    raster = utils4test.indir + "tif_file.tif"
+    stats_to_compute = ["count", "min", "max", "mean", "std", "median", "mad",
+                        "percentile_10", "percentile_75", "valid"]
+    bands = [1, 2]
+
+    with rasterio.open(raster) as src:
+        left, bottom, right, top = src.bounds
+        xres, yres = src.res
+    geoms = [box(left + i * 300 * xres, bottom + 10 * yres,
+                 left + (i + 1) * 300 * xres, top - 10 * yres) for i in range(3)]
+    geoms.append(box(left + 100 * xres, bottom + 100 * yres, left + 500 * xres, top))
+    geometries = gpd.GeoDataFrame(geometry=geoms, crs=src.crs)
+
+    ref = stats._compute_zonal_stats_per_geometry(geometries, raster, bands=bands,
+                                                  stats=stats_to_compute)
+
+    # histograms with bins of width 1: stats are exact
+    statistics = stats.compute_zonal_stats(geometries, raster, bands=bands,
+                                           stats=stats_to_compute, streaming=True, bins=65536)
+    assert len(statistics) == len(geometries.index)
+    for geom_stats, ref_stats in zip(statistics, ref):
+        for band_stats, band_ref in zip(geom_stats, ref_stats):
+            assert band_stats.keys() == band_ref.keys()
+            for key, val in band_ref.items():
+                assert band_stats[key] == pytest.approx(val)
+
+    # approximated quantiles: error is bounded by the bin width
+    statistics = stats.compute_zonal_stats(geometries, raster, bands=bands,
+                                           stats=stats_to_compute, streaming=True, bins=16)
+    for geom_stats, ref_stats in zip(statistics, ref):
+        for band_stats, band_ref in zip(geom_stats, ref_stats):
+            width = (band_ref["max"] - band_ref["min"]) / 16
+            for key in ["median", "mad", "percentile_10", "percentile_75"]:
+                assert abs(band_stats[key] - band_ref[key]) <= width
+
+    # quantile sketches: relative error is bounded by the accuracy
+    for accuracy in [0.01, 0.001]:
+        statistics = stats.compute_zonal_stats(geometries, raster, bands=bands,
+                                               stats=stats_to_compute, streaming=True,
+                                               accuracy=accuracy)
+        for geom_stats, ref_stats in zip(statistics, ref):
+            for band_stats, band_ref in zip(geom_stats, ref_stats):
+                assert band_stats.keys() == band_ref.keys()
+                for key in ["count", "min", "max", "mean", "std", "valid"]:
+                    assert band_stats[key] == pytest.approx(band_ref[key])
+                for key in ["median", "percentile_10", "percentile_75"]:
+                    assert abs(band_stats[key] - band_ref[key]) <= accuracy * band_ref[key]
+                bound = 2 * accuracy * max(abs(band_ref["min"]), abs(band_ref["max"]))
+                assert abs(band_stats["mad"] - band_ref["mad"]) <= bound
+
+    with pytest.raises(ValueError):
+        stats.compute_zonal_stats(geometries, raster, stats=["majority"], streaming=True)
+
+
+def test_zonal_histogram_sparse():
+    # 100000 labels x 1024 bins: only the non empty bins are kept
+    nb_labels = 100000
+    vmin, vmax = np.zeros(nb_labels), np.full(nb_labels, 2000.)
+    histogram = zonal._ZonalHistogram(vmin, vmax, 1024, integer=True)
+    values = np.arange(0, 2000, 10, dtype=np.uint16)
+    for label in [3, 99999]:
+        labels = np.full(len(values), label)
+        histogram.merge(histogram.reduce(labels, values))
+        histogram.merge(histogram.reduce(labels[:10], values[:10]))
+    histogram._compact()
+    assert len(histogram.indexes) <= 2 * len(values)
+
+    ref = np.concatenate([values, values[:10]])
+    for label in [3, 99999]:
+        feature_stats = histogram.get_stats(label, ["median", "percentile_90"])
+        assert abs(feature_stats["median"] - np.median(ref)) <= 2000 / 1024
+        assert abs(feature_stats["percentile_90"] - np.percentile(ref, 90)) <= 2000 / 1024
+
+
+@pytest.mark.parametrize("executor", ["threads", "processes"])
+def test_compute_zonal_stats_executors(monkeypatch, executor):
+    raster = utils4test.indir + "tif_file.tif"
+    stats_to_compute = ["count", "min", "max", "mean", "std", "median", "percentile_25"]
+    bands = [1, 3]
+
+    with rasterio.open(raster) as src:
+        left, bottom, right, top = src.bounds
+        xres, yres = src.res
+    geoms = [box(left + i * 70 * xres, bottom + j * 60 * yres,
+                 left + (i + 2) * 70 * xres, bottom + (j + 2) * 60 * yres)
+             for i in range(6) for j in range(4)]
+    geometries = gpd.GeoDataFrame(geometry=geoms, crs=src.crs)
+
+    def compute():
+        return [zonal.compute_zonal_stats_by_labels(geometries, raster, bands=bands,
+                                                    stats=DEFAULT_STATS, block_size=64),
+                zonal.compute_zonal_stats_streaming(geometries, raster, bands=bands,
+                                                    stats=stats_to_compute, block_size=64),
+                zonal.compute_zonal_stats_streaming(geometries, raster, bands=bands,
+                                                    stats=stats_to_compute, block_size=64,
+                                                    accuracy=0.01),
+                stats.compute_zonal_stats(geometries, raster, bands=bands,
+                                          stats=stats_to_compute)]
+
+    monkeypatch.setenv("RASTERTOOLS_EXECUTOR", "serial")
+    ref = compute()
+
+    # results do not depend on the backend nor on the number of workers
+    monkeypatch.setenv("RASTERTOOLS_EXECUTOR", executor)
+    monkeypatch.setenv("RASTERTOOLS_MAXWORKERS", "3")
+    assert compute() == ref
+
+
+def test_compute_zonal_stats_per_geometry_strips(monkeypatch):
+    raster = utils4test.indir + "toulouse-mnh.tif"
+    stats_to_compute = ["count", "min", "max", "median", "mad", "percentile_90"]
+
+    # dense overlapping geometries, large geometries and geometries outside the raster
+    with rasterio.open(raster) as src:
+        left, bottom, right, top = src.bounds
+        xres, yres = src.res
+        nodata = src.nodata
+    geoms = [box(left + i * 37.5 * xres, top - (j + 1.5) * 23.2 * yres,
+                 left + (i + 1.5) * 37.5 * xres, top - j * 23.2 * yres)
+             for i in range(0, 24, 5) for j in range(32)]
+    geoms.append(box(left + 100 * xres, bottom + 10 * yres, right - 100 * xres, top - 10 * yres))
+    geoms.append(box(left - 50 * xres, bottom - 50 * yres, left + 50 * xres, bottom + 50 * yres))
+    geometries = gpd.GeoDataFrame(geometry=geoms, crs=src.crs)
+
+    # rows are read by strips of 20 rows at least, geometries higher than 100 rows are
+    # read on their own
+    monkeypatch.setattr(stats, "STRIP_HEIGHT", 20)
+    monkeypatch.setattr(stats, "MAX_STRIP_ROWS", 100)
+    statistics = stats.compute_zonal_stats(geometries, raster, stats=stats_to_compute)
+
+    with rasterio.open(raster) as src:
+        for geom, geom_stats in zip(geoms, statistics):
+            window = rasterio.features.geometry_window(src, [geom])
+            data = src.read([1], window=window)
+            ref = stats._compute_stats((data, src.window_transform(window), [geom], window),
+                                       nodata, stats_to_compute)
+            assert geom_stats == ref
+
+
+def test_iter_strips_bounded(monkeypatch):
+    monkeypatch.setattr(stats, "STRIP_HEIGHT", 20)
+    monkeypatch.setattr(stats, "MAX_STRIP_ROWS", 50)
+    data = np.arange(400 * 300, dtype=np.float32).reshape(1, 400, 300)
+    profile = {"driver": "GTiff", "width": 300, "height": 400, "count": 1,
+               "dtype": "float32", "tiled": True, "blockxsize": 16, "blockysize": 16}
+    # a window as high as the raster and small windows at the top and at the bottom
+    windows = [Window(10, 0, 10, 400), Window(0, 0, 10, 10), Window(280, 380, 10, 10)]
+    windows += [Window(i * 3, i * 4, 20, 40) for i in range(90)]
+    items = [([], "")] * len(windows)
+
+    with rasterio.MemoryFile() as memfile:
+        with memfile.open(**profile) as dst:
+            dst.write(data)
+        with memfile.open() as src:
+            small = [window for window in windows if window.height <= 50]
+            for _, strips in stats._iter_strips([src], [1], small):
+                assert sum(datas.shape[1] for _, _, datas in strips) <= 50 + 2 * 32
+
+            seen = set()
+            for indexes, packs in stats._iter_packs([src], [1], items, windows):
+                for i, pack in zip(indexes, packs):
+                    (row_start, row_stop), (col_start, col_stop) = windows[i].toranges()
+                    np.testing.assert_array_equal(
+                        pack[1], data[:, row_start:row_stop, col_start:col_stop])
+                    seen.add(i)
+            assert seen == set(range(len(windows)))
+
+
+def test_iter_strips_columns(monkeypatch):
+    monkeypatch.setattr(stats, "STRIP_HEIGHT", 20)
+    data = np.arange(200 * 300, dtype=np.float32).reshape(1, 200, 300)
+    profile = {"driver": "GTiff", "width": 300, "height": 200, "count": 1,
+               "dtype": "float32", "tiled": True, "blockxsize": 16, "blockysize": 16}
+    # small windows on the left and on the right of the raster, an empty window
+    windows = [Window(5, 10, 10, 10), Window(250, 100, 20, 50), Window(20, 150, 0, 10)]
+
+    with rasterio.MemoryFile() as memfile:
+        with memfile.open(**profile) as dst:
+            dst.write(data)
+        with memfile.open() as src:
+            # only the columns of blocks of the windows of every strip are read
+            columns = set()
+            for _, strips in stats._iter_strips([src], [1], windows):
+                columns.update((top, left, datas.shape[2]) for top, left, datas in strips)
+            assert columns == {(0, 0, 16), (96, 240, 32), (128, 240, 32)}
+
+            items = [([], "")] * len(windows)
+            for indexes, packs in stats._iter_packs([src], [1], items, windows):
+                for i, pack in zip(indexes, packs):
+                    (row_start, row_stop), (col_start, col_stop) = windows[i].toranges()
+                    np.testing.assert_array_equal(
+                        pack[1], data[:, row_start:row_stop, col_start:col_stop])
+
+
+def test_compute_zonal_stats_per_category_raster():
+    raster = utils4test.indir + "tif_file.tif"
+    stats_to_compute = ["count", "min", "max", "mean", "std", "valid"]
+    bands = [1, 2]
+
+    # category raster 3 times coarser than the input image
+    utils4test.create_outdir()
+    categories = utils4test.outdir + "categories.tif"
+    with rasterio.open(raster) as src:
+        left, bottom, right, top = src.bounds
+        xres, yres = src.res
+        transform = rasterio.Affine(3 * xres, 0, left, 0, -3 * yres, top)
+        classes = (np.arange(150 * 400).reshape(150, 400) // 7 % 5 + 1) * 10
+        with rasterio.open(categories, "w", driver="GTiff", width=400, height=150, count=1,
+                           dtype="uint8", crs=src.crs, transform=transform) as dst:
+            dst.write(classes.astype(np.uint8), 1)
+
+    geoms = [box(left + i * 120 * xres, bottom + 20 * yres,
+                 left + (i + 2) * 120 * xres, bottom + 200 * yres) for i in range(8)]
+    geometries = gpd.GeoDataFrame(geometry=geoms, crs=src.crs)
+    labels = {"10": "ten", "30": "thirty"}
+
+    statistics = stats.compute_zonal_stats_per_category(geometries, raster, bands=bands,
+                                                        stats=stats_to_compute,
+                                                        categories=categories,
+                                                        category_labels=labels)
+
+    # reference: stats computed on the vectorized categories
+    class_geom = vector.reproject(vector.vectorize(categories, raster, "Classe"), raster)
+    ref = stats.compute_zonal_stats_per_category(geometries, raster, bands=bands,
+                                                 stats=stats_to_compute,
+                                                 categories=class_geom,
+                                                 category_labels=labels)
+
+    assert len(statistics) == len(geometries.index)
+    for geom_stats, ref_stats in zip(statistics, ref):
+        for band_stats, band_ref in zip(geom_stats, ref_stats):
+            assert band_stats.keys() == band_ref.keys()
+            assert "thirtymean" in band_stats and "20mean" in band_stats
+            for key, val in band_ref.items():
+                assert band_stats[key] == pytest.approx(val)
+
+    utils4test.clear_outdir()
+
+
+def test_compute_zonal_stats_masks(monkeypatch):
+    raster = utils4test.indir + "tif_file.tif"
+    bands = [1, 2]
+
+    with rasterio.open(raster) as src:
+        left, bottom, right, top = src.bounds
+        xres, yres = src.res
+    geoms = [box(left + i * 90 * xres, bottom + j * 70 * yres,
+                 left + (i + 1.5) * 90 * xres, bottom + (j + 1.5) * 70 * yres)
+             for i in range(4) for j in range(3)]
+    geometries = gpd.GeoDataFrame(geometry=geoms, crs=src.crs)
+
+    all_stats = [DEFAULT_STATS, DEFAULT_STATS + ["median", "majority"]]
+    ref = [stats.compute_zonal_stats(geometries, raster, bands=bands, stats=s)
+           for s in all_stats]
+
+    masks = zonal.MaskCache()
+    for s, ref_stats in zip(all_stats, ref):
+        assert stats.compute_zonal_stats(geometries, raster, bands=bands, stats=s,
+                                         masks=masks) == ref_stats
+    assert len(masks) > 0
+
+    # next rasters of the same grid use the masks of the cache
+    def _fail(*args):
+        raise AssertionError("geometries shall not be rasterized again")
+
+    monkeypatch.setattr(zonal, "_burn_block", _fail)
+    monkeypatch.setattr(stats, "_geometry_mask", _fail)
+    for s, ref_stats in zip(all_stats, ref):
+        assert stats.compute_zonal_stats(geometries, raster, bands=bands, stats=s,
+                                         masks=masks) == ref_stats
+
+    # other geometries are rasterized
+    with pytest.raises(AssertionError):
+        stats.compute_zonal_stats(geometries.iloc[1:], raster, bands=bands, stats=DEFAULT_STATS,
+                                  masks=masks)
+
+
+def test_mask_cache_bounded():
+    masks = zonal.MaskCache(max_size=1000)
+    for key in "abc":
+        masks.get(key, lambda: np.zeros(100, dtype=np.int32))
+        if key == "b":
+            # "a" is the most recently used mask
+            masks.get("a", lambda: None)
+    assert len(masks) == 2 and masks.size <= 1000
+
+    # the least recently used mask has been removed
+    assert masks.get("b", lambda: "computed") == "computed"
+    assert isinstance(masks.get("a", lambda: "computed"), np.ndarray)
+
+    # a mask greater than the cache is not kept
+    masks.get("d", lambda: np.zeros(1000, dtype=np.int32))
+    assert "d" not in masks._masks and masks.size <= 1000
+
+
+def test_compute_zonal_stats_stack():
+    raster = utils4test.indir + "tif_file.tif"
+    bands = [1, 3]
+
+    # stack of 3 dates of the same grid
+    utils4test.create_outdir()
+    images = []
+    with rasterio.open(raster) as src:
+        left, bottom, right, top = src.bounds
+        xres, yres = src.res
+        profile = src.profile
+        data = src.read()
+    for i in range(3):
+        image = utils4test.outdir + f"date{i}.tif"
+        with rasterio.open(image, "w", **profile) as dst:
+            dst.write(data // (i + 1))
+        images.append(image)
+
+    geoms = [box(left + i * 90 * xres, bottom + j * 70 * yres,
+                 left + (i + 1.5) * 90 * xres, bottom + (j + 1.5) * 70 * yres)
+             for i in range(4) for j in range(3)]
+    geometries = gpd.GeoDataFrame(geometry=geoms, crs=src.crs)
+
+    for s in [DEFAULT_STATS, DEFAULT_STATS + ["median", "majority"]]:
+        statistics = stats.compute_zonal_stats_stack(geometries, images, bands=bands, stats=s)
+        assert len(statistics) == len(images)
+        for image, image_stats in zip(images, statistics):
+            ref = stats.compute_zonal_stats(geometries, image, bands=bands, stats=s)
+            assert image_stats == ref
+
+    statistics = stats.compute_zonal_stats_stack(geometries, images, bands=bands,
+                                                 stats=["min", "max", "median"], streaming=True)
+    for image, image_stats in zip(images, statistics):
+        assert image_stats == stats.compute_zonal_stats(geometries, image, bands=bands,
+                                                        stats=["min", "max", "median"],
+                                                        streaming=True)
+
+    # images of another grid can not be stacked
+    with pytest.raises(ValueError):
+        stats.compute_zonal_stats_stack(geometries, [raster, utils4test.indir + "toulouse-mnh.tif"])
+
+    utils4test.clear_outdir()
+
+
+def test_extract_zonal_outliers(monkeypatch):
+    raster = utils4test.indir + "tif_file.tif"
+    bands = [1, 3]
+
+    with rasterio.open(raster) as src:
+        left, bottom, right, top = src.bounds
+        xres, yres = src.res
+        data = src.read(bands)
+        nodata = src.nodata
+    geoms = [box(left + i * 90 * xres, bottom + j * 70 * yres,
+                 left + (i + 1.5) * 90 * xres, bottom + (j + 1.5) * 70 * yres)
+             for i in range(4) for j in range(3)]
+    geometries = gpd.GeoDataFrame(geometry=geoms, crs=src.crs)
+    statistics = stats.compute_zonal_stats(geometries, raster, bands=bands, stats=["mean", "std"])
+    for i, band in enumerate(bands):
+        for stat in ["mean", "std"]:
+            geometries[f"b{band}.{stat}"] = [geom_stats[i][stat] for geom_stats in statistics]
+
+    # process the image in several strips
+    monkeypatch.setattr(stats, "STRIP_HEIGHT", 50)
+    utils4test.create_outdir()
+    outliers_image = utils4test.outdir + "outliers.tif"
+    stats.extract_zonal_outliers(geometries, raster, outliers_image, bands=bands, sigma=1)
+
+    # zone of every pixel (last geometry wins)
+    labels = vector.rasterize(geometries, raster)
+    with rasterio.open(outliers_image) as dst:
+        for i, band in enumerate(bands):
+            outliers = dst.read(band)
+            inside = (labels >= 0) & (data[i] != nodata)
+            assert (outliers[~inside] == nodata).all()
+
+            mean = geometries[f"b{band}.mean"].to_numpy(dtype=np.float32)[labels[inside]]
+            std = geometries[f"b{band}.std"].to_numpy(dtype=np.float32)[labels[inside]]
+            values = data[i][inside]
+            selected = (values <= mean - std) | (values >= mean + std)
+            assert selected.any() and not selected.all()
+            assert (outliers[inside][selected] == values[selected]).all()
+            assert (outliers[inside][~selected] == mean[~selected].astype(outliers.dtype)).all()
+
+    utils4test.clear_outdir()
+
+
+def test_compute_zonal_stats_streaming_footprint():
+    raster = utils4test.indir + "tif_file.tif"
+    stats_to_compute = DEFAULT_STATS + ["valid", "nodata", "sum", "median"]
+
+    # image with nodata areas that differ between the bands
+    utils4test.create_outdir()
+    image = utils4test.outdir + "nodata.tif"
+    with rasterio.open(raster) as src:
+        profile = src.profile
+        data = src.read()
+    data[0, :100, :] = src.nodata
+    data[1, :50, :] = src.nodata
+    data[:, 300:, 500:] = src.nodata
+    with rasterio.open(image, "w", **profile) as dst:
+        dst.write(data)
+
+    shape = vector.get_raster_shape(image)
+    for img in [raster, image]:
+        statistics = zonal.compute_zonal_stats_streaming(None, img, bands=[1, 2, 3],
+                                                         stats=stats_to_compute,
+                                                         block_size=256)
+        assert statistics == zonal.compute_zonal_stats_streaming(
+            vector.get_raster_shape(img), img, bands=[1, 2, 3], stats=stats_to_compute,
+            block_size=256)
+    assert statistics[0][0]["nodata"] > statistics[0][1]["nodata"] > 0
+    assert statistics[0][2]["nodata"] == 0
+    assert len(shape.index) == 1
+
+    utils4test.clear_outdir()
+
+
+def test_compute_zonal_stats_points():
+    raster = utils4test.indir + "tif_file.tif"
+    stats_to_compute = DEFAULT_STATS + ["valid", "nodata", "median", "mad", "percentile_20",
+                                        "majority", "unique"]
+    bands = [1, 3]
+
+    with rasterio.open(raster) as src:
+        transform = src.transform
+        width, height = src.width, src.height
+    rng = np.random.default_rng(0)
+    cols, rows = rng.uniform(0, width, 500), rng.uniform(0, height, 500)
+    points = [Point(transform * (col, row)) for col, row in zip(cols, rows)]
+    geometries = gpd.GeoDataFrame(geometry=points, crs=src.crs)
+
+    for categorical in [False, True]:
+        statistics = stats.compute_zonal_stats(geometries, raster, bands=bands,
+                                               stats=stats_to_compute, categorical=categorical)
+        # reference: stats computed on the one pixel window of every point
+        items = [([point], "") for point in points]
+        ref = stats._map_geometries(raster, items, bands, stats_to_compute, categorical)
+        assert statistics == ref
+
+    # points on the pixel edges and outside the raster
+    points = [Point(transform * (0, 0)), Point(transform * (10, 20)),
+              Point(transform * (-5, 20))]
+    geometries = gpd.GeoDataFrame(geometry=points, crs=src.crs)
+    statistics = stats.compute_zonal_stats(geometries, raster, bands=bands,
+                                           stats=stats_to_compute)
+    with rasterio.open(raster) as src:
+        data = src.read(bands)
+    for i, (row, col) in enumerate([(0, 0), (20, 10)]):
+        for band_stats, value in zip(statistics[i], data[:, row, col]):
+            assert band_stats["count"] == 1
+            assert band_stats["median"] == band_stats["majority"] == value
+    assert all(band_stats["count"] == 0 and band_stats["mean"] is None
+               for band_stats in statistics[2])
+
+
+def test_gen_stats():
+    from scipy.stats import median_abs_deviation
+
+    stats_to_compute = ["min", "max", "mean", "sum", "std", "median", "range",
+                        "percentile_5", "percentile_50", "percentile_92.5", "mad",
+                        "majority", "minority", "unique"]
+    rng = np.random.default_rng(0)
+    for dtype in ["uint16", "float32", "float64"]:
+        data = (rng.normal(size=(37, 23)) * 20 + 100).round().astype(dtype)
+        dataset = np.ma.MaskedArray(data, mask=rng.random(data.shape) < 0.3)
+        values = {}
+        statistics = stats._gen_stats(dataset, stats_to_compute, True, "", values)
+        statistics.update(stats._gen_stats_cat(dataset, stats_to_compute, True, "", values))
+
+        # intermediate results are computed once and shared by the stats
+        assert "sorted" in values and "unique" in values
+
+        valid = dataset.compressed()
+        keys, counts = np.unique(valid, return_counts=True)
+        ref = {"min": valid.min(), "max": valid.max(), "mean": valid.mean(),
+               "sum": valid.sum(), "std": valid.std(), "median": np.median(valid),
+               "range": valid.max() - valid.min(),
+               "percentile_5": np.percentile(valid, 5),
+               "percentile_50": np.percentile(valid, 50),
+               "percentile_92.5": np.percentile(valid, 92.5),
+               "mad": median_abs_deviation(valid)}
+        ref.update(zip(keys.tolist(), counts.tolist()))
+        ref.update({"majority": keys[np.argmax(counts)], "minority": keys[np.argmin(counts)],
+                    "unique": len(keys)})
+        assert list(statistics) == list(ref)
+        for key, val in ref.items():
+            assert statistics[key] == pytest.approx(float(val), rel=1e-6)
@@ -170,3 +170,37 @@ def test_rasterize():
 def test_crop():
     # tested by test_rasterproduct
     assert True
+
+
+def test_geometry_cache(monkeypatch):
+    geometries = utils4test.indir + "COMMUNE_59xxx.geojson"
+    raster = utils4test.indir + "DSM_PHR_Dunkerque.tif"
+    grid = utils4test.indir + "grid.geojson"
+    other_raster = utils4test.indir + "tif_file.tif"
+
+    references = [vector.reproject(vector.filter(geoms, image, within), image)
+                  for geoms, image in [(geometries, raster), (grid, other_raster)]
+                  for within in [False, True]]
+
+    # the vector file is read once
+    read_file = gpd.read_file
+    calls = []
+
+    def _read_file(*args, **kwargs):
+        calls.append(args)
+        return read_file(*args, **kwargs)
+
+    monkeypatch.setattr(gpd, "read_file", _read_file)
+    caches = [vector.GeometryCache(geometries), vector.GeometryCache(Path(grid))]
+    for _ in range(2):
+        results = [cache.filter(image, within)
+                   for cache, image in zip(caches, [raster, other_raster])
+                   for within in [False, True]]
+        for geoms, ref in zip(results, references):
+            assert list(geoms.columns) == list(ref.columns)
+            assert geoms.crs == ref.crs
+            assert geoms.index.equals(ref.index)
+            assert geoms.geom_equals_exact(ref, 0).all()
+    assert len(calls) == 2
+    assert len(references[0]) == 2
+    assert len(references[2]) == 2
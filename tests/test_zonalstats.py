@@ -3,6 +3,8 @@
 
 import pytest
 import filecmp
+import pandas as pd
+import rasterio
 from pathlib import Path
 from eolab.rastertools import Zonalstats
 from eolab.rastertools import RastertoolConfigurationException
@@ -213,6 +215,50 @@ def test_zonalstats_category(compare, save_gen_as_ref):
     utils4test.clear_outdir()
 
 
+def test_zonalstats_stack():
+    # create output dir and clear its content if any
+    utils4test.create_outdir()
+
+    # stack of 2 rasters of the same grid
+    inputfile = utils4test.indir + "tif_file.tif"
+    with rasterio.open(inputfile) as src:
+        profile = src.profile
+        data = src.read()
+    inputfiles = []
+    for i in range(2):
+        outputfile = utils4test.outdir + f"date{i}.tif"
+        with rasterio.open(outputfile, "w", **profile) as dst:
+            dst.write(data // (i + 1))
+        inputfiles.append(outputfile)
+
+    statistics = "min max mean".split()
+    tool = Zonalstats(statistics).with_stack()
+    tool.with_output(utils4test.outdir)
+    outputs = tool.process_files(inputfiles)
+
+    assert outputs == [utils4test.outdir + "date0-stats-stack.csv"]
+    table = pd.read_csv(outputs[0])
+    assert list(table.columns) == ["zone", "date", "band", "stat", "value"]
+    assert set(table["date"]) == {"date0", "date1"}
+    assert len(table.index) == 2 * len(statistics)
+    assert len(tool.generated_stats) == 2
+
+    # stats of the stack are the stats of each raster
+    for outputfile, geom_stats in zip(inputfiles, tool.generated_stats):
+        ref = Zonalstats(statistics)
+        ref.with_output(utils4test.outdir)
+        ref.process_file(outputfile)
+        for column in ref.generated_stats[0].columns.drop("geometry"):
+            assert geom_stats[column].tolist() == ref.generated_stats[0][column].tolist()
+
+    # outliers can not be computed in stack mode
+    tool = Zonalstats(statistics).with_stack().with_outliers(1.0)
+    with pytest.raises(ValueError):
+        tool.process_files(inputfiles)
+
+    utils4test.clear_outdir()
+
+
 def test_zonalstats_errors():
     # create output dir and clear its content if any
     utils4test.create_outdir()
@@ -228,6 +274,19 @@ def test_zonalstats_errors():
     assert ("Cannot apply a valid threshold when the computation of the valid "
             "stat has not been requested.") in str(err.value)
 
+    # cas 3 - stats that can not be computed in streaming mode
+    with pytest.raises(RastertoolConfigurationException) as err:
+        Zonalstats(["min", "majority"]).with_streaming()
+    assert "can not be computed in streaming mode" in str(err.value)
+
+    with pytest.raises(RastertoolConfigurationException) as err:
+        Zonalstats(["median"]).with_streaming(bins=-1)
+    assert "Number of bins must be positive" in str(err.value)
+
+    with pytest.raises(RastertoolConfigurationException) as err:
+        Zonalstats(["median"]).with_streaming(accuracy=1.5)
+    assert "Accuracy must be in range ]0, 1[" in str(err.value)
+
     utils4test.clear_outdir()
 
 